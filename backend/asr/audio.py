@@ -0,0 +1,156 @@
+"""
+Audio preprocessing — runs before any model or network call.
+
+  bytes ─► validate size ─► decode to 16 kHz mono float32 ─► trim silence ─► normalise gain
+
+PCM WAV is decoded with `wave` + np.frombuffer (no temp files); other
+containers (WebM/Opus, MP3, …) and WAV variants `wave` can't read (float,
+24-bit) are piped through ffmpeg. The duration limit is enforced before the
+samples are held in memory: from the WAV header, or by capping ffmpeg's output.
+Trimming compares frames with the recording's own noise floor (measured before
+any gain), so a quiet mic keeps its speech and noise-only input stays silent.
+Trimming returns a view and gain is applied in place, so the only allocations
+are the decoded buffer and any resampling. An all-silent input comes back as
+an empty array, which callers short-circuit to an empty transcript.
+"""
+
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+from common.config import settings
+
+SAMPLE_RATE = 16000
+FRAME = SAMPLE_RATE // 100          # 10 ms analysis frames for trimming
+DURATION_MARGIN = 0.5               # seconds decoded past asr_max_seconds to tell "too long" apart
+
+
+class AudioError(ValueError):
+    """Audio that can't be decoded."""
+
+
+class AudioTooLarge(AudioError):
+    """Audio over the configured byte or duration limit."""
+
+
+def _too_long() -> AudioTooLarge:
+    return AudioTooLarge(f"Audio longer than {settings.asr_max_seconds:g} s")
+
+
+def _decode_wav(audio_bytes: bytes) -> np.ndarray:
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as wf:
+            channels, width, rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+            if wf.getnframes() > settings.asr_max_seconds * rate:
+                raise _too_long()                      # from the header, before reading samples
+            raw = wf.readframes(wf.getnframes())
+    except (wave.Error, EOFError):
+        return _decode_ffmpeg(audio_bytes)             # float / extensible WAV; ffmpeg reports real damage
+
+    if width == 2:
+        pcm, scale = np.frombuffer(raw, dtype="<i2"), 1 / 32768.0
+    elif width == 4:
+        pcm, scale = np.frombuffer(raw, dtype="<i4"), 1 / 2147483648.0
+    elif width == 1:
+        pcm, scale = np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128, 1 / 128.0
+    else:
+        return _decode_ffmpeg(audio_bytes)             # 24-bit PCM
+
+    if channels > 1:
+        pcm = pcm[: len(pcm) // channels * channels].reshape(-1, channels)
+        audio = pcm.mean(axis=1, dtype=np.float32)
+        audio *= scale
+    else:
+        audio = pcm.astype(np.float32)
+        audio *= scale
+
+    if rate != SAMPLE_RATE and audio.size:
+        n_out = int(round(audio.size * SAMPLE_RATE / rate))
+        audio = np.interp(
+            np.arange(n_out, dtype=np.float64) * (rate / SAMPLE_RATE),
+            np.arange(audio.size, dtype=np.float64),
+            audio,
+        ).astype(np.float32)
+    return audio
+
+
+def _decode_ffmpeg(audio_bytes: bytes) -> np.ndarray:
+    # -t caps the output, so a small but very long compressed file never
+    # expands to hundreds of MB of float32 before being rejected
+    limit = settings.asr_max_seconds + DURATION_MARGIN
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0", "-t", f"{limit:g}",
+             "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+            input=audio_bytes, capture_output=True, check=True, timeout=30,
+        ).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        raise AudioError(f"Could not decode audio: {e}") from e
+    if len(out) > settings.asr_max_seconds * SAMPLE_RATE * 4:
+        raise _too_long()
+    return np.frombuffer(out, dtype="<f4").copy()     # writable, for in-place gain
+
+
+def decode(audio_bytes: bytes) -> np.ndarray:
+    """Decode any supported container to 16 kHz mono float32 in [-1, 1]."""
+    if len(audio_bytes) > settings.asr_max_bytes:
+        raise AudioTooLarge(f"Audio payload exceeds {settings.asr_max_bytes} bytes")
+    if audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+        audio = _decode_wav(audio_bytes)
+    else:
+        audio = _decode_ffmpeg(audio_bytes)
+    if audio.size > settings.asr_max_seconds * SAMPLE_RATE:
+        raise _too_long()
+    return audio
+
+
+def trim_silence(audio: np.ndarray, threshold: float = 0.01, min_threshold: float = 0.001,
+                 noise_ratio: float = 3.0, pad_frames: int = 10) -> np.ndarray:
+    """
+    View of `audio` without leading/trailing silence. A frame is voiced above
+    `noise_ratio` × the noise floor (10th-percentile frame RMS), clamped to
+    [`min_threshold`, `threshold`] RMS: a quiet but clean recording keeps its
+    speech, while hiss has to clear the noise floor and the fixed threshold.
+    """
+    n_frames = audio.size // FRAME
+    if n_frames == 0:
+        return audio[:0]
+    frames = audio[: n_frames * FRAME].reshape(n_frames, FRAME)
+    energy = np.einsum("ij,ij->i", frames, frames) / FRAME
+    floor = float(np.percentile(energy, 10))
+    cutoff = min(threshold * threshold, noise_ratio * noise_ratio * floor)
+    voiced = np.flatnonzero(energy > max(min_threshold * min_threshold, cutoff))
+    if voiced.size == 0:
+        return audio[:0]
+    start = max(0, voiced[0] - pad_frames) * FRAME
+    end = min(n_frames, voiced[-1] + 1 + pad_frames) * FRAME
+    return audio[start:end]
+
+
+def normalize_gain(audio: np.ndarray, target_peak: float = 0.9, max_gain: float = 20.0) -> np.ndarray:
+    """Scale in place so the peak sits at `target_peak` (quiet mics get boosted, capped)."""
+    if audio.size:
+        peak = float(np.max(np.abs(audio)))
+        if peak > 0:
+            audio *= min(max_gain, target_peak / peak)
+    return audio
+
+
+def preprocess(audio_bytes: bytes) -> np.ndarray:
+    """Full pipeline; returns an empty array for silent audio."""
+    return normalize_gain(trim_silence(decode(audio_bytes)))
+
+
+def to_wav(audio: np.ndarray) -> bytes:
+    """Encode float32 16 kHz mono as a compact s16 WAV (for the remote API)."""
+    pcm = np.clip(audio, -1.0, 1.0)
+    pcm *= 32767
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.astype("<i2").tobytes())
+    return buf.getvalue()
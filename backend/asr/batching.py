@@ -0,0 +1,115 @@
+"""
+Micro-batching scheduler for transcription requests.
+
+Requests that arrive within a short window (or until `max_batch` is reached)
+are grouped and handed to a single batched inference call on the engine's
+executor. Results are split back to each caller's future. While one batch
+runs, the next one is already collecting, so under load the model stays busy
+with full batches instead of one utterance at a time.
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger("asr.batching")
+
+QUEUE_DEPTH = Gauge("asr_queue_depth", "Transcription requests waiting for a batch")
+BATCH_SIZE = Histogram("asr_batch_size", "Utterances per batched inference", buckets=(1, 2, 4, 8, 16, 32))
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the scheduler already holds `max_queue` waiting requests."""
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        run_batch: Callable[[list], list],
+        get_executor: Callable[[], Any],
+        window_ms: float = 20.0,
+        max_batch: int = 8,
+        max_queue: int = 64,
+    ):
+        self.run_batch = run_batch
+        self.get_executor = get_executor
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item) -> Any:
+        self._ensure_worker()
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError(f"ASR queue full ({self.max_queue} waiting)")
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future))
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return [(item, fut) for item, fut in batch if not fut.cancelled()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            BATCH_SIZE.observe(len(batch))
+            try:
+                results = await self._loop.run_in_executor(
+                    self.get_executor(), self.run_batch, [item for item, _ in batch]
+                )
+            except Exception as e:
+                logger.warning(f"Batched inference of {len(batch)} failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def close(self):
+        """Stop the worker and fail anything still waiting."""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, fut = self._queue.get_nowait()
+                if not fut.done():
+                    fut.set_exception(RuntimeError("ASR scheduler shut down"))
+        self._worker = self._queue = self._loop = None
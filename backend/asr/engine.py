@@ -0,0 +1,131 @@
+"""
+Local Whisper engine — openai-whisper on CPU, loaded lazily on first use and
+kept resident. Optional int8 dynamic quantisation of the Linear layers
+(~2x faster, ~1/4 the weight memory). Inference runs on a dedicated
+single-thread executor so the event loop is never blocked and the model is
+never entered concurrently.
+
+Utterances that fit in one 30 s Whisper window go through a micro-batching
+scheduler (asr/batching.py): concurrent requests are padded to the window and
+decoded together in one forward pass. Longer audio uses model.transcribe.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.config import settings
+from asr.batching import MicroBatcher
+
+logger = logging.getLogger("asr.engine")
+
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 30 * SAMPLE_RATE          # Whisper's fixed input window
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".whisper_cache")
+
+_executor = None
+_model = None
+_model_lock = threading.Lock()
+
+
+def whisper_available() -> bool:
+    return importlib.util.find_spec("whisper") is not None
+
+
+def use_local_engine() -> bool:
+    """`asr_engine` = local | remote | auto (local when openai-whisper is installed)."""
+    engine = settings.asr_engine.lower()
+    if engine == "auto":
+        return whisper_available()
+    return engine == "local"
+
+
+def model_loaded() -> bool:
+    return _model is not None
+
+
+def _load_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            import torch
+            import whisper
+
+            torch.set_num_threads(settings.whisper_threads)
+            model = whisper.load_model(settings.whisper_model, device="cpu", download_root=CACHE_DIR)
+            if settings.whisper_int8:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
+            _model = model
+            logger.info(f"Whisper '{settings.whisper_model}' loaded (int8={settings.whisper_int8})")
+    return _model
+
+
+def _transcribe_sync(audio: np.ndarray) -> dict:
+    model = _load_model()
+    result = model.transcribe(audio, language="en", fp16=False, condition_on_previous_text=False)
+    return {
+        "text": result["text"].strip(),
+        "language": result.get("language", "en"),
+        "segments": [
+            {"id": s["id"], "start": s["start"], "end": s["end"], "text": s["text"].strip()}
+            for s in result.get("segments", [])
+        ],
+    }
+
+
+def _transcribe_batch_sync(audios: list[np.ndarray]) -> list[dict]:
+    import torch
+    import whisper
+
+    model = _load_model()
+    n_mels = getattr(model.dims, "n_mels", 80)
+    mels = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(a), n_mels) for a in audios])
+    options = whisper.DecodingOptions(language="en", fp16=False, without_timestamps=True)
+    with torch.inference_mode():
+        results = whisper.decode(model, mels, options)
+    return [
+        {
+            "text": r.text.strip(),
+            "language": r.language or "en",
+            "segments": [{"id": 0, "start": 0.0, "end": round(len(a) / SAMPLE_RATE, 3), "text": r.text.strip()}],
+        }
+        for a, r in zip(audios, results)
+    ]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+    return _executor
+
+
+async def transcribe_local(audio: np.ndarray) -> dict:
+    """Transcribe preprocessed 16 kHz mono float32 audio (see asr/audio.py)."""
+    loop = asyncio.get_running_loop()
+    if len(audio) <= WINDOW_SAMPLES:
+        return await batcher.submit(audio)
+    return await loop.run_in_executor(_get_executor(), _transcribe_sync, audio)
+
+
+batcher = MicroBatcher(
+    _transcribe_batch_sync,
+    _get_executor,
+    window_ms=settings.asr_batch_window_ms,
+    max_batch=settings.asr_max_batch,
+    max_queue=settings.asr_max_queue,
+)
+
+
+async def shutdown_engine():
+    global _executor
+    await batcher.close()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
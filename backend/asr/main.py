@@ -1,16 +1,23 @@
 """
-ASR Microservice — Whisper via HuggingFace Inference API (free tier)
-No local model loading — stays within 512MB RAM limit on Render free tier.
+ASR Microservice — Whisper via HuggingFace Inference API (free tier), or an
+in-process Whisper engine (`ASR_ENGINE=local`) for deployments with spare CPU.
+The remote API stays as the fallback when local inference fails.
 """
 
 import logging
 import os
 import asyncio
+from typing import Optional
 
-import httpx
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 
+from common.config import settings
+from common.http import get_client, HUGGINGFACE
+from asr.streaming import VADSegmenter, Segment, StreamDecoder, decoder_available, is_container, pcm_to_wav
+from asr.engine import transcribe_local, use_local_engine, model_loaded, batcher
+from asr.audio import AudioError, AudioTooLarge, preprocess, to_wav
+
 logger = logging.getLogger("asr")
 logging.basicConfig(level=logging.INFO)
 
@@ -28,23 +35,53 @@ HF_ASR_URL = "https://api-inference.huggingface.co/models/facebook/wav2vec2-base
 
 async def transcribe_hf(audio_bytes: bytes) -> dict:
     """Transcribe using HuggingFace Whisper API — no local model needed."""
-    async with httpx.AsyncClient(timeout=30) as client:
+    client = get_client(HUGGINGFACE)
+    resp = await client.post(
+        HF_ASR_URL,
+        headers={"Authorization": f"Bearer {HF_TOKEN}"},
+        content=audio_bytes,
+    )
+    if resp.status_code == 503:
+        await asyncio.sleep(10)
         resp = await client.post(
             HF_ASR_URL,
             headers={"Authorization": f"Bearer {HF_TOKEN}"},
             content=audio_bytes,
         )
-        if resp.status_code == 503:
-            await asyncio.sleep(10)
-            resp = await client.post(
-                HF_ASR_URL,
-                headers={"Authorization": f"Bearer {HF_TOKEN}"},
-                content=audio_bytes,
-            )
-        resp.raise_for_status()
-        result = resp.json()
-        text = result.get("text", "").strip()
-        return {"text": text, "language": "en", "segments": []}
+    resp.raise_for_status()
+    result = resp.json()
+    text = result.get("text", "").strip()
+    return {"text": text, "language": "en", "segments": []}
+
+
+async def _preprocess(audio_bytes: bytes):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, preprocess, audio_bytes)
+
+
+async def transcribe_whisper(audio_bytes: bytes) -> dict:
+    """Transcribe in-process with the local Whisper engine."""
+    audio = await _preprocess(audio_bytes)
+    if audio.size == 0:
+        return _rule_based_transcribe()
+    return await transcribe_local(audio)
+
+
+async def transcribe(audio_bytes: bytes) -> dict:
+    """
+    Preprocess (decode → 16 kHz mono, trim, gain), then route to the configured
+    engine; local failures fall back to the HF API. Silent audio never reaches
+    a model. Raises AudioError for undecodable or oversized input.
+    """
+    audio = await _preprocess(audio_bytes)
+    if audio.size == 0:
+        return _rule_based_transcribe()
+    if use_local_engine():
+        try:
+            return await transcribe_local(audio)
+        except Exception as e:
+            logger.warning(f"Local Whisper failed: {e}. Falling back to HF API.")
+    return await transcribe_hf(to_wav(audio))
 
 
 def _rule_based_transcribe() -> dict:
@@ -55,32 +92,104 @@ def _rule_based_transcribe() -> dict:
 async def health():
     return {
         "status": "ok",
-        "mode": "huggingface-api",
+        "mode": "local-whisper" if use_local_engine() else "huggingface-api",
+        "model_loaded": model_loaded(),
+        "queue_depth": batcher.depth,
         "hf_token_set": bool(HF_TOKEN),
     }
 
 
 @app.post("/transcribe")
 async def transcribe_file(request: Request):
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.asr_max_bytes:
+        raise HTTPException(status_code=413, detail=f"Audio payload exceeds {settings.asr_max_bytes} bytes")
     audio_data = await request.body()
     if not audio_data:
         raise HTTPException(status_code=400, detail="Empty audio payload.")
     try:
-        result = await transcribe_hf(audio_data)
+        result = await transcribe(audio_data)
         return {"success": True, **result}
+    except AudioTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AudioError as e:
+        # Undecodable input is the client's problem, not a crash: empty transcript.
+        logger.info(f"Rejected audio: {e}")
+        return {"success": False, "error": str(e), **_rule_based_transcribe()}
     except Exception as e:
-        logger.error(f"HF ASR failed: {e}")
+        logger.error(f"ASR failed: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"ASR failed: {e}"
         )
 
 
+def _stitch(texts: list[Optional[str]]) -> str:
+    return " ".join(t for t in texts if t)
+
+
 @app.websocket("/ws")
 async def websocket_asr(ws: WebSocket):
+    """
+    Streaming recognition. Client sends audio as binary frames, then the text
+    "DONE". Frames are either raw 16 kHz mono s16le PCM or a container stream
+    (MediaRecorder WebM/Opus chunks, detected from the first bytes), which is
+    decoded to PCM by ffmpeg as it arrives. Speech segments are transcribed as
+    soon as the VAD closes them, each one producing a `partial`; the `final`
+    message is stitched from the segments, so after DONE only the last segment
+    is still in flight. Without ffmpeg, a container stream is buffered and
+    transcribed whole at DONE.
+    """
     await ws.accept()
     logger.info("WebSocket ASR session opened.")
-    buffer = bytearray()
+    segmenter = VADSegmenter()
+    received = 0
+    texts: list[Optional[str]] = []
+    spans: list[dict] = []
+    tasks: list[asyncio.Task] = []
+    mode: Optional[str] = None              # pcm | decode | buffer, fixed by the first frame
+    decoder: Optional[StreamDecoder] = None
+    pump: Optional[asyncio.Task] = None
+    buffered = bytearray()
+
+    async def _recognise(segment: Segment):
+        try:
+            result = await transcribe(pcm_to_wav(segment.pcm))
+        except Exception as e:
+            logger.warning(f"Segment {segment.index} transcription failed: {e}")
+            result = _rule_based_transcribe()
+        texts[segment.index] = result["text"]
+        spans[segment.index]["text"] = result["text"]
+        await ws.send_json({
+            "type": "partial",
+            "text": _stitch(texts),
+            "segment": spans[segment.index],
+        })
+
+    def _start(segments: list[Segment]):
+        for segment in segments:
+            texts.append(None)
+            spans.append({"id": segment.index, "start": segment.start, "end": segment.end, "text": ""})
+            tasks.append(asyncio.create_task(_recognise(segment)))
+
+    async def _pump_decoded():
+        while pcm := await decoder.read():
+            _start(segmenter.feed(pcm))
+
+    async def _final() -> dict:
+        if mode == "buffer":
+            try:
+                return await transcribe(bytes(buffered))
+            except Exception as e:
+                logger.warning(f"Stream transcription failed: {e}")
+                return _rule_based_transcribe()
+        if mode == "decode":
+            await decoder.end_input()
+            await pump
+        _start(segmenter.flush())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return {"text": _stitch(texts), "language": "en", "segments": spans}
 
     try:
         while True:
@@ -89,16 +198,41 @@ async def websocket_asr(ws: WebSocket):
                 break
             if msg["type"] == "websocket.receive":
                 if "bytes" in msg and msg["bytes"]:
-                    buffer.extend(msg["bytes"])
-                    if len(buffer) >= 8000:
-                        await ws.send_json({"type": "partial", "text": "..."})
+                    data = msg["bytes"]
+                    received += len(data)
+                    if received > settings.asr_max_bytes:
+                        await ws.send_json({"type": "error", "detail": "Audio stream too large."})
+                        await ws.close(code=1009)
+                        break
+                    if mode is None:
+                        mode = "pcm"
+                        if is_container(data):
+                            mode = "decode" if decoder_available() else "buffer"
+                        if mode == "decode":
+                            decoder = StreamDecoder()
+                            await decoder.start()
+                            pump = asyncio.create_task(_pump_decoded())
+                    if mode == "decode":
+                        await decoder.write(data)
+                    elif mode == "buffer":
+                        buffered.extend(data)
+                    else:
+                        _start(segmenter.feed(data))
                 elif "text" in msg and msg["text"] == "DONE":
-                    if buffer:
-                        try:
-                            result = await transcribe_hf(bytes(buffer))
-                        except Exception:
-                            result = _rule_based_transcribe()
-                        await ws.send_json({"type": "final", **result})
-                    buffer.clear()
+                    await ws.send_json({"type": "final", **await _final()})
+                    if decoder is not None:
+                        await decoder.close()
+                    segmenter = VADSegmenter()
+                    received = 0
+                    texts, spans, tasks = [], [], []
+                    mode, decoder, pump = None, None, None
+                    buffered = bytearray()
     except WebSocketDisconnect:
         logger.info("WebSocket ASR session closed.")
+    finally:
+        for task in tasks:
+            task.cancel()
+        if pump is not None:
+            pump.cancel()
+        if decoder is not None:
+            await decoder.close()
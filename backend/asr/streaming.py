@@ -0,0 +1,210 @@
+"""
+Streaming ASR helpers — energy-based voice-activity segmentation of 16 kHz
+mono s16le PCM, so each utterance segment can be transcribed while the
+speaker is still talking.
+
+Browsers stream MediaRecorder chunks (WebM/Opus), not PCM; `StreamDecoder`
+pipes such a container stream through one long-lived ffmpeg process and
+yields PCM as it is decoded, so the VAD always sees samples.
+"""
+
+import asyncio
+import io
+import shutil
+import wave
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from common.config import settings
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2          # bytes per s16le sample
+_CONTAINER_MAGIC = (b"\x1aE\xdf\xa3", b"OggS", b"RIFF", b"fLaC")
+
+
+def is_container(head: bytes) -> bool:
+    """True if the first bytes of a stream look like an audio container (WebM, Ogg, WAV, MP4, …)."""
+    return head[:4] in _CONTAINER_MAGIC or head[:3] == b"ID3" or head[4:8] == b"ftyp"
+
+
+def decoder_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+class StreamDecoder:
+    """Incremental container → 16 kHz mono s16le decoding through one ffmpeg process."""
+
+    def __init__(self):
+        self._proc: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+    async def write(self, data: bytes):
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass                                    # ffmpeg gave up on the input; read() hits EOF
+
+    async def read(self, n: int = 8192) -> bytes:
+        """Next decoded PCM; b"" once the input is closed and fully decoded."""
+        return await self._proc.stdout.read(n)
+
+    async def end_input(self):
+        if not self._proc.stdin.is_closing():
+            self._proc.stdin.close()
+
+    async def close(self):
+        if self._proc is None:
+            return
+        if self._proc.returncode is None:
+            self._proc.kill()
+        await self._proc.wait()
+        self._proc = None
+
+
+@dataclass
+class Segment:
+    index: int
+    start: float          # seconds from the start of the stream
+    end: float
+    pcm: bytes
+
+
+def pcm_to_wav(pcm: bytes, rate: int = SAMPLE_RATE) -> bytes:
+    """Wrap raw s16le mono PCM in a WAV container for recognisers that expect files."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(SAMPLE_WIDTH)
+        wf.setframerate(rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+class VADSegmenter:
+    """
+    Splits a PCM stream into speech segments.
+
+    Audio is cut into fixed frames; a frame is speech when its RMS exceeds
+    max(threshold, 3 × running noise floor). A segment closes after
+    `silence_ms` of non-speech or once it reaches `max_segment_s`. Segments
+    shorter than `min_speech_ms` (clicks, breaths) are dropped.
+    """
+
+    def __init__(
+        self,
+        frame_ms: int = 30,
+        silence_ms: Optional[int] = None,
+        threshold: Optional[float] = None,
+        max_segment_s: Optional[float] = None,
+        min_speech_ms: int = 200,
+        pad_ms: int = 150,
+    ):
+        self.frame_bytes = SAMPLE_RATE * frame_ms // 1000 * SAMPLE_WIDTH
+        self.frame_s = frame_ms / 1000
+        silence_ms = settings.asr_vad_silence_ms if silence_ms is None else silence_ms
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.threshold = settings.asr_vad_threshold if threshold is None else threshold
+        max_segment_s = settings.asr_max_segment_s if max_segment_s is None else max_segment_s
+        self.max_frames = max(1, int(max_segment_s / self.frame_s))
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.pad_frames = pad_ms // frame_ms
+
+        self._pending = bytearray()         # bytes not yet forming a whole frame
+        self._pre_roll: list[bytes] = []    # recent silence, prepended to the next segment
+        self._frames: list[bytes] = []      # current segment
+        self._speech_frames = 0
+        self._trailing_silence = 0
+        self._frame_no = 0
+        self._segment_start = 0
+        self._noise = 0.0
+        self._next_index = 0
+
+    def _is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+        speech = rms > max(self.threshold, 3.0 * self._noise)
+        if not speech:
+            self._noise = 0.95 * self._noise + 0.05 * rms
+        return speech
+
+    def feed(self, data: bytes) -> list[Segment]:
+        """Consume PCM bytes; return every segment that finished inside them."""
+        self._pending.extend(data)
+        done = []
+        n_whole = len(self._pending) // self.frame_bytes * self.frame_bytes
+        view = memoryview(self._pending)[:n_whole]
+        for off in range(0, n_whole, self.frame_bytes):
+            segment = self._push(bytes(view[off:off + self.frame_bytes]))
+            if segment is not None:
+                done.append(segment)
+        view.release()
+        del self._pending[:n_whole]
+        return done
+
+    def _push(self, frame: bytes) -> Optional[Segment]:
+        speech = self._is_speech(frame)
+        self._frame_no += 1
+
+        if not self._frames:
+            if not speech:
+                self._pre_roll.append(frame)
+                if len(self._pre_roll) > self.pad_frames:
+                    self._pre_roll.pop(0)
+                return None
+            self._segment_start = self._frame_no - 1 - len(self._pre_roll)
+            self._frames = self._pre_roll + [frame]
+            self._pre_roll = []
+            self._speech_frames = 1
+            self._trailing_silence = 0
+            return None
+
+        self._frames.append(frame)
+        if speech:
+            self._speech_frames += 1
+            self._trailing_silence = 0
+        else:
+            self._trailing_silence += 1
+
+        if self._trailing_silence >= self.silence_frames or len(self._frames) >= self.max_frames:
+            return self._close()
+        return None
+
+    def _close(self) -> Optional[Segment]:
+        frames, speech, silence = self._frames, self._speech_frames, self._trailing_silence
+        self._frames, self._speech_frames, self._trailing_silence = [], 0, 0
+        if speech < self.min_speech_frames:
+            return None
+        trim = max(0, silence - self.pad_frames)       # keep only `pad_ms` of trailing silence
+        if trim:
+            frames = frames[:-trim]
+        segment = Segment(
+            index=self._next_index,
+            start=round(self._segment_start * self.frame_s, 3),
+            end=round((self._segment_start + len(frames)) * self.frame_s, 3),
+            pcm=b"".join(frames),
+        )
+        self._next_index += 1
+        return segment
+
+    def flush(self) -> list[Segment]:
+        """End of stream: close whatever segment is still open."""
+        done = []
+        if self._pending:
+            self._pending.extend(b"\x00" * (self.frame_bytes - len(self._pending)))
+            done.extend(self.feed(b""))
+        if self._frames:
+            segment = self._close()
+            if segment is not None:
+                done.append(segment)
+        return done
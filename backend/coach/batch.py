@@ -0,0 +1,66 @@
+"""
+Packed coaching prompts — several transcripts answered by one LLM call.
+
+The model is asked for a JSON array with one object per numbered transcript.
+Parsing is per object rather than per array, so a response cut short by the
+token limit still yields every item that was completed; anything missing or
+malformed is left for the caller to retry on its own.
+"""
+
+import json
+import re
+from typing import Optional
+
+PACK_SYSTEM_PROMPT = """You are an encouraging English speaking coach for non-native speakers.
+You will receive several numbered transcripts from students. Respond with a JSON array
+containing one object per transcript, in the same order:
+[
+  {
+    "id": <the transcript number>,
+    "correction": "Corrected version of their sentence (if needed, else null)",
+    "explanation": "Brief, friendly grammar/pronunciation note (1 sentence)",
+    "vocabulary": ["up to 2 better word suggestions if applicable"],
+    "encouragement": "A short motivating sentence",
+    "score": <integer 1-10 fluency estimate>,
+    "tags": ["error_type tags like: grammar, pronunciation, vocabulary, fluency"]
+  }
+]
+Rules: be positive, keep each object under 120 words, use simple English, output only the array."""
+
+TOKENS_PER_ITEM = 200
+
+
+def build_pack_prompt(transcripts: list[str], level: str) -> tuple[str, str]:
+    """(system, user) messages for one pack."""
+    numbered = "\n".join(f'{i}. "{t}"' for i, t in enumerate(transcripts, 1))
+    return f"{PACK_SYSTEM_PROMPT}\nStudent level: {level}", f"Transcripts:\n{numbered}"
+
+
+def _feedback(obj: dict) -> Optional[dict]:
+    try:
+        score = min(10, max(1, int(obj["score"])))
+        return {
+            "correction": obj.get("correction") or None,
+            "explanation": str(obj["explanation"]),
+            "vocabulary": [str(v) for v in obj.get("vocabulary") or []],
+            "encouragement": str(obj["encouragement"]),
+            "score": score,
+            "tags": [str(t) for t in obj.get("tags") or []],
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_pack_output(generated: str, n: int) -> dict[int, dict]:
+    """{0-based item index: feedback} for every well-formed object in the output."""
+    results: dict[int, dict] = {}
+    for match in re.finditer(r"\{[^{}]*\}", generated):
+        try:
+            obj = json.loads(match.group())
+            idx = int(obj["id"]) - 1
+        except (ValueError, KeyError, TypeError):
+            continue
+        feedback = _feedback(obj)
+        if 0 <= idx < n and feedback is not None and idx not in results:
+            results[idx] = feedback
+    return results
@@ -0,0 +1,139 @@
+"""
+Content-addressed cache for coaching feedback.
+
+Learners repeat the same drill sentences constantly, so LLM feedback is cached
+under sha256(normalized transcript | level | prompt version):
+  • in-memory LRU with a TTL (hot drills)
+  • optional on-disk tier, one JSON file per key, that survives restarts
+Only real LLM answers are cached — never the rule-based fallback.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from prometheus_client import Counter
+
+from common.config import settings
+
+logger = logging.getLogger("coach.cache")
+
+CACHE_HITS = Counter("coach_cache_hits_total", "Coach feedback cache hits", ["tier"])
+CACHE_MISSES = Counter("coach_cache_misses_total", "Coach feedback cache misses")
+
+
+def normalize_transcript(text: str) -> str:
+    """Case/whitespace-insensitive form used for the cache key."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(".!?… ")
+
+
+def prompt_version(prompt: str) -> str:
+    """Short digest of a system prompt — editing the prompt invalidates old entries."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class FeedbackCache:
+    """LRU + TTL memory tier in front of an optional content-addressed disk tier."""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 86400.0, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._mem: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(transcript: str, level: str, version: str) -> str:
+        raw = f"{normalize_transcript(transcript)}\x1f{level}\x1f{version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        entry = self._mem.get(key)
+        if entry is not None:
+            stored_at, feedback = entry
+            if now - stored_at < self.ttl:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                CACHE_HITS.labels(tier="memory").inc()
+                return copy.deepcopy(feedback)
+            del self._mem[key]
+
+        feedback = self._disk_get(key, now)
+        if feedback is not None:
+            self._remember(key, feedback, now)
+            self.disk_hits += 1
+            CACHE_HITS.labels(tier="disk").inc()
+            return copy.deepcopy(feedback)
+
+        self.misses += 1
+        CACHE_MISSES.inc()
+        return None
+
+    def put(self, key: str, feedback: dict):
+        now = time.time()
+        self._remember(key, copy.deepcopy(feedback), now)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(feedback))
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def _remember(self, key: str, feedback: dict, stored_at: float):
+        self._mem[key] = (stored_at, feedback)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if now - path.stat().st_mtime >= self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def clear(self):
+        self._mem.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._mem),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+feedback_cache = FeedbackCache(
+    max_entries=settings.coach_cache_size,
+    ttl=settings.coach_cache_ttl,
+    disk_dir=settings.coach_cache_dir or None,
+)
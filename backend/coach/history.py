@@ -0,0 +1,66 @@
+"""
+Keyset-paginated coaching history.
+
+Pages are ordered newest first by (created_at, id) and continue from an opaque
+cursor — the key of the last row served — rather than an OFFSET, so every page
+is one range read on idx_sessions_user_created no matter how far back it is.
+The export walks the same pages and yields rows one at a time, so memory stays
+constant however long the history is.
+"""
+
+import base64
+import json
+from typing import AsyncIterator, Optional
+
+from common.db import execute
+
+HISTORY_COLUMNS = "id,transcript,correction,score,tags,created_at"
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return str(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise BadCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+async def history_page(
+    user_id: str, limit: int, cursor: Optional[str] = None, columns: str = HISTORY_COLUMNS,
+) -> tuple[list[dict], Optional[str]]:
+    """(up to `limit` sessions older than `cursor`, cursor for the next page or None)."""
+    key = decode_cursor(cursor) if cursor else None
+
+    def build(sb):
+        q = sb.table("coaching_sessions").select(columns).eq("user_id", user_id)
+        if key is not None:
+            created_at, row_id = key
+            q = q.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+        return q.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+
+    rows = await execute(build) or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+async def export_history(user_id: str, page_size: int) -> AsyncIterator[dict]:
+    """Every session of the user, newest first, fetched `page_size` rows at a time."""
+    cursor = None
+    while True:
+        rows, cursor = await history_page(user_id, page_size, cursor)
+        for row in rows:
+            yield row
+        if cursor is None:
+            return
@@ -1,44 +1,50 @@
 """
-Coaching Engine — LLaMA-3-8B-Instruct via Hugging Face Inference API (free tier)
+Coaching Engine — LLaMA-3-8B-Instruct / Mistral-7B via Hugging Face Inference
+API (free tier) and LLaMA-3 on Groq, routed by coach/router.py
 Endpoint: POST /coach
 Input:  { user_id, transcript, lesson_context? }
 Output: { correction, vocabulary, encouragement, score, tags }
+Batch:  POST /coach/batch → NDJSON, one line per item as it completes
+Stream: POST /coach/stream → SSE, one event per field as the model finishes it
 Progress stored in Supabase.
 
 FIX: Updated HF Inference API URL to the v2 serverless endpoint format.
      Added Mistral-7B as fallback if LLaMA-3 is unavailable.
+     Providers are hedged and circuit-broken instead of tried one after another.
 """
 
+import asyncio
+import json
 import logging
-import os
 import re
 from datetime import datetime
-from typing import Optional
+from typing import Any, AsyncIterator, Optional
 
-import httpx
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from prometheus_client import Counter
+from pydantic import BaseModel, ValidationError
 
-from common.db import get_supabase
+from common.profiles import profile_cache
 from common.config import settings
+from coach.cache import feedback_cache, prompt_version
+from coach.batch import TOKENS_PER_ITEM, build_pack_prompt, parse_pack_output
+from coach.streaming import FieldStream, sse
+from coach.router import AllProvidersFailed, HF_TOKEN, GROQ_API_KEY, router
+from coach.rules import rule_engine
+from coach.sessions import session_writer
+from coach.history import BadCursor, export_history, history_page
+from coach.progress import get_progress
 
 logger = logging.getLogger("coach")
 logging.basicConfig(level=logging.INFO)
 
+RULES_FAST_PATH = Counter("coach_rules_fast_path_total", "Feedback answered by the rule engine without an LLM call")
+
 app = FastAPI(title="Coaching Engine", version="1.0.0")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
-HF_API_URL = (
-    "https://api-inference.huggingface.co/models/"
-    "meta-llama/Meta-Llama-3-8B-Instruct"
-)
-HF_FALLBACK_URL = (
-    "https://api-inference.huggingface.co/models/"
-    "mistralai/Mistral-7B-Instruct-v0.3"
-)
-HF_TOKEN = os.getenv("HF_TOKEN", "")
-
 SYSTEM_PROMPT = """You are an encouraging English speaking coach for non-native speakers.
 Analyze the student's spoken transcript and respond with a JSON object containing:
 {
@@ -50,105 +56,174 @@ Analyze the student's spoken transcript and respond with a JSON object containin
   "tags": ["error_type tags like: grammar, pronunciation, vocabulary, fluency"]
 }
 Rules: be positive, keep total output under 120 words, use simple English."""
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT)
 
 
-async def _call_hf(url: str, prompt: str) -> dict:
-    async with httpx.AsyncClient(timeout=25) as client:
-        resp = await client.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {HF_TOKEN}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": 220,
-                    "temperature": 0.3,
-                    "return_full_text": False,
-                    "stop": ["<|eot_id|>", "</s>", "[/INST]"],
-                },
-            },
-        )
-        if resp.status_code == 503:
-            raise RuntimeError("Model loading (503) — retry later.")
-        resp.raise_for_status()
-        raw = resp.json()
-        generated = raw[0]["generated_text"] if isinstance(raw, list) else raw.get("generated_text", "")
-        match = re.search(r'\{.*?\}', generated, re.DOTALL)
-        if not match:
-            raise ValueError(f"No JSON in LLM response: {generated[:200]}")
-        import json
-        return json.loads(match.group())
+def _extract_json(generated: str) -> dict:
+    match = re.search(r'\{.*?\}', generated, re.DOTALL)
+    if not match:
+        raise ValueError(f"No JSON in LLM response: {generated[:200]}")
+    return json.loads(match.group())
+
+
+def _messages(transcript: str, level: str) -> tuple[str, str]:
+    return f"{SYSTEM_PROMPT}\nStudent level: {level}", f'Transcript: "{transcript}"'
 
 
 async def call_llama(transcript: str, level: str = "beginner") -> dict:
-    prompt = (
-        f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n"
-        f"{SYSTEM_PROMPT}\nStudent level: {level}<|eot_id|>\n"
-        f"<|start_header_id|>user<|end_header_id|>\n"
-        f'Transcript: "{transcript}"<|eot_id|>\n'
-        f"<|start_header_id|>assistant<|end_header_id|>\n"
-    )
+    cache_key = feedback_cache.key(transcript, level, PROMPT_VERSION)
+    cached = feedback_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    fast = _rules_fast_path(transcript)
+    if fast is not None:
+        return fast
+
+    try:
+        result = await router.generate(*_messages(transcript, level), parse=_extract_json)
+    except AllProvidersFailed as e:
+        logger.warning(f"All LLM providers failed ({e}) — using rule-based fallback.")
+        return _rule_based_feedback(transcript)
+    feedback_cache.put(cache_key, result)
+    return result
+
+
+async def stream_feedback(transcript: str, level: str = "beginner") -> AsyncIterator[tuple[str, Any]]:
+    """
+    (field, value) pairs in the order the LLM completes them. Cached feedback
+    is replayed at once. If the stream breaks, or never yields a field,
+    whatever is missing comes from the rule engine, so every field is always
+    produced exactly once.
+    """
+    cache_key = feedback_cache.key(transcript, level, PROMPT_VERSION)
+    cached = feedback_cache.get(cache_key)
+    if cached is not None:
+        for field in FEEDBACK_FIELDS:
+            yield field, cached.get(field)
+        return
+    fast = _rules_fast_path(transcript)
+    if fast is not None:
+        for field in FEEDBACK_FIELDS:
+            yield field, fast[field]
+        return
+
+    got: dict[str, Any] = {}
+    parser = FieldStream()
+    tokens = router.stream(*_messages(transcript, level))
+    try:
+        async for token in tokens:
+            for field, value in parser.feed(token):
+                if field in FEEDBACK_FIELDS and field not in got:
+                    got[field] = value
+                    yield field, value
+            if parser.done:
+                break
+    except Exception as e:
+        logger.warning(f"LLM stream failed after {len(got)} fields: {e}")
+    finally:
+        await tokens.aclose()
 
-    for url, label in [(HF_API_URL, "LLaMA-3"), (HF_FALLBACK_URL, "Mistral-7B")]:
+    if parser.done and all(field in got for field in FEEDBACK_FIELDS):
         try:
-            result = await _call_hf(url, prompt)
-            logger.info(f"Coach response via {label}")
-            return result
-        except Exception as e:
-            logger.warning(f"{label} failed: {e}. Trying next…")
+            feedback_cache.put(cache_key, CoachResponse(**got).model_dump())
+        except ValueError:
+            pass
+        return
+    fallback = _rule_based_feedback(transcript)
+    for field in FEEDBACK_FIELDS:
+        if field not in got:
+            yield field, fallback[field]
+
+
+async def call_llama_pack(transcripts: list[str], level: str) -> list[dict]:
+    """
+    Feedback for several same-level transcripts from one LLM call. Items the
+    model dropped or mangled are retried individually; if the pack call fails
+    outright, every item gets rule-based feedback. Transcripts the rule
+    engine is confident about never reach the LLM.
+    """
+    results: dict[int, dict] = {}
+    for i, transcript in enumerate(transcripts):
+        fast = _rules_fast_path(transcript)
+        if fast is not None:
+            results[i] = fast
+    if len(results) == len(transcripts):
+        return [results[i] for i in range(len(transcripts))]
+    todo = [i for i in range(len(transcripts)) if i not in results]
+    pending = [transcripts[i] for i in todo]
+
+    def parse(generated: str) -> dict[int, dict]:
+        parsed = parse_pack_output(generated, len(pending))
+        if not parsed:
+            raise ValueError(f"No usable items in packed response: {generated[:200]}")
+        return parsed
 
-    logger.warning("All LLM endpoints failed — using rule-based fallback.")
-    return _rule_based_feedback(transcript)
+    try:
+        parsed = await router.generate(
+            *build_pack_prompt(pending, level),
+            max_tokens=TOKENS_PER_ITEM * len(pending),
+            parse=parse,
+        )
+    except AllProvidersFailed as e:
+        logger.warning(f"Pack of {len(pending)} failed on every provider ({e}) — using rule-based fallback.")
+        parsed = {}
+        results.update({i: _rule_based_feedback(transcripts[i]) for i in todo})
+    else:
+        logger.info(f"Packed coach response: {len(parsed)}/{len(pending)} items")
+
+    for j, feedback in parsed.items():
+        results[todo[j]] = feedback
+        feedback_cache.put(feedback_cache.key(pending[j], level, PROMPT_VERSION), feedback)
+    missing = [i for i in todo if i not in results]
+    for i, feedback in zip(missing, await asyncio.gather(*(call_llama(transcripts[i], level) for i in missing))):
+        results[i] = feedback
+    return [results[i] for i in range(len(transcripts))]
 
 
 def _rule_based_feedback(transcript: str) -> dict:
-    tags = []
-    word_count = len(transcript.split())
+    return rule_engine.check(transcript).feedback
 
-    correction = None
-    if re.search(r'\b(i is|he are|she are|they is)\b', transcript, re.I):
-        tags.append("grammar")
-        correction = re.sub(r'\bi is\b', 'I am', transcript, flags=re.I)
 
-    if word_count < 5:
-        tags.append("fluency")
-
-    return {
-        "correction": correction,
-        "explanation": "Keep practicing — every sentence makes you better!",
-        "vocabulary": [],
-        "encouragement": "Great effort! You're improving every day. 🎉",
-        "score": min(10, max(1, word_count // 2)),
-        "tags": tags or ["fluency"],
-    }
+def _rules_fast_path(transcript: str) -> Optional[dict]:
+    """Rule-engine feedback when it is confident enough to skip the LLM."""
+    check = rule_engine.check(transcript)
+    if check.confidence >= settings.coach_rules_threshold:
+        RULES_FAST_PATH.inc()
+        return check.feedback
+    return None
 
 
 async def save_session(user_id: str, transcript: str, feedback: dict):
-    try:
-        supabase = get_supabase()
-        supabase.table("coaching_sessions").insert({
-            "user_id": user_id,
-            "transcript": transcript,
-            "correction": feedback.get("correction"),
-            "score": feedback.get("score"),
-            "tags": feedback.get("tags", []),
-            "created_at": datetime.utcnow().isoformat(),
-        }).execute()
-    except Exception as e:
-        logger.error(f"Supabase insert failed: {e}")
+    """Queue the session row; coach/sessions.py writes it in the background."""
+    session_writer.enqueue({
+        "user_id": user_id,
+        "transcript": transcript,
+        "correction": feedback.get("correction"),
+        "score": feedback.get("score"),
+        "tags": feedback.get("tags", []),
+        "created_at": datetime.utcnow().isoformat(),
+    })
 
 
 async def get_user_level(user_id: str) -> str:
     try:
-        supabase = get_supabase()
-        result = supabase.table("profiles").select("level").eq("id", user_id).single().execute()
-        return result.data.get("level", "beginner") if result.data else "beginner"
+        profile = await profile_cache.get(user_id)
+        return profile.get("level") or "beginner"
     except Exception:
         return "beginner"
 
 
+async def get_user_levels(user_ids: list[str]) -> dict[str, str]:
+    """Levels for many users in one query; unknown users are beginners."""
+    levels = dict.fromkeys(user_ids, "beginner")
+    try:
+        for user_id, profile in (await profile_cache.get_many(list(levels))).items():
+            levels[user_id] = profile.get("level") or "beginner"
+    except Exception as e:
+        logger.warning(f"Batch level lookup failed: {e}")
+    return levels
+
+
 class CoachRequest(BaseModel):
     user_id: str
     transcript: str
@@ -164,9 +239,33 @@ class CoachResponse(BaseModel):
     tags: list[str]
 
 
+FEEDBACK_FIELDS = tuple(CoachResponse.model_fields)
+
+
+def _validated(feedback: dict, transcript: str) -> dict:
+    """`feedback` checked against CoachResponse; the rule-based answer if it doesn't fit."""
+    try:
+        return CoachResponse(**feedback).model_dump()
+    except (ValidationError, TypeError):
+        logger.warning("LLM feedback failed validation; using rule-based feedback")
+        return CoachResponse(**_rule_based_feedback(transcript)).model_dump()
+
+
+class CoachBatchRequest(BaseModel):
+    items: list[CoachRequest]
+
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "hf_token_set": bool(HF_TOKEN)}
+    return {
+        "status": "ok",
+        "hf_token_set": bool(HF_TOKEN),
+        "groq_key_set": bool(GROQ_API_KEY),
+        "providers": router.stats(),
+        "cache": feedback_cache.stats(),
+        "profiles": profile_cache.stats(),
+        "sessions": session_writer.stats(),
+    }
 
 
 @app.post("/", response_model=CoachResponse)
@@ -177,24 +276,132 @@ async def coach(req: CoachRequest):
     level = await get_user_level(req.user_id)
     feedback = await call_llama(req.transcript, level)
 
-    import asyncio
-    asyncio.create_task(save_session(req.user_id, req.transcript, feedback))
+    await save_session(req.user_id, req.transcript, feedback)
 
     return CoachResponse(**feedback)
 
 
+@app.post("/stream")
+async def coach_stream(req: CoachRequest):
+    """
+    Server-sent-events variant of POST /. One event per feedback field
+    (`correction`, `explanation`, …) as soon as the model has finished it,
+    then `done` carrying the complete, validated response.
+    """
+    if not req.transcript.strip():
+        raise HTTPException(status_code=400, detail="Transcript is empty.")
+    level = await get_user_level(req.user_id)
+
+    async def events():
+        feedback = {}
+        async for field, value in stream_feedback(req.transcript, level):
+            feedback[field] = value
+            yield sse(field, value)
+        response = _validated(feedback, req.transcript)
+        await save_session(req.user_id, req.transcript, response)
+        yield sse("done", response)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/batch")
+async def coach_batch(req: CoachBatchRequest):
+    """
+    Many transcripts, one or more users. Levels come from a single query,
+    cache hits are answered immediately, and the rest are packed by level
+    (`coach_batch_pack_size` per LLM prompt, `coach_batch_concurrency` packs in
+    flight). Streams NDJSON lines {index, user_id, feedback | error} as each
+    pack completes, so order follows completion, not the request.
+    """
+    if len(req.items) > settings.coach_batch_max_items:
+        raise HTTPException(status_code=400, detail=f"At most {settings.coach_batch_max_items} items per batch.")
+    levels = await get_user_levels([item.user_id for item in req.items])
+
+    def line(index: int, item: CoachRequest, **body) -> str:
+        return json.dumps({"index": index, "user_id": item.user_id, **body}) + "\n"
+
+    async def run_pack(sem: asyncio.Semaphore, level: str, pack: list[tuple[int, CoachRequest]]):
+        async with sem:
+            return pack, await call_llama_pack([item.transcript for _, item in pack], level)
+
+    async def stream():
+        by_level: dict[str, list[tuple[int, CoachRequest]]] = {}
+        for index, item in enumerate(req.items):
+            if not item.transcript.strip():
+                yield line(index, item, error="Transcript is empty.")
+                continue
+            level = levels[item.user_id]
+            cached = feedback_cache.get(feedback_cache.key(item.transcript, level, PROMPT_VERSION))
+            if cached is not None:
+                feedback = _validated(cached, item.transcript)
+                await save_session(item.user_id, item.transcript, feedback)
+                yield line(index, item, feedback=feedback)
+            else:
+                by_level.setdefault(level, []).append((index, item))
+
+        size = max(1, settings.coach_batch_pack_size)
+        sem = asyncio.Semaphore(max(1, settings.coach_batch_concurrency))
+        tasks = [
+            asyncio.create_task(run_pack(sem, level, items[i:i + size]))
+            for level, items in by_level.items()
+            for i in range(0, len(items), size)
+        ]
+        try:
+            for done in asyncio.as_completed(tasks):
+                pack, feedbacks = await done
+                for (index, item), feedback in zip(pack, feedbacks):
+                    feedback = _validated(feedback, item.transcript)
+                    await save_session(item.user_id, item.transcript, feedback)
+                    yield line(index, item, feedback=feedback)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.get("/history/{user_id}")
-async def get_history(user_id: str, limit: int = 20):
+async def get_history(user_id: str, limit: int = 20, cursor: Optional[str] = None):
+    """Newest sessions first; pass `next_cursor` back as `cursor` for the next page."""
+    limit = max(1, min(limit, settings.history_max_page))
     try:
-        supabase = get_supabase()
-        result = (
-            supabase.table("coaching_sessions")
-            .select("*")
-            .eq("user_id", user_id)
-            .order("created_at", desc=True)
-            .limit(limit)
-            .execute()
-        )
-        return {"sessions": result.data}
+        sessions, next_cursor = await history_page(user_id, limit, cursor)
+        return {"sessions": sessions, "next_cursor": next_cursor}
+    except BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="History lookup timed out")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/history/{user_id}/export")
+async def get_history_export(user_id: str):
+    """Entire history as NDJSON, one session per line, streamed page by page."""
+    async def stream() -> AsyncIterator[str]:
+        try:
+            async for row in export_history(user_id, settings.history_export_page):
+                yield json.dumps(row, default=str) + "\n"
+        except Exception as e:
+            logger.error(f"History export for {user_id} failed: {e}")
+            yield json.dumps({"error": "export interrupted"}) + "\n"
+
+    return StreamingResponse(
+        stream(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="history-{user_id}.ndjson"'},
+    )
+
+
+@app.get("/progress/{user_id}")
+async def get_user_progress(user_id: str, days: int = 30):
+    """Totals, streak, tag counts and a daily series, read from session_rollups."""
+    try:
+        return {"user_id": user_id, **await get_progress(user_id, max(1, min(days, 366)))}
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Progress lookup timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,70 @@
+"""
+Learner progress from the per-day `session_rollups` table.
+
+The table is maintained on insert by the rollup_sessions() trigger in
+infra/supabase_schema.sql, so a dashboard costs one indexed read of at most
+one row per active day instead of a scan over coaching_sessions.
+"""
+
+from datetime import date, timedelta
+from typing import Optional
+
+from common.db import select_many
+
+ROLLUP_COLUMNS = "day,sessions,score_sum,scored,best_score,tag_counts"
+
+
+def _mean(score_sum: int, scored: int) -> Optional[float]:
+    return round(score_sum / scored, 2) if scored else None
+
+
+def _streak(active_days: set[str], today: date) -> int:
+    """Consecutive active days ending today (or yesterday, if today has no session yet)."""
+    day = today if today.isoformat() in active_days else today - timedelta(days=1)
+    streak = 0
+    while day.isoformat() in active_days:
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+def summarize(rollups: list[dict], days: int, today: Optional[date] = None) -> dict:
+    """Totals over all rollups plus the daily series for the most recent `days` days."""
+    today = today or date.today()
+    tags: dict[str, int] = {}
+    sessions = score_sum = scored = 0
+    best = None
+    for r in rollups:
+        sessions += r["sessions"]
+        score_sum += r["score_sum"]
+        scored += r["scored"]
+        if r.get("best_score") is not None:
+            best = max(best or 0, r["best_score"])
+        for tag, n in (r.get("tag_counts") or {}).items():
+            tags[tag] = tags.get(tag, 0) + n
+
+    since = (today - timedelta(days=days - 1)).isoformat()
+    daily = [
+        {
+            "day": str(r["day"]),
+            "sessions": r["sessions"],
+            "mean_score": _mean(r["score_sum"], r["scored"]),
+            "tags": r.get("tag_counts") or {},
+        }
+        for r in sorted(rollups, key=lambda r: str(r["day"]))
+        if str(r["day"]) >= since
+    ]
+    return {
+        "sessions": sessions,
+        "mean_score": _mean(score_sum, scored),
+        "best_score": best,
+        "active_days": len(rollups),
+        "streak": _streak({str(r["day"]) for r in rollups}, today),
+        "tags": dict(sorted(tags.items(), key=lambda kv: -kv[1])),
+        "daily": daily,
+    }
+
+
+async def get_progress(user_id: str, days: int = 30) -> dict:
+    rollups = await select_many("session_rollups", ROLLUP_COLUMNS, eq={"user_id": user_id}, order="day")
+    return summarize(rollups, days)
@@ -0,0 +1,347 @@
+"""
+LLM provider routing for the coach.
+
+Providers — Hugging Face LLaMA-3, Hugging Face Mistral-7B and Groq — are
+ranked by recently observed latency (EWMA of successful calls; unmeasured ones
+are assumed to take `llm_latency_prior` seconds). A request goes to the best
+provider; if it hasn't answered within that provider's p95 latency, a hedge
+goes to the next one and the first usable answer wins, the other is cancelled.
+A failure moves on to the next provider immediately instead of waiting out a
+timeout, and the whole call is bounded by `llm_timeout`; providers still
+pending at that deadline are charged a failure.
+
+Each provider has a circuit breaker: `llm_breaker_failures` consecutive
+failures open it for `llm_breaker_cooldown` seconds, after which a single
+trial request is let through. When no provider can answer, AllProvidersFailed
+is raised and the caller uses the local rule engine.
+
+Streams are not hedged (two token streams can't be merged); they fail over to
+the next provider only until the first token has arrived.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from common.config import settings
+from common.http import get_client, GROQ, HUGGINGFACE
+
+logger = logging.getLogger("coach.router")
+
+HF_TOKEN = os.getenv("HF_TOKEN", "")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
+
+LATENCY = Histogram("coach_llm_latency_seconds", "Successful LLM call latency", ["provider"],
+                    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32))
+REQUESTS = Counter("coach_llm_requests_total", "LLM calls by outcome", ["provider", "outcome"])
+HEDGES = Counter("coach_llm_hedges_total", "Hedge requests sent to a second provider")
+CIRCUIT_OPEN = Gauge("coach_llm_circuit_open", "1 while a provider's circuit is open", ["provider"])
+
+
+class AllProvidersFailed(RuntimeError):
+    """No provider produced a usable answer within the budget."""
+
+
+class Provider:
+    name = "provider"
+
+    def __init__(self):
+        self.latencies: deque[float] = deque(maxlen=settings.llm_latency_window)
+        self.ewma: Optional[float] = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+
+    def available(self) -> bool:
+        return True
+
+    async def generate(self, system: str, user: str, max_tokens: int) -> str:
+        raise NotImplementedError
+
+    def stream(self, system: str, user: str, max_tokens: int) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    # ── health ──
+    def allows(self, now: float) -> bool:
+        if not self.open_until:
+            return True
+        return now >= self.open_until and not self.trial       # half-open: one trial at a time
+
+    def begin(self):
+        if self.open_until:
+            self.trial = True
+
+    def release(self):
+        self.trial = False
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.ewma = latency if self.ewma is None else 0.7 * self.ewma + 0.3 * latency
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        LATENCY.labels(provider=self.name).observe(latency)
+        REQUESTS.labels(provider=self.name, outcome="success").inc()
+        CIRCUIT_OPEN.labels(provider=self.name).set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        REQUESTS.labels(provider=self.name, outcome="failure").inc()
+        if self.trial or self.failures >= settings.llm_breaker_failures:
+            self.open_until = time.monotonic() + settings.llm_breaker_cooldown
+            CIRCUIT_OPEN.labels(provider=self.name).set(1)
+            logger.warning(f"Circuit open for {self.name} ({self.failures} consecutive failures)")
+        self.trial = False
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < 5:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available(),
+            "ewma_s": round(self.ewma, 3) if self.ewma is not None else None,
+            "p95_s": round(self.p95(), 3) if self.p95() is not None else None,
+            "consecutive_failures": self.failures,
+            "circuit_open": self.open_until > time.monotonic(),
+        }
+
+
+class HFProvider(Provider):
+    """Text-generation on the Hugging Face Inference API with a chat template."""
+
+    TEMPLATES = {
+        "llama3": (
+            "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n{system}<|eot_id|>\n"
+            "<|start_header_id|>user<|end_header_id|>\n{user}<|eot_id|>\n"
+            "<|start_header_id|>assistant<|end_header_id|>\n"
+        ),
+        "mistral": "<s>[INST] {system}\n\n{user} [/INST]",
+    }
+
+    def __init__(self, name: str, url: str, template: str):
+        super().__init__()
+        self.name = name
+        self.url = url
+        self.template = self.TEMPLATES[template]
+
+    def _request(self, system: str, user: str, max_tokens: int, stream: bool) -> dict:
+        return {
+            "headers": {"Authorization": f"Bearer {HF_TOKEN}", "Content-Type": "application/json"},
+            "json": {
+                "inputs": self.template.format(system=system, user=user),
+                "parameters": {
+                    "max_new_tokens": max_tokens,
+                    "temperature": 0.3,
+                    "return_full_text": False,
+                    "stop": ["<|eot_id|>", "</s>", "[/INST]"],
+                },
+                "stream": stream,
+            },
+            "timeout": settings.llm_timeout,
+        }
+
+    async def generate(self, system: str, user: str, max_tokens: int) -> str:
+        resp = await get_client(HUGGINGFACE).post(self.url, **self._request(system, user, max_tokens, False))
+        if resp.status_code == 503:
+            raise RuntimeError("Model loading (503) — retry later.")
+        resp.raise_for_status()
+        raw = resp.json()
+        return raw[0]["generated_text"] if isinstance(raw, list) else raw.get("generated_text", "")
+
+    async def stream(self, system: str, user: str, max_tokens: int) -> AsyncIterator[str]:
+        async with get_client(HUGGINGFACE).stream("POST", self.url, **self._request(system, user, max_tokens, True)) as resp:
+            if resp.status_code == 503:
+                raise RuntimeError("Model loading (503) — retry later.")
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                token = json.loads(line[5:]).get("token") or {}
+                if not token.get("special"):
+                    yield token.get("text", "")
+
+
+class GroqProvider(Provider):
+    """OpenAI-compatible chat completions on Groq."""
+
+    name = "groq"
+    url = "https://api.groq.com/openai/v1/chat/completions"
+    model = "llama3-8b-8192"
+
+    def available(self) -> bool:
+        return bool(GROQ_API_KEY)
+
+    def _request(self, system: str, user: str, max_tokens: int, stream: bool) -> dict:
+        return {
+            "headers": {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
+            "json": {
+                "model": self.model,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
+                "temperature": 0.3,
+                "max_tokens": max_tokens,
+                "stream": stream,
+            },
+            "timeout": settings.llm_timeout,
+        }
+
+    async def generate(self, system: str, user: str, max_tokens: int) -> str:
+        resp = await get_client(GROQ).post(self.url, **self._request(system, user, max_tokens, False))
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    async def stream(self, system: str, user: str, max_tokens: int) -> AsyncIterator[str]:
+        async with get_client(GROQ).stream("POST", self.url, **self._request(system, user, max_tokens, True)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                text = json.loads(data)["choices"][0]["delta"].get("content")
+                if text:
+                    yield text
+
+
+class ProviderRouter:
+    def __init__(self, providers: list[Provider]):
+        self.providers = providers
+
+    def ranked(self) -> list[Provider]:
+        """Usable providers, fastest (by recent latency) first."""
+        now = time.monotonic()
+        usable = [p for p in self.providers if p.available() and p.allows(now)]
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        return sorted(usable, key=lambda p: (p.ewma if p.ewma is not None else settings.llm_latency_prior, order[p.name]))
+
+    @staticmethod
+    def hedge_delay(provider: Provider) -> float:
+        p95 = provider.p95()
+        delay = p95 if p95 is not None else settings.llm_hedge_default_ms / 1000
+        return min(settings.llm_hedge_max_ms / 1000, max(settings.llm_hedge_min_ms / 1000, delay))
+
+    async def _attempt(self, provider: Provider, system: str, user: str, max_tokens: int, parse: Callable[[str], Any]):
+        provider.begin()
+        start = time.monotonic()
+        try:
+            result = parse(await provider.generate(system, user, max_tokens))
+        except asyncio.CancelledError:
+            provider.release()
+            REQUESTS.labels(provider=provider.name, outcome="cancelled").inc()
+            raise
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - start)
+        return result
+
+    async def generate(self, system: str, user: str, *, max_tokens: int = 220,
+                       parse: Callable[[str], Any] = lambda text: text) -> Any:
+        """
+        First usable answer, hedged across providers. `parse` runs inside the
+        attempt, so unusable output counts as that provider failing.
+        """
+        candidates = self.ranked()
+        if not candidates:
+            raise AllProvidersFailed("no provider available (all circuits open)")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.llm_timeout
+        running: dict[asyncio.Task, Provider] = {}
+        errors: list[str] = []
+        last_launch, last_provider = 0.0, None
+
+        def launch():
+            nonlocal last_launch, last_provider
+            last_provider = candidates.pop(0)
+            last_launch = loop.time()
+            running[asyncio.create_task(self._attempt(last_provider, system, user, max_tokens, parse))] = last_provider
+
+        launch()
+        try:
+            while running:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    errors.append(f"timed out after {settings.llm_timeout:g}s")
+                    for provider in running.values():         # hung, not merely out-hedged: counts toward its breaker
+                        logger.warning(f"{provider.name} still pending at the {settings.llm_timeout:g}s deadline")
+                        provider.record_failure()
+                    break
+                wait = remaining
+                if candidates:
+                    wait = min(wait, max(0.0, last_launch + self.hedge_delay(last_provider) - loop.time()))
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if candidates and loop.time() >= last_launch + self.hedge_delay(last_provider):
+                        HEDGES.inc()
+                        logger.info(f"{last_provider.name} slower than its p95 — hedging to {candidates[0].name}")
+                        launch()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        logger.warning(f"{provider.name} failed: {e}")
+                        continue
+                    logger.info(f"Coach response via {provider.name}")
+                    return result
+                if not running and candidates:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+        raise AllProvidersFailed("; ".join(errors))
+
+    async def stream(self, system: str, user: str, *, max_tokens: int = 220) -> AsyncIterator[str]:
+        """Tokens from the best provider, failing over until the first token arrives."""
+        candidates = self.ranked()
+        if not candidates:
+            raise AllProvidersFailed("no provider available (all circuits open)")
+        errors: list[str] = []
+        for provider in candidates:
+            provider.begin()
+            start = time.monotonic()
+            started = False
+            try:
+                async for token in provider.stream(system, user, max_tokens):
+                    started = True
+                    yield token
+            except GeneratorExit:                     # consumer stopped reading, e.g. the JSON was complete
+                if started:
+                    provider.record_success(time.monotonic() - start)
+                else:
+                    provider.release()
+                raise
+            except asyncio.CancelledError:
+                provider.release()
+                raise
+            except Exception as e:
+                provider.record_failure()
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e}")
+                logger.warning(f"{provider.name} stream failed before the first token: {e}")
+                continue
+            provider.record_success(time.monotonic() - start)
+            return
+        raise AllProvidersFailed("; ".join(errors))
+
+    def stats(self) -> dict:
+        return {p.name: p.stats() for p in self.providers}
+
+
+router = ProviderRouter([
+    HFProvider("llama3", "https://api-inference.huggingface.co/models/meta-llama/Meta-Llama-3-8B-Instruct", "llama3"),
+    HFProvider("mistral", "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.3", "mistral"),
+    GroqProvider(),
+])
@@ -0,0 +1,344 @@
+"""
+Compiled rule engine for common learner errors.
+
+Several hundred grammar, vocabulary and fluency rules are compiled into ONE
+regular expression, so a transcript is checked in a single left-to-right pass:
+
+  • fixed phrases ("he don't", "more better", "discuss about", …) are merged
+    into a character trie and emitted as one nested alternation, so the
+    engine never tries more than a handful of branches per position
+  • structural rules (a/an, "since 3 years", repeated words, fillers) are
+    appended as named alternatives
+
+Each rule carries a confidence. A check is as confident as its least certain
+match, discounted for long transcripts (the rules only vouch for what they
+see). Nothing matched → confidence 0, i.e. "ask the LLM". Templated phrases
+that also occur in valid English ("in Monday Street", "that he have lunch")
+stay below coach_rules_threshold, so they only shape the rule-based fallback.
+"""
+
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Union
+
+from common.config import settings
+
+
+@dataclass(frozen=True)
+class Rule:
+    id: str
+    tag: str                                              # grammar | vocabulary | fluency
+    note: str                                             # one-sentence explanation for the learner
+    fix: Union[str, Callable[[str], str], None] = None    # replacement; None only flags
+    confidence: float = 0.9
+    not_after: frozenset = frozenset()                    # words that make the phrase correct
+    not_in_past: bool = False                             # skip when the sentence talks about the past
+
+
+@dataclass
+class Match:
+    rule: Rule
+    start: int
+    end: int
+    text: str
+
+
+@dataclass
+class RuleCheck:
+    matches: list[Match] = field(default_factory=list)
+    confidence: float = 0.0
+    feedback: dict = field(default_factory=dict)
+
+
+# ── Rule tables ───────────────────────────────────────────────────────────────
+
+_QUESTION_OR_MODAL = frozenset(
+    "do does did don't doesn't didn't can can't cannot could couldn't will won't would wouldn't "
+    "shall should shouldn't may might must let make made help helps why to".split()
+)
+
+# "Yesterday he go to school" wants "went", not "goes" — present-tense agreement
+# rules stand aside when the sentence is anchored in the past
+_PAST_TIME = re.compile(
+    r"\b(?:yesterday|ago|last\s+(?:night|week|weekend|month|year|time|summer|winter|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday)|in\s+(?:19|20)\d\d)\b",
+    re.IGNORECASE,
+)
+
+_BE = {
+    ("i", "is"): "I am", ("i", "are"): "I am",
+    ("he", "are"): "he is", ("she", "are"): "she is", ("it", "are"): "it is",
+    ("we", "is"): "we are", ("you", "is"): "you are", ("they", "is"): "they are",
+    ("we", "was"): "we were", ("you", "was"): "you were", ("they", "was"): "they were",
+}
+
+_DO_HAVE = {
+    ("he", "don't"): "he doesn't", ("she", "don't"): "she doesn't", ("it", "don't"): "it doesn't",
+    ("he", "do", "not"): "he does not", ("she", "do", "not"): "she does not",
+    ("i", "doesn't"): "I don't", ("you", "doesn't"): "you don't",
+    ("we", "doesn't"): "we don't", ("they", "doesn't"): "they don't",
+    ("he", "have"): "he has", ("she", "have"): "she has",
+    ("i", "has"): "I have", ("you", "has"): "you have", ("we", "has"): "we have", ("they", "has"): "they have",
+}
+
+_THIRD_PERSON = {
+    "go": "goes", "do": "does", "like": "likes", "want": "wants", "play": "plays", "work": "works",
+    "live": "lives", "need": "needs", "know": "knows", "think": "thinks", "make": "makes",
+    "take": "takes", "come": "comes", "say": "says", "get": "gets", "see": "sees", "watch": "watches",
+    "eat": "eats", "drink": "drinks", "study": "studies", "try": "tries", "speak": "speaks",
+    "read": "reads", "write": "writes", "love": "loves", "hate": "hates", "teach": "teaches",
+    "learn": "learns", "help": "helps", "buy": "buys", "cook": "cooks", "drive": "drives",
+    "walk": "walks", "run": "runs", "sleep": "sleeps", "wake": "wakes", "listen": "listens",
+    "understand": "understands", "feel": "feels", "look": "looks", "use": "uses", "call": "calls",
+    "visit": "visits", "wash": "washes", "finish": "finishes", "start": "starts",
+}
+
+_IRREGULAR_PAST = {
+    "went": "go", "saw": "see", "came": "come", "ate": "eat", "took": "take", "gave": "give",
+    "made": "make", "wrote": "write", "spoke": "speak", "bought": "buy", "brought": "bring",
+    "thought": "think", "told": "tell", "knew": "know", "got": "get", "did": "do", "had": "have",
+    "was": "be", "were": "be", "drank": "drink", "drove": "drive", "ran": "run", "swam": "swim",
+    "began": "begin", "felt": "feel", "left": "leave", "taught": "teach", "understood": "understand",
+    "slept": "sleep", "woke": "wake", "met": "meet", "sang": "sing", "forgot": "forget",
+}
+
+_BASE_AFTER = ("didn't", "did not", "doesn't", "does not", "don't", "can", "can't", "could",
+               "will", "won't", "would", "should", "must")
+
+_COMPARATIVE = {
+    "better": "good", "worse": "bad", "bigger": "big", "smaller": "small", "taller": "tall",
+    "shorter": "short", "older": "old", "younger": "young", "easier": "easy", "harder": "hard",
+    "faster": "fast", "slower": "slow", "cheaper": "cheap", "higher": "high", "lower": "low",
+    "happier": "happy", "busier": "busy", "larger": "large", "longer": "long", "stronger": "strong",
+    "richer": "rich", "smarter": "smart", "nicer": "nice", "colder": "cold", "hotter": "hot",
+}
+_SUPERLATIVE = {
+    "best": "good", "worst": "bad", "biggest": "big", "tallest": "tall", "oldest": "old",
+    "youngest": "young", "easiest": "easy", "hardest": "hard", "fastest": "fast", "cheapest": "cheap",
+    "happiest": "happy", "largest": "large", "longest": "long", "strongest": "strong", "nicest": "nice",
+}
+
+_UNCOUNTABLE = {
+    "informations": "information", "advices": "advice", "furnitures": "furniture",
+    "homeworks": "homework", "equipments": "equipment", "luggages": "luggage",
+    "knowledges": "knowledge", "baggages": "baggage", "evidences": "evidence", "feedbacks": "feedback",
+    "softwares": "software", "traffics": "traffic",
+}
+_IRREGULAR_PLURAL = {
+    "childs": "children", "womans": "women", "foots": "feet", "feets": "feet", "tooths": "teeth",
+    "teeths": "teeth", "mouses": "mice", "gooses": "geese", "sheeps": "sheep",
+    "mens": "men", "childrens": "children",
+}
+
+_COLLOCATIONS = {
+    "discuss about": ("discuss", "'Discuss' takes no 'about' — we discuss something."),
+    "explain me": ("explain to me", "We explain something *to* someone."),
+    "say me": ("tell me", "Use 'tell' with a person: tell me."),
+    "depend of": ("depend on", "'Depend' goes with 'on'."),
+    "depends of": ("depends on", "'Depend' goes with 'on'."),
+    "interested for": ("interested in", "We are interested *in* something."),
+    "interested about": ("interested in", "We are interested *in* something."),
+    "listen music": ("listen to music", "'Listen' needs 'to' before its object."),
+    "return back": ("return", "'Return' already means 'go back'."),
+    "repeat again": ("repeat", "'Repeat' already means 'say again'."),
+    "make my homework": ("do my homework", "We *do* homework."),
+    "make homework": ("do homework", "We *do* homework."),
+    "make a photo": ("take a photo", "We *take* photos."),
+    "make a picture": ("take a picture", "We *take* pictures."),
+    "do a mistake": ("make a mistake", "We *make* mistakes."),
+    "do mistakes": ("make mistakes", "We *make* mistakes."),
+    "do a decision": ("make a decision", "We *make* decisions."),
+    "go to home": ("go home", "No 'to' before 'home'."),
+    "come to home": ("come home", "No 'to' before 'home'."),
+    "go to abroad": ("go abroad", "No 'to' before 'abroad'."),
+    "in night": ("at night", "We say *at* night."),
+    "in the night time": ("at night", "We say *at* night."),
+    "i am agree": ("I agree", "'Agree' is a verb — no 'am'."),
+    "i am not agree": ("I don't agree", "'Agree' is a verb — use 'don't agree'."),
+    "i very like": ("I really like", "Use 'really' before a verb, not 'very'."),
+    "could of": ("could have", "The phrase is 'could have' ('could've')."),
+    "should of": ("should have", "The phrase is 'should have' ('should've')."),
+    "would of": ("would have", "The phrase is 'would have' ('would've')."),
+    "more easy": ("easier", "Short adjectives take -er: easier."),
+    "more big": ("bigger", "Short adjectives take -er: bigger."),
+    "more cheap": ("cheaper", "Short adjectives take -er: cheaper."),
+    "more fast": ("faster", "Short adjectives take -er: faster."),
+    "reach to": ("reach", "'Reach' takes a direct object: reach the station."),
+    "afraid from": ("afraid of", "We are afraid *of* something."),
+    "good in english": ("good at English", "We are good *at* something."),
+    "arrive to": ("arrive at", "We arrive *at* a place (or *in* a city)."),
+    "very exciting about": ("very excited about", "People feel *excited*; things are *exciting*."),
+    "i am exciting": ("I am excited", "People feel *excited*; things are *exciting*."),
+    "i am boring": ("I am bored", "People feel *bored*; things are *boring*."),
+    "i am interesting in": ("I am interested in", "People feel *interested*; things are *interesting*."),
+    "i am confusing": ("I am confused", "People feel *confused*; things are *confusing*."),
+    "i am tiring": ("I am tired", "People feel *tired*; things are *tiring*."),
+}
+
+_DAYS = "monday tuesday wednesday thursday friday saturday sunday".split()
+
+_ENCOURAGEMENTS = [
+    "Great effort! You're improving every day. 🎉",
+    "Nice work — keep speaking and it gets easier!",
+    "Good job! Every sentence makes you more fluent.",
+    "Well done — small fixes, big progress!",
+]
+
+
+def _phrase_rules() -> dict[str, Rule]:
+    rules: dict[str, Rule] = {}
+
+    def add(phrase, tag, note, fix, confidence=0.8, not_after=frozenset(), not_in_past=False):
+        rules[phrase] = Rule(f"{tag}:{phrase}", tag, note, fix, confidence, not_after, not_in_past)
+
+    for words, fix in _BE.items():
+        add(" ".join(words), "grammar", f"Use '{fix.split()[1]}' with '{fix.split()[0]}'.", fix,
+            not_after=_QUESTION_OR_MODAL)
+    for words, fix in _DO_HAVE.items():
+        add(" ".join(words), "grammar", f"'{words[0].capitalize()}' goes with '{' '.join(fix.split()[1:])}'.",
+            fix, not_after=_QUESTION_OR_MODAL)
+    for base, third in _THIRD_PERSON.items():
+        for subject in ("he", "she"):
+            add(f"{subject} {base}", "grammar", f"With he/she/it, add -s: '{third}'.", f"{subject} {third}",
+                confidence=0.9, not_after=_QUESTION_OR_MODAL, not_in_past=True)
+    for past, base in _IRREGULAR_PAST.items():
+        for aux in _BASE_AFTER:
+            add(f"{aux} {past}", "grammar", f"After '{aux}', use the base verb: '{base}'.", f"{aux} {base}",
+                confidence=0.95)
+    for base, third in _THIRD_PERSON.items():
+        for aux in _BASE_AFTER:
+            add(f"{aux} {third}", "grammar", f"After '{aux}', use the base verb: '{base}'.", f"{aux} {base}",
+                confidence=0.95)
+    for comparative in _COMPARATIVE:
+        add(f"more {comparative}", "grammar", f"'{comparative}' is already comparative — drop 'more'.", comparative,
+            confidence=0.95)
+    for superlative in _SUPERLATIVE:
+        add(f"most {superlative}", "grammar", f"'{superlative}' is already superlative — drop 'most'.", superlative,
+            confidence=0.95)
+    for wrong, right in _UNCOUNTABLE.items():
+        add(wrong, "vocabulary", f"'{right}' is uncountable — no -s.", right, confidence=0.9)
+    for wrong, right in _IRREGULAR_PLURAL.items():
+        add(wrong, "vocabulary", f"The plural is '{right}'.", right, confidence=0.75)
+    for wrong, (right, note) in _COLLOCATIONS.items():
+        add(wrong, "vocabulary", note, right, confidence=0.75)
+    for day in _DAYS:
+        for prep in ("in", "at"):
+            add(f"{prep} {day}", "grammar", "Use 'on' with days of the week.", f"on {day.capitalize()}",
+                confidence=0.75)
+    return rules
+
+
+_VOWEL_SOUND_EXCEPTIONS = r"(?:uni|use|usu|uti|ura|ure|one|once|eu|ewe|uk)"
+
+_REGEX_RULES: list[tuple[str, Rule]] = [
+    (rf"\ba(?=\s+[aeiou])(?!\s+{_VOWEL_SOUND_EXCEPTIONS})",
+     Rule("grammar:a-an", "grammar", "Use 'an' before a vowel sound.", "an", 0.9)),
+    (r"\ban(?=\s+[bcdfgjklmnpqrstvwyz])(?-i:(?!\s+[A-Z]{2,}))",
+     Rule("grammar:an-a", "grammar", "Use 'a' before a consonant sound.", "a", 0.85)),
+    (r"\bsince\s+(?:\d+|two|three|four|five|six|seven|eight|nine|ten|many|several)\s+(?:years?|months?|weeks?|days?|hours?)\b",
+     Rule("grammar:since-for", "grammar", "Use 'for' with a length of time, 'since' with a starting point.",
+          lambda s: "for" + s[5:], 0.9)),
+    (r"\bi\s+have\s+\d{1,2}\s+years(?!\s+(?:of|in|at|to|experience))\b",
+     Rule("grammar:age", "grammar", "Say your age with 'be': I am 20 years old.",
+          lambda s: "I am " + s.split()[2] + " years old", 0.9)),
+    (r"\b(?:on|at)\s+(?:19|20)\d\d\b",
+     Rule("grammar:in-year", "grammar", "Use 'in' with years.", lambda s: "in" + s[2:], 0.85)),
+    (r"\b(?!(?:had|that|is|very|so|bye|no)\b)(?P<repeated>[a-z]+)\s+(?P=repeated)\b",
+     Rule("fluency:repeat", "fluency", "Try not to repeat words — pause instead.", lambda s: s.split()[0], 0.8)),
+    (r"\b(?:u+m+|u+h+|e+r+m+|hmm+)\b",
+     Rule("fluency:filler", "fluency", "Fewer fillers like 'um' and 'uh' will make you sound more fluent.", None, 0.6)),
+]
+
+
+def _trie_regex(phrases) -> str:
+    """One alternation for many literal phrases, shared prefixes factored out."""
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        optional = "" in node
+        alts = [(r"\s+" if ch == " " else re.escape(ch)) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if optional:
+            body = f"(?:{body})?" if len(alts) == 1 and len(body) > 1 else f"{body}?"
+        return body
+
+    return emit(trie)
+
+
+class RuleEngine:
+    def __init__(self):
+        self.phrases = _phrase_rules()
+        self.regex_rules = {f"r{i}": rule for i, (_, rule) in enumerate(_REGEX_RULES)}
+        parts = [rf"(?P<phrase>(?<![\w'])(?:{_trie_regex(self.phrases)})(?![\w']))"]
+        parts += [f"(?P<r{i}>{pattern})" for i, (pattern, _) in enumerate(_REGEX_RULES)]
+        self.pattern = re.compile("|".join(parts), re.IGNORECASE)
+
+    def __len__(self) -> int:
+        return len(self.phrases) + len(self.regex_rules)
+
+    def matches(self, text: str) -> list[Match]:
+        found = []
+        past = None
+        for m in self.pattern.finditer(text):
+            if m.lastgroup == "phrase":
+                rule = self.phrases.get(" ".join(m.group().lower().split()))
+                if rule is None:
+                    continue
+                if rule.not_in_past:
+                    if past is None:
+                        past = _PAST_TIME.search(text) is not None
+                    if past:
+                        continue
+                if rule.not_after:
+                    before = re.findall(r"[\w']+", text[max(0, m.start() - 20):m.start()])
+                    if before and before[-1].lower() in rule.not_after:
+                        continue
+            else:
+                rule = self.regex_rules[m.lastgroup]
+            found.append(Match(rule, m.start(), m.end(), m.group()))
+        return found
+
+    def check(self, transcript: str) -> RuleCheck:
+        matches = self.matches(transcript)
+        words = len(transcript.split())
+        confidence = 0.0
+        if matches:
+            confidence = min(m.rule.confidence for m in matches)
+            confidence *= min(1.0, settings.coach_rules_max_words / max(1, words))
+        return RuleCheck(matches, round(confidence, 3), self._feedback(transcript, matches, words))
+
+    @staticmethod
+    def _feedback(transcript: str, matches: list[Match], words: int) -> dict:
+        corrected = transcript
+        for m in sorted((m for m in matches if m.rule.fix is not None), key=lambda m: m.start, reverse=True):
+            fix = m.rule.fix(m.text) if callable(m.rule.fix) else m.rule.fix
+            if m.text[:1].isupper() and fix[:1].islower():
+                fix = fix[0].upper() + fix[1:]
+            corrected = corrected[:m.start] + fix + corrected[m.end:]
+
+        tags = list(dict.fromkeys(m.rule.tag for m in matches))
+        if words < 5 and "fluency" not in tags:
+            tags.append("fluency")
+        errors = {"grammar": 2, "vocabulary": 1, "fluency": 1}
+        penalty = sum(errors[m.rule.tag] for m in matches) + (words < 5)
+        best = max(matches, key=lambda m: (m.rule.fix is not None, m.rule.confidence), default=None)
+        vocabulary = [m.rule.fix for m in matches if m.rule.tag == "vocabulary" and isinstance(m.rule.fix, str)]
+        return {
+            "correction": corrected if corrected != transcript else None,
+            "explanation": best.rule.note if best else "Keep practicing — every sentence makes you better!",
+            "vocabulary": list(dict.fromkeys(vocabulary))[:2],
+            "encouragement": _ENCOURAGEMENTS[zlib.crc32(transcript.encode()) % len(_ENCOURAGEMENTS)],
+            "score": max(1, min(10, 9 - penalty)) if words >= 5 else min(10, max(1, words // 2)),
+            "tags": tags or ["fluency"],
+        }
+
+
+rule_engine = RuleEngine()
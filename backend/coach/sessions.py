@@ -0,0 +1,203 @@
+"""
+Write-behind queue for `coaching_sessions` rows.
+
+  • requests only append to an in-memory queue — no database I/O on the
+    request path, and none on the event loop (inserts run on the bounded DB
+    pool of common/db.py, with its per-call timeout)
+  • rows go out as one bulk insert per `session_batch_size` rows, or every
+    `session_flush_interval` seconds, whichever comes first
+  • failed or stalled (timed-out) inserts are retried with exponential
+    backoff; rows that still can't be written stay queued for the next round
+  • a batch rejected for its data (bad uuid, missing profile, failed check —
+    SQLSTATE class 22/23) is bisected: the good rows are written and the rows
+    the database rejects on their own are dropped, so one bad row can't block
+    the queue
+  • the queue holds at most `session_max_pending` rows — beyond that the
+    oldest are dropped (and counted) rather than growing without bound
+  • the gateway lifespan drains the queue on shutdown
+Queue depth and lag (age of the oldest unwritten row) are exported as gauges.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Gauge
+
+from common.config import settings
+from common.db import get_supabase, run_blocking
+
+logger = logging.getLogger("coach.sessions")
+
+QUEUE_DEPTH = Gauge("coach_session_queue_depth", "Coaching session rows waiting to be written")
+QUEUE_LAG = Gauge("coach_session_queue_lag_seconds", "Age of the oldest unwritten coaching session row")
+WRITTEN = Counter("coach_session_rows_written_total", "Coaching session rows inserted")
+DROPPED = Counter("coach_session_rows_dropped_total", "Coaching session rows dropped at the queue cap")
+REJECTED = Counter("coach_session_rows_rejected_total", "Coaching session rows the database refused to insert")
+
+
+def _insert_rows(rows: list[dict]):
+    get_supabase().table("coaching_sessions").insert(rows).execute()
+
+
+def _rejects_data(error: Exception) -> bool:
+    """True if retrying can't help: Postgres data exception (22xxx) or integrity violation (23xxx)."""
+    return str(getattr(error, "code", "") or "")[:2] in ("22", "23")
+
+
+class SessionWriter:
+    def __init__(
+        self,
+        insert: Callable[[list[dict]], None] = _insert_rows,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+        max_pending: int = 5000,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: Optional[float] = None,
+    ):
+        self.insert = insert
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout              # per insert; None → settings.db_timeout
+        self._rows: deque[tuple[float, dict]] = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def lag(self) -> float:
+        return time.monotonic() - self._rows[0][0] if self._rows else 0.0
+
+    def _trim(self):
+        while len(self._rows) > self.max_pending:
+            self._rows.popleft()
+            self.dropped += 1
+            DROPPED.inc()
+        QUEUE_DEPTH.set(len(self._rows))
+
+    def enqueue(self, row: dict):
+        self._rows.append((time.monotonic(), row))
+        if len(self._rows) > self.max_pending:
+            logger.warning(f"Session queue over {self.max_pending} rows — dropping the oldest")
+        self._trim()
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _write(self, rows: list[dict], retries: int) -> Optional[Exception]:
+        """Insert `rows` in one call; None on success, else the last error."""
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                await run_blocking(self.insert, rows, timeout=self.timeout)
+                self.written += len(rows)
+                WRITTEN.inc(len(rows))
+                return None
+            except Exception as e:
+                logger.warning(f"Session insert of {len(rows)} rows failed (attempt {attempt + 1}): {e!r}")
+                if _rejects_data(e):
+                    return e
+                if attempt < retries:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+                else:
+                    return e
+
+    async def _isolate(
+        self, batch: list[tuple[float, dict]], error: Optional[Exception] = None,
+    ) -> list[tuple[float, dict]]:
+        """
+        Bisect a batch the database rejected for its data: halves that insert
+        are written, single rows it still rejects are dropped. Returns the rows
+        that failed for any other reason, to be requeued.
+        """
+        if error is None:
+            error = await self._write([row for _, row in batch], 0)
+            if error is None:
+                return []
+        if not _rejects_data(error):
+            return batch
+        if len(batch) == 1:
+            self.rejected += 1
+            REJECTED.inc()
+            logger.error(f"Dropping coaching session row rejected by the database: {error}")
+            return []
+        mid = len(batch) // 2
+        return await self._isolate(batch[:mid]) + await self._isolate(batch[mid:])
+
+    async def flush(self, retries: Optional[int] = None) -> int:
+        """Write everything queued, one bulk insert per batch; returns rows written."""
+        retries = self.retries if retries is None else retries
+        written = self.written
+        async with self._flush_lock:
+            while self._rows:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+                try:
+                    error = await self._write([row for _, row in batch], retries)
+                    failed = await self._isolate(batch, error) if error is not None else []
+                except asyncio.CancelledError:
+                    self._rows.extendleft(reversed(batch))       # shutting down mid-backoff; close() drains
+                    raise
+                if failed:
+                    self._rows.extendleft(reversed(failed))      # keep order; retried next round
+                    self._trim()
+                    break
+            QUEUE_DEPTH.set(len(self._rows))
+        return self.written - written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._rows:
+                await self.flush()
+
+    def start(self):
+        if self._writer is None or self._writer.done():
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background writer and drain the queue."""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        await self.flush()
+        if self._rows:
+            logger.error(f"{len(self._rows)} coaching session rows could not be written before shutdown")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._rows),
+            "lag_s": round(self.lag, 3),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+session_writer = SessionWriter(
+    batch_size=settings.session_batch_size,
+    flush_interval=settings.session_flush_interval,
+    max_pending=settings.session_max_pending,
+    retries=settings.session_retries,
+)
+QUEUE_LAG.set_function(lambda: session_writer.lag)
@@ -0,0 +1,75 @@
+"""
+Incremental parsing of streamed coach feedback.
+
+FieldStream is fed LLM tokens as they arrive and yields each top-level field
+of the feedback object the moment its value is complete — `correction` can be
+shown while `explanation` is still being generated. Any text before the first
+`{` (preamble, whitespace) is ignored; parsing stops at the matching `}`.
+"""
+
+import json
+from typing import Any
+
+
+class FieldStream:
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self.done = False
+
+    def feed(self, text: str) -> list[tuple[str, Any]]:
+        """Consume more generated text; returns the fields completed by it."""
+        self._buf += text
+        fields: list[tuple[str, Any]] = []
+        while self._pos < len(self._buf) and not self.done:
+            i, c = self._pos, self._buf[self._pos]
+            self._pos += 1
+            if self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+                continue
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._depth == 1 and self._value_start is None:
+                        self._key = json.loads(self._buf[self._key_start:i + 1])
+                continue
+            if c == '"':
+                self._in_str = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = i
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(i, fields)
+                    self.done = True
+            elif self._depth == 1:
+                if c == ":" and self._key is not None and self._value_start is None:
+                    self._value_start = i + 1
+                elif c == ",":
+                    self._complete(i, fields)
+        return fields
+
+    def _complete(self, end: int, fields: list):
+        if self._key is not None and self._value_start is not None:
+            try:
+                fields.append((self._key, json.loads(self._buf[self._value_start:end])))
+            except ValueError:
+                pass                        # malformed value; the caller fills the gap
+        self._key = self._key_start = self._value_start = None
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -9,14 +9,99 @@ class Settings(BaseSettings):
     supabase_url: str = ""
     supabase_key: str = ""          # anon/service key
 
+    # Database access (common/db.py)
+    db_backend: str = "supabase"        # supabase | local (in-memory stand-in, opt-in only)
+    db_pool_size: int = 8               # threads running blocking Supabase calls
+    db_timeout: float = 5.0             # default per-query timeout (s)
+    db_local_seed: str = ""             # JSON file of {"table": [rows]} loaded into the local backend
+    profile_cache_size: int = 10000     # cached profiles (common/profiles.py)
+    profile_cache_ttl: float = 60.0     # seconds; writes through mark_lesson_complete invalidate immediately
+
     # Hugging Face
     hf_token: str = ""
 
+    # Upstream HTTP (HF Inference, Groq) — one pooled client per upstream
+    http_pool_size: int = 20            # max open connections per upstream
+    http_keepalive: int = 10            # idle keep-alive connections kept per upstream
+    http_keepalive_expiry: float = 30.0
+    http_timeout: float = 30.0
+    http_connect_timeout: float = 5.0
+    http2: bool = True                  # used only if the `h2` package is installed
+    llm_timeout: float = 25.0           # overall budget for one coach LLM answer, hedges included
+
+    # Coach LLM provider routing
+    llm_hedge_default_ms: float = 2500  # hedge delay until a provider has latency samples
+    llm_hedge_min_ms: float = 300       # clamp for the p95-based hedge delay
+    llm_hedge_max_ms: float = 8000
+    llm_latency_window: int = 50        # recent successful calls kept per provider
+    llm_latency_prior: float = 3.0      # assumed latency (s) of a provider not yet measured
+    llm_breaker_failures: int = 3       # consecutive failures that open a provider's circuit
+    llm_breaker_cooldown: float = 30.0  # seconds before a single trial request is let through
+
+    # Coach feedback cache
+    coach_cache_size: int = 2048        # in-memory LRU entries
+    coach_cache_ttl: float = 86400.0    # seconds
+    coach_cache_dir: str = ""           # on-disk tier; empty disables it
+    coach_rules_threshold: float = 0.9  # rule-engine confidence that skips the LLM; >1 disables the fast path
+    coach_rules_max_words: int = 12     # rule confidence is discounted for longer transcripts
+
+    # Coach batch endpoint
+    coach_batch_max_items: int = 200    # per POST /coach/batch
+    coach_batch_pack_size: int = 4      # transcripts answered by one LLM prompt
+    coach_batch_concurrency: int = 3    # packs in flight at once
+
+    # Coaching session writes (write-behind, coach/sessions.py)
+    session_batch_size: int = 50        # rows per bulk insert
+    session_flush_interval: float = 2.0 # seconds before a partial batch is written
+    session_max_pending: int = 5000     # queue cap; oldest rows are dropped beyond it
+    session_retries: int = 3            # per batch, with exponential backoff
+
+    # Coaching history
+    history_max_page: int = 100         # sessions per GET /coach/history page
+    history_export_page: int = 500      # rows fetched per round trip by the NDJSON export
+
+    # Personalization
+    faiss_min_rows: int = 2000          # switch a user's index to FAISS at this many mistakes
+    mistake_registry_bytes: int = 64 * 1024 * 1024   # budget for loaded user indexes
+    mistake_flush_batch: int = 32       # buffered adds per user before a forced flush
+    mistake_flush_interval: float = 5.0 # seconds between background flushes
+    tag_half_life_days: float = 14.0    # error-tag weight halves every N days; 0 disables decay
+    tag_score_weighted: bool = False    # weight mistakes with low fluency scores more heavily
+    lesson_reload_interval: float = 300.0   # seconds between lesson catalogue reloads; 0 loads once
+    recommend_batch_max_users: int = 1000   # per POST /recommend/batch
+
     # Whisper
     whisper_model: str = "tiny"
+    asr_engine: str = "remote"          # remote (HF API) | local (in-process Whisper) | auto
+    whisper_int8: bool = True           # int8 dynamic quantisation for the local engine
+    whisper_threads: int = 1            # torch intra-op threads for local inference
+    asr_batch_window_ms: float = 20.0   # how long the scheduler gathers concurrent requests
+    asr_max_batch: int = 8              # utterances per batched inference
+    asr_max_queue: int = 64             # waiting requests before new ones are rejected
+
+    # ASR input limits (checked before any model or network call)
+    asr_max_bytes: int = 10 * 1024 * 1024
+    asr_max_seconds: float = 120.0
+
+    # Streaming ASR (WebSocket) — voice-activity segmentation
+    asr_vad_threshold: float = 300.0    # minimum s16 RMS counted as speech
+    asr_vad_silence_ms: int = 450       # silence that closes a segment
+    asr_max_segment_s: float = 12.0     # force-close long segments
 
-    # Kokoro
+    # Kokoro / TTS
     kokoro_lang: str = "a"
+    tts_engine: str = "auto"            # kokoro | pyttsx3 | auto (kokoro when installed)
+    tts_workers: int = 1                # each worker keeps its own engine resident (pyttsx3: always 1)
+    tts_max_queue: int = 32             # waiting jobs before new ones are rejected
+    tts_cache_bytes: int = 32 * 1024 * 1024        # in-memory synthesized-audio cache
+    tts_cache_dir: str = "/tmp/tts_cache"          # disk tier; empty disables it
+    tts_cache_disk_bytes: int = 512 * 1024 * 1024
+    tts_cache_max_age: int = 86400                 # Cache-Control max-age for clients/CDNs
+    tts_prewarm_file: str = ""                     # newline-separated phrases rendered at startup
+    tts_stream_lookahead: int = 2                  # clauses rendered ahead of the one being streamed
+    tts_encode_workers: int = 2                    # threads waiting on ffmpeg for whole-clip mp3 / Opus
+    tts_mp3_bitrate: str = "48k"                   # mono speech; ~1/8 the size of 24 kHz WAV
+    tts_opus_bitrate: str = "24k"
 
     # App
     debug: bool = False
@@ -1,13 +1,113 @@
 """
 Supabase / PostgreSQL client — singleton pattern, safe for serverless.
+
+supabase-py is synchronous, so async handlers never call it directly: they go
+through `execute()` (or `select_one` / `select_many`), which runs the query on
+a bounded thread pool with a per-call timeout and keeps the event loop free.
+
+DB_BACKEND=local swaps in the in-memory stand-in from common/localdb.py,
+optionally seeded from DB_LOCAL_SEED. It is never chosen implicitly: with the
+default backend a missing SUPABASE_URL / SUPABASE_KEY is an error.
 """
-import os
-from functools import lru_cache
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Optional
+
 from supabase import create_client, Client
 
+from common.config import settings
+from common.localdb import LocalSupabase
+
+logger = logging.getLogger("db")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
 
 @lru_cache(maxsize=1)
 def get_supabase() -> Client:
-    url = os.environ["SUPABASE_URL"]
-    key = os.environ["SUPABASE_KEY"]
-    return create_client(url, key)
+    if settings.db_backend == "local":
+        logger.warning("DB_BACKEND=local — using the in-memory local database")
+        seed = settings.db_local_seed
+        return LocalSupabase.from_file(seed) if seed else LocalSupabase()
+    if settings.db_backend != "supabase":
+        raise ValueError(f"Unknown DB_BACKEND {settings.db_backend!r} (expected supabase or local)")
+    if not settings.supabase_url or not settings.supabase_key:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set (or DB_BACKEND=local)")
+    return create_client(settings.supabase_url, settings.supabase_key)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.db_pool_size, thread_name_prefix="db")
+    return _executor
+
+
+def _run(build: Callable[[Client], Any]) -> Any:
+    return build(get_supabase()).execute().data
+
+
+async def run_blocking(fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+    """
+    Run a blocking data-access call `fn(*args)` on the bounded DB pool.
+    Raises asyncio.TimeoutError after `timeout` (default settings.db_timeout) seconds.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_executor(), partial(fn, *args))
+    return await asyncio.wait_for(future, timeout or settings.db_timeout)
+
+
+async def execute(build: Callable[[Client], Any], timeout: Optional[float] = None) -> Any:
+    """
+    Run `build(client).execute()` off the event loop and return its `.data`.
+    e.g. await execute(lambda sb: sb.table("profiles").update(v).eq("id", uid))
+    Raises asyncio.TimeoutError after `timeout` (default settings.db_timeout) seconds.
+    """
+    return await run_blocking(_run, build, timeout=timeout)
+
+
+async def select_one(table: str, columns: str, timeout: Optional[float] = None, **eq) -> Optional[dict]:
+    """First row of `table` matching every column=value in `eq`, or None."""
+    def build(sb):
+        q = sb.table(table).select(columns)
+        for col, value in eq.items():
+            q = q.eq(col, value)
+        return q.limit(1)
+
+    rows = await execute(build, timeout)
+    return rows[0] if rows else None
+
+
+async def select_many(
+    table: str,
+    columns: str,
+    *,
+    eq: Optional[dict] = None,
+    in_: Optional[tuple[str, list]] = None,
+    order: Optional[str] = None,
+    desc: bool = False,
+    limit: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> list[dict]:
+    def build(sb):
+        q = sb.table(table).select(columns)
+        for col, value in (eq or {}).items():
+            q = q.eq(col, value)
+        if in_ is not None:
+            q = q.in_(in_[0], list(in_[1]))
+        if order:
+            q = q.order(order, desc=desc)
+        if limit is not None:
+            q = q.limit(limit)
+        return q
+
+    return await execute(build, timeout) or []
+
+
+def close_db():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,58 @@
+"""
+Shared upstream HTTP clients — one pooled httpx.AsyncClient per upstream.
+Connections are kept alive between requests (no TCP+TLS handshake per call)
+and closed by the gateway lifespan on shutdown.
+"""
+import logging
+
+import httpx
+
+from common.config import settings
+
+logger = logging.getLogger("http")
+
+HUGGINGFACE = "huggingface"
+GROQ = "groq"
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client(http2: bool) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.http_pool_size,
+            max_keepalive_connections=settings.http_keepalive,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout),
+    )
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Return the pooled client for `upstream`, creating it on first use."""
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        http2 = settings.http2 and _http2_available()
+        client = _build_client(http2)
+        _clients[upstream] = client
+        logger.info(f"Opened pooled HTTP client for {upstream} (http2={http2})")
+    return client
+
+
+async def close_clients():
+    """Close every pooled client. Called once from the gateway lifespan."""
+    for upstream, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Closing {upstream} client failed: {e}")
+    _clients.clear()
@@ -0,0 +1,328 @@
+"""
+In-memory stand-in for Supabase, for tests, offline development and load runs.
+
+Implements the slice of the supabase-py client the services use:
+
+  client.table(name).select("a,b").eq(..).in_(..).lt(..).or_(..).order(..).limit(..).execute()
+  client.table(name).insert(rows) / .update(values).eq(..) / .upsert(rows) / .delete().eq(..)
+  client.rpc(name, params).execute()      — functions registered with `register`;
+                                           update_streak / complete_lessons mirror
+                                           infra/supabase_schema.sql
+
+Inserts into coaching_sessions maintain session_rollups, like the schema's trigger.
+
+Tables are lists of dicts guarded by one lock, so it is safe to call from the
+data-access thread pool. Seed data can be loaded from a JSON file of the form
+{"table": [rows, …]}.
+"""
+
+import copy
+import json
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Callable, Optional
+
+
+class LocalAPIError(Exception):
+    """Mirrors postgrest's APIError for the cases the stand-in can detect."""
+
+
+@dataclass
+class LocalResponse:
+    data: Any
+    count: Optional[int] = None
+
+
+class LocalSupabase:
+    def __init__(self, seed: Optional[dict[str, list[dict]]] = None):
+        self.tables: dict[str, list[dict]] = defaultdict(list)
+        self.functions: dict[str, Callable[["LocalSupabase", dict], Any]] = {}
+        self.lock = threading.RLock()
+        self._ids = defaultdict(int)
+        for table, rows in (seed or {}).items():
+            self.tables[table].extend(copy.deepcopy(rows))
+        self.register("update_streak", _update_streak)
+        self.register("complete_lessons", _complete_lessons)
+        self.triggers: dict[str, list[Callable[["LocalSupabase", list[dict]], None]]] = {
+            "coaching_sessions": [_rollup_sessions],
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "LocalSupabase":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def table(self, name: str) -> "_Query":
+        return _Query(self, name)
+
+    def register(self, name: str, fn: Callable[["LocalSupabase", dict], Any]):
+        """Make `fn(db, params)` callable through rpc(name, params)."""
+        self.functions[name] = fn
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> "_RPC":
+        return _RPC(self, name, params or {})
+
+    def next_id(self, table: str) -> int:
+        self._ids[table] += 1
+        return self._ids[table]
+
+
+def _profile(db: LocalSupabase, user_id) -> Optional[dict]:
+    return next((p for p in db.tables["profiles"] if p.get("id") == user_id), None)
+
+
+def _update_streak(db: LocalSupabase, params: dict):
+    profile = _profile(db, params["p_user_id"])
+    if profile is None:
+        return None
+    today = date.today().isoformat()
+    last = profile.get("last_active_date")
+    if last == today:
+        return None
+    consecutive = last == (date.today() - timedelta(days=1)).isoformat()
+    profile["streak"] = (profile.get("streak") or 0) + 1 if consecutive else 1
+    profile["last_active_date"] = today
+    profile["total_sessions"] = (profile.get("total_sessions") or 0) + 1
+    return None
+
+
+def _complete_lessons(db: LocalSupabase, params: dict) -> list[dict]:
+    profile = _profile(db, params["p_user_id"])
+    if profile is None:
+        return []
+    done = list(profile.get("completed_lessons") or [])
+    for lesson_id in params["p_lesson_ids"]:
+        if lesson_id not in done:
+            done.append(lesson_id)
+    profile["completed_lessons"] = done
+    _update_streak(db, params)
+    return [{
+        "completed_lessons": list(done),
+        "streak": profile["streak"],
+        "total_sessions": profile["total_sessions"],
+    }]
+
+
+def _rollup_sessions(db: LocalSupabase, rows: list[dict]):
+    rollups = db.tables["session_rollups"]
+    for row in rows:
+        day = str(row.get("created_at") or date.today().isoformat())[:10]
+        rollup = next((r for r in rollups if r["user_id"] == row["user_id"] and r["day"] == day), None)
+        if rollup is None:
+            rollup = {"user_id": row["user_id"], "day": day, "sessions": 0, "score_sum": 0,
+                      "scored": 0, "best_score": None, "tag_counts": {}}
+            rollups.append(rollup)
+        rollup["sessions"] += 1
+        score = row.get("score")
+        if score is not None:
+            rollup["score_sum"] += score
+            rollup["scored"] += 1
+            rollup["best_score"] = max(rollup["best_score"] or score, score)
+        for tag in row.get("tags") or []:
+            rollup["tag_counts"][tag] = rollup["tag_counts"].get(tag, 0) + 1
+
+
+class _RPC:
+    def __init__(self, db: LocalSupabase, name: str, params: dict):
+        self.db, self.name, self.params = db, name, params
+
+    def execute(self) -> LocalResponse:
+        fn = self.db.functions.get(self.name)
+        if fn is None:
+            raise LocalAPIError(f"function {self.name} does not exist")
+        with self.db.lock:
+            return LocalResponse(fn(self.db, self.params))
+
+
+_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+
+def _split_top(expr: str) -> list[str]:
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(expr):
+        depth += ch == "("
+        depth -= ch == ")"
+        if ch == "," and depth == 0:
+            parts.append(expr[start:i])
+            start = i + 1
+    parts.append(expr[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_logic(kind: str, expr: str) -> Callable[[dict], bool]:
+    tests = []
+    for part in _split_top(expr):
+        if part.startswith(("and(", "or(")) and part.endswith(")"):
+            inner_kind, inner = part.split("(", 1)
+            tests.append(_parse_logic(inner_kind, inner[:-1]))
+            continue
+        col, op, raw = part.split(".", 2)
+        if op not in _OPS:
+            raise LocalAPIError(f"unsupported operator {op}")
+        tests.append(_compare(col, _OPS[op], raw.strip('"')))
+    combine = any if kind == "or" else all
+    return lambda row: combine(t(row) for t in tests)
+
+
+def _compare(col: str, op: Callable[[Any, Any], bool], raw: str) -> Callable[[dict], bool]:
+    def test(row: dict) -> bool:
+        value = row.get(col)
+        if value is None:
+            return False
+        try:
+            return op(value, type(value)(raw) if isinstance(value, (int, float)) else raw)
+        except (TypeError, ValueError):
+            return False
+    return test
+
+
+class _Query:
+    def __init__(self, db: LocalSupabase, table: str):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns: Optional[list[str]] = None
+        self.payload: Any = None
+        self.filters: list[Callable[[dict], bool]] = []
+        self.ordering: list[tuple[str, bool]] = []
+        self.max_rows: Optional[int] = None
+        self.one: Optional[str] = None
+        self.with_count = False
+
+    # ── operations ──
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "_Query":
+        self.op = "select"
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",") if c.strip()]
+        self.with_count = count is not None
+        return self
+
+    def insert(self, rows) -> "_Query":
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "id") -> "_Query":
+        self.op, self.payload, self.conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, values: dict) -> "_Query":
+        self.op, self.payload = "update", values
+        return self
+
+    def delete(self) -> "_Query":
+        self.op = "delete"
+        return self
+
+    # ── filters / modifiers ──
+    def _where(self, test: Callable[[dict], bool]) -> "_Query":
+        self.filters.append(test)
+        return self
+
+    def eq(self, col, value):
+        return self._where(lambda r: r.get(col) == value)
+
+    def neq(self, col, value):
+        return self._where(lambda r: r.get(col) != value)
+
+    def lt(self, col, value):
+        return self._where(lambda r: r.get(col) is not None and r[col] < value)
+
+    def lte(self, col, value):
+        return self._where(lambda r: r.get(col) is not None and r[col] <= value)
+
+    def gt(self, col, value):
+        return self._where(lambda r: r.get(col) is not None and r[col] > value)
+
+    def gte(self, col, value):
+        return self._where(lambda r: r.get(col) is not None and r[col] >= value)
+
+    def in_(self, col, values):
+        values = list(values)
+        return self._where(lambda r: r.get(col) in values)
+
+    def or_(self, filters: str):
+        """PostgREST logic tree, e.g. "created_at.lt.X,and(created_at.eq.X,id.lt.7)"."""
+        return self._where(_parse_logic("or", filters))
+
+    def order(self, col: str, desc: bool = False):
+        self.ordering.append((col, desc))
+        return self
+
+    def limit(self, n: int):
+        self.max_rows = n
+        return self
+
+    def single(self):
+        self.one = "single"
+        return self
+
+    def maybe_single(self):
+        self.one = "maybe"
+        return self
+
+    # ── execution ──
+    def _matching(self, rows: list[dict]) -> list[dict]:
+        return [r for r in rows if all(f(r) for f in self.filters)]
+
+    def _project(self, row: dict) -> dict:
+        if self.columns is None:
+            return copy.deepcopy(row)
+        return {c: copy.deepcopy(row.get(c)) for c in self.columns}
+
+    def _new_row(self, row: dict) -> dict:
+        row = copy.deepcopy(row)
+        row.setdefault("id", self.db.next_id(self.table))
+        return row
+
+    def execute(self) -> LocalResponse:
+        with self.db.lock:
+            rows = self.db.tables[self.table]
+            if self.op == "insert":
+                new = [self._new_row(r) for r in (self.payload if isinstance(self.payload, list) else [self.payload])]
+                rows.extend(new)
+                for trigger in self.db.triggers.get(self.table, []):
+                    trigger(self.db, new)
+                return LocalResponse(copy.deepcopy(new))
+            if self.op == "upsert":
+                out = []
+                for r in self.payload if isinstance(self.payload, list) else [self.payload]:
+                    existing = next((x for x in rows if x.get(self.conflict) == r.get(self.conflict)), None)
+                    if existing is None:
+                        existing = self._new_row(r)
+                        rows.append(existing)
+                    else:
+                        existing.update(copy.deepcopy(r))
+                    out.append(copy.deepcopy(existing))
+                return LocalResponse(out)
+            if self.op == "update":
+                hit = self._matching(rows)
+                for r in hit:
+                    r.update(copy.deepcopy(self.payload))
+                return LocalResponse(copy.deepcopy(hit))
+            if self.op == "delete":
+                hit = self._matching(rows)
+                self.db.tables[self.table] = [r for r in rows if r not in hit]
+                return LocalResponse(copy.deepcopy(hit))
+
+            hit = self._matching(rows)
+            for col, desc in reversed(self.ordering):
+                hit.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+            total = len(hit)
+            if self.max_rows is not None:
+                hit = hit[: self.max_rows]
+            data = [self._project(r) for r in hit]
+        if self.one == "single":
+            if len(data) != 1:
+                raise LocalAPIError(f"expected a single row from {self.table}, got {len(data)}")
+            return LocalResponse(data[0], total if self.with_count else None)
+        if self.one == "maybe":
+            return LocalResponse(data[0] if data else None, total if self.with_count else None)
+        return LocalResponse(data, total if self.with_count else None)
@@ -0,0 +1,156 @@
+"""
+Read-through cache for `profiles` rows, shared by coach and personalization.
+
+  • LRU with a TTL (profile_cache_ttl) and a size cap (profile_cache_size)
+  • single-flight: concurrent misses for one user share one database fetch
+  • missing profiles are cached too, so unknown users don't hit the DB each time
+  • invalidate(user_id) after any write to the profile; a fetch that was
+    already in flight when the profile changed is not stored
+Lookups are counted by result and the hit ratio is exported as a gauge.
+"""
+
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from prometheus_client import Counter, Gauge
+
+from common.config import settings
+from common.db import select_many, select_one
+
+PROFILE_COLUMNS = "id,level,completed_lessons"
+
+LOOKUPS = Counter("profile_cache_lookups_total", "Profile cache lookups", ["result"])   # hit | miss | shared
+HIT_RATIO = Gauge("profile_cache_hit_ratio", "Share of profile lookups served without a database fetch")
+
+
+async def _load(user_id: str) -> dict:
+    return await select_one("profiles", PROFILE_COLUMNS, id=user_id) or {}
+
+
+async def _load_many(user_ids: list[str]) -> dict[str, dict]:
+    rows = await select_many("profiles", PROFILE_COLUMNS, in_=("id", user_ids))
+    return {row["id"]: row for row in rows}
+
+
+class ProfileCache:
+    def __init__(
+        self,
+        load: Callable[[str], Awaitable[dict]] = _load,
+        load_many: Callable[[list[str]], Awaitable[dict[str, dict]]] = _load_many,
+        max_entries: int = 10000,
+        ttl: float = 60.0,
+    ):
+        self.load = load
+        self.load_many = load_many
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._mem: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.lookups = {"hit": 0, "shared": 0, "miss": 0}
+        self._invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+    def _cached(self, user_id: str) -> Optional[dict]:
+        entry = self._mem.get(user_id)
+        if entry is None:
+            return None
+        stored_at, profile = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._mem[user_id]
+            return None
+        self._mem.move_to_end(user_id)
+        return profile
+
+    def _remember(self, user_id: str, profile: dict):
+        self._mem[user_id] = (time.monotonic(), profile)
+        self._mem.move_to_end(user_id)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _count(self, result: str, n: int = 1):
+        self.lookups[result] += n
+        LOOKUPS.labels(result=result).inc(n)
+
+    async def get(self, user_id: str) -> dict:
+        """The user's profile ({} if there is none). Raises if the fetch fails."""
+        profile = self._cached(user_id)
+        if profile is not None:
+            self._count("hit")
+            return copy.deepcopy(profile)
+        pending = self._inflight.get(user_id)
+        if pending is not None:
+            self._count("shared")
+            return copy.deepcopy(await asyncio.shield(pending))
+
+        self._count("miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            profile = await self.load(user_id)
+            if self._inflight.get(user_id) is future:          # not invalidated meanwhile
+                self._remember(user_id, profile)
+            future.set_result(profile)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()                             # waiters re-raise; don't log it as unretrieved
+            else:
+                future.cancel()
+            raise
+        finally:
+            if self._inflight.get(user_id) is future:
+                del self._inflight[user_id]
+        return copy.deepcopy(profile)
+
+    async def get_many(self, user_ids: list[str]) -> dict[str, dict]:
+        """Profiles for many users; everything not cached is fetched in one query."""
+        profiles: dict[str, dict] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self._cached(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                self._count("hit")
+                profiles[user_id] = copy.deepcopy(profile)
+        if missing:
+            self._count("miss", len(missing))
+            invalidations = self._invalidations
+            loaded = await self.load_many(missing)
+            for user_id in missing:
+                profile = loaded.get(user_id, {})
+                if self._invalidations == invalidations:        # no profile changed meanwhile
+                    self._remember(user_id, profile)
+                profiles[user_id] = copy.deepcopy(profile)
+        return profiles
+
+    def invalidate(self, user_id: str):
+        """Forget the cached profile; call after every write to it."""
+        self._mem.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+        self._invalidations += 1
+
+    def clear(self):
+        self._mem.clear()
+        self._inflight.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = sum(self.lookups.values())
+        return (total - self.lookups["miss"]) / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._mem),
+            **self.lookups,
+            "hit_ratio": round(self.hit_ratio, 3),
+        }
+
+
+profile_cache = ProfileCache(max_entries=settings.profile_cache_size, ttl=settings.profile_cache_ttl)
+HIT_RATIO.set_function(lambda: profile_cache.hit_ratio)
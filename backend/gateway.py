@@ -11,8 +11,12 @@ Routes:
   /health         → Overall health check
 """
 
+import asyncio
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator
 
@@ -22,14 +26,46 @@ from tts.main   import app as tts_app
 from coach.main import app as coach_app
 
 # Personalization routes (lightweight — inline here)
-from personalization.recommender import recommend_lessons, mark_lesson_complete
-from personalization.model import UserMistakeIndex
-from pydantic import BaseModel
+from personalization.recommender import recommend_lessons, recommend_many, mark_lesson_complete, complete_lessons
+from personalization.catalogue import lesson_catalogue
+from personalization.registry import mistake_registry
+from common.http import close_clients
+from common.db import close_db
+from asr.engine import shutdown_engine
+from tts.pool import tts_pool
+from tts.encode import shutdown_encoder
+from coach.sessions import session_writer
+from common.config import settings
+from tts.main import prewarm_from_file
+from pydantic import BaseModel, Field
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted sub-apps don't get their own lifespan — shared resources
+    # (upstream clients, mistake registry, ASR/TTS engines) are owned and torn down here.
+    mistake_registry.start()
+    lesson_catalogue.start()             # loads the lessons table, then hot-reloads it
+    session_writer.start()
+    tts_pool.start()                     # engines warm up before the first request
+    prewarm_task = asyncio.create_task(prewarm_from_file())
+    yield
+    prewarm_task.cancel()
+    await mistake_registry.close()
+    await lesson_catalogue.close()
+    await session_writer.close()         # drain queued coaching sessions
+    await close_clients()
+    close_db()
+    await shutdown_engine()
+    tts_pool.shutdown()
+    shutdown_encoder()
+
 
 gateway = FastAPI(
     title="Spoken English Coach API",
     version="1.0.0",
     description="Open-source spoken English coaching — ASR · TTS · AI Coach",
+    lifespan=lifespan,
 )
 
 gateway.add_middleware(
@@ -59,17 +95,42 @@ class AddMistakeRequest(BaseModel):
     score: int = 5
 
 
+class CompleteLessonsRequest(BaseModel):
+    lesson_ids: list[str] = Field(min_length=1, max_length=500)
+
+
+class RecommendBatchRequest(BaseModel):
+    user_ids: list[str]
+    n: int = 3
+
+
 @gateway.get("/recommend/{user_id}")
-async def get_recommendations(user_id: str, n: int = 3):
-    lessons = await recommend_lessons(user_id, n=n)
+async def get_recommendations(user_id: str, n: int = 3, q: Optional[str] = None):
+    lessons = await recommend_lessons(user_id, n=n, query=q)
     return {"user_id": user_id, "recommendations": lessons}
 
 
+@gateway.post("/recommend/batch")
+async def get_recommendations_batch(req: RecommendBatchRequest):
+    """Recommendations for many users in one pass (email digests, push notifications)."""
+    if len(req.user_ids) > settings.recommend_batch_max_users:
+        raise HTTPException(status_code=400, detail=f"At most {settings.recommend_batch_max_users} users per batch.")
+    recommendations = await recommend_many(req.user_ids, n=max(1, req.n))
+    return {"catalogue_version": lesson_catalogue.version, "recommendations": recommendations}
+
+
+@gateway.post("/recommend/catalogue/reload")
+async def reload_catalogue():
+    changed = await lesson_catalogue.reload()
+    return {"changed": changed, **lesson_catalogue.stats()}
+
+
 @gateway.post("/recommend/mistake")
 async def add_mistake(req: AddMistakeRequest):
-    idx = UserMistakeIndex(req.user_id)
-    idx.add(req.mistake_text, req.tags, req.score)
-    return {"added": True, "total_mistakes": len(idx)}
+    async with mistake_registry.acquire(req.user_id) as idx:
+        idx.add(req.mistake_text, req.tags, req.score, defer=True)
+        total = len(idx)
+    return {"added": True, "total_mistakes": total}
 
 
 @gateway.post("/recommend/complete/{user_id}/{lesson_id}")
@@ -78,6 +139,18 @@ async def complete_lesson(user_id: str, lesson_id: str):
     return {"marked_complete": lesson_id}
 
 
+@gateway.post("/recommend/complete/{user_id}")
+async def complete_lessons_bulk(user_id: str, req: CompleteLessonsRequest):
+    """Sync several completions at once (e.g. from an offline client)."""
+    try:
+        progress = await complete_lessons(user_id, req.lesson_ids)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not record completions: {e}")
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Unknown user")
+    return progress
+
+
 # ── Root health ───────────────────────────────────────────────────────────────
 
 @gateway.get("/health")
@@ -85,6 +158,8 @@ async def health():
     return {
         "status": "ok",
         "services": ["asr", "tts", "coach", "personalization"],
+        "mistake_registry": mistake_registry.stats(),
+        "lesson_catalogue": lesson_catalogue.stats(),
     }
 
 
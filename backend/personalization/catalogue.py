@@ -0,0 +1,170 @@
+"""
+Lesson catalogue — the `lessons` table held in memory as column arrays.
+
+  • loaded from the database (id, title, area, level) at startup and re-read
+    every `lesson_reload_interval` seconds or on demand; a reload only swaps the
+    snapshot when the content version (digest of the rows) changed
+  • each snapshot is immutable, so a request keeps the one it started with
+    while a reload swaps in the next
+  • (area, level) → lesson positions index for direct lookups
+  • ranking is one vectorised pass: a users × lessons score matrix built from
+    per-user area weights, masked by level and completed lessons
+Until the first successful load (or if the table is empty) the built-in
+catalogue below is served.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Optional
+
+import numpy as np
+
+from common.config import settings
+from common.db import select_many
+
+logger = logging.getLogger("catalogue")
+
+BUILTIN_LESSONS = [
+    {"id": "g1", "title": "Subject-Verb Agreement", "area": "grammar", "level": "beginner"},
+    {"id": "g2", "title": "Past Simple vs Present Perfect", "area": "grammar", "level": "intermediate"},
+    {"id": "g3", "title": "Conditional Sentences", "area": "grammar", "level": "advanced"},
+    {"id": "v1", "title": "Common Phrasal Verbs", "area": "vocabulary", "level": "beginner"},
+    {"id": "v2", "title": "Business English Vocabulary", "area": "vocabulary", "level": "intermediate"},
+    {"id": "v3", "title": "Idiomatic Expressions", "area": "vocabulary", "level": "advanced"},
+    {"id": "p1", "title": "Vowel Sounds Practice", "area": "pronunciation", "level": "beginner"},
+    {"id": "p2", "title": "Stress and Rhythm", "area": "pronunciation", "level": "intermediate"},
+    {"id": "p3", "title": "Connected Speech", "area": "pronunciation", "level": "advanced"},
+    {"id": "f1", "title": "Filler Words & Hesitations", "area": "fluency", "level": "beginner"},
+    {"id": "f2", "title": "Storytelling Techniques", "area": "fluency", "level": "intermediate"},
+    {"id": "f3", "title": "Debate & Persuasion", "area": "fluency", "level": "advanced"},
+]
+
+LESSON_COLUMNS = "id,title,area,level"
+
+
+class CatalogueSnapshot:
+    def __init__(self, rows: list[dict]):
+        self.lessons = [{k: row[k] for k in ("id", "title", "area", "level")} for row in rows]
+        self.version = hashlib.sha256(
+            json.dumps(self.lessons, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        self.loaded_at = time.time()
+
+        self.areas = list(dict.fromkeys(lesson["area"] for lesson in self.lessons))
+        self.levels = list(dict.fromkeys(lesson["level"] for lesson in self.lessons))
+        self._area_code = {a: i for i, a in enumerate(self.areas)}
+        self._level_code = {lv: i for i, lv in enumerate(self.levels)}
+        self._position = {lesson["id"]: i for i, lesson in enumerate(self.lessons)}
+        self.area_codes = np.array([self._area_code[lesson["area"]] for lesson in self.lessons], dtype=np.int32)
+        self.level_codes = np.array([self._level_code[lesson["level"]] for lesson in self.lessons], dtype=np.int32)
+
+        self.index: dict[tuple[str, str], list[int]] = {}
+        for i, lesson in enumerate(self.lessons):
+            self.index.setdefault((lesson["area"], lesson["level"]), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.lessons)
+
+    def lookup(self, area: str, level: str) -> list[dict]:
+        return [dict(self.lessons[i]) for i in self.index.get((area, level), [])]
+
+    def rank(
+        self,
+        levels: list[str],
+        completed: list[set[str]],
+        weak_areas: list[list[str]],
+        n: int,
+    ) -> list[list[dict]]:
+        """
+        Top-`n` unfinished lessons at each user's level: lessons in the user's
+        weakest areas first (in the order given), then the rest in catalogue order.
+        """
+        users, size = len(levels), len(self.lessons)
+        if users == 0 or size == 0:
+            return [[] for _ in range(users)]
+
+        # users × areas weights: the first weak area scores highest
+        area_weights = np.zeros((users, len(self.areas)), dtype=np.float64)
+        for u, areas in enumerate(weak_areas):
+            known = [a for a in dict.fromkeys(areas) if a in self._area_code]
+            for rank, area in enumerate(known):
+                area_weights[u, self._area_code[area]] = len(known) - rank
+
+        level_codes = np.array([self._level_code.get(lv, -1) for lv in levels], dtype=np.int32)
+        eligible = level_codes[:, None] == self.level_codes[None, :]
+        for u, done in enumerate(completed):
+            positions = [self._position[i] for i in done if i in self._position]
+            eligible[u, positions] = False
+
+        # area weight dominates; catalogue position breaks ties (earlier first)
+        scores = area_weights[:, self.area_codes] * (size + 1) - np.arange(size)[None, :]
+        scores[~eligible] = -np.inf
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :n]
+
+        results = []
+        for u in range(users):
+            picks = [i for i in top[u] if np.isfinite(scores[u, i])]
+            results.append([dict(self.lessons[i]) for i in picks])
+        return results
+
+
+class LessonCatalogue:
+    def __init__(self, reload_interval: float = 300.0):
+        self.reload_interval = reload_interval
+        self.snapshot = CatalogueSnapshot(BUILTIN_LESSONS)
+        self.source = "builtin"
+        self._reloader: Optional[asyncio.Task] = None
+
+    @property
+    def version(self) -> str:
+        return self.snapshot.version
+
+    async def reload(self) -> bool:
+        """Re-read the lessons table; True if a new version was swapped in."""
+        try:
+            rows = await select_many("lessons", LESSON_COLUMNS, order="id")
+        except Exception as e:
+            logger.warning(f"Lesson catalogue reload failed, keeping {self.version}: {e}")
+            return False
+        if not rows:
+            return False
+        snapshot = CatalogueSnapshot(rows)
+        if snapshot.version == self.version:
+            return False
+        self.snapshot, self.source = snapshot, "database"
+        logger.info(f"Lesson catalogue {snapshot.version} loaded ({len(snapshot)} lessons)")
+        return True
+
+    async def _reload_periodically(self):
+        while True:
+            await self.reload()
+            if self.reload_interval <= 0:               # load once, no hot reload
+                return
+            await asyncio.sleep(self.reload_interval)
+
+    def start(self):
+        if self._reloader is None or self._reloader.done():
+            self._reloader = asyncio.create_task(self._reload_periodically())
+
+    async def close(self):
+        if self._reloader is not None:
+            self._reloader.cancel()
+            try:
+                await self._reloader
+            except asyncio.CancelledError:
+                pass
+            self._reloader = None
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "lessons": len(self.snapshot),
+            "loaded_at": self.snapshot.loaded_at,
+        }
+
+
+lesson_catalogue = LessonCatalogue(reload_interval=settings.lesson_reload_interval)
@@ -1,46 +1,201 @@
 """
-Personalization — simplified version without FAISS dependency.
-Uses simple in-memory storage for mistake tracking.
+Personalization — per-user mistake index with vector similarity search.
+
+Mistake rows for all users live in one SQLite store (personalization/store.py).
+Each mistake is also embedded into a fixed-size float32 vector (hashed
+character n-grams + words, L2-normalised — no model download, a few µs per
+sentence). Vectors are written to a contiguous per-user matrix on disk and
+searched through a read-only np.memmap, so history never has to be loaded into
+Python objects; only the top-k hits are fetched from the store. Large
+histories switch to a FAISS inner-product index when `faiss` is installed.
 """
 
 import json
 import os
+import re
+import zlib
 from pathlib import Path
-from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from common.config import settings
+from personalization.store import MistakeStore, get_store
 
 INDEX_DIR = Path(os.getenv("FAISS_INDEX_DIR", "/tmp/faiss_indexes"))
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
 
+STORE_FILE = "mistakes.db"
+EMBED_DIM = 256
+ROW_BYTES = EMBED_DIM * 4
+NGRAM_SIZES = (3, 4)
+
+try:
+    import faiss
+except ImportError:  # optional — numpy search is used instead
+    faiss = None
+
+
+def embed(text: str) -> np.ndarray:
+    """Feature-hashed embedding of a sentence (char n-grams + words)."""
+    vec = np.zeros(EMBED_DIM, dtype=np.float32)
+    norm = re.sub(r"\s+", " ", text.casefold()).strip()
+    padded = f" {norm} "
+    features = norm.split(" ")
+    for n in NGRAM_SIZES:
+        features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    for feat in features:
+        h = zlib.crc32(feat.encode("utf-8"))
+        vec[h % EMBED_DIM] += 1.0 if h & 0x80000000 else -1.0
+    length = np.linalg.norm(vec)
+    return vec / length if length else vec
+
+
+def mistake_store() -> MistakeStore:
+    """The shared store behind every user's index."""
+    return get_store(INDEX_DIR / STORE_FILE)
+
 
 class UserMistakeIndex:
-    """Per-user mistake index stored as JSON (no FAISS needed)."""
+    """Per-user view over the shared mistake store + memory-mapped float32 embeddings."""
 
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.meta_path = INDEX_DIR / f"{user_id}.json"
-        self._meta: list[dict] = []
+        self.store = mistake_store()
+        self.meta_path = INDEX_DIR / f"{user_id}.json"     # legacy per-user history
+        self.index_path = INDEX_DIR / f"{user_id}.f32"
+        self._count = self.store.count(user_id)
+        self._pending: list[tuple[str, list[str], int, bytes]] = []   # write-behind rows
+        self._matrix = None            # np.memmap view, reopened after appends
+        self._faiss = None
+        self._faiss_rows = 0
         self._load()
 
     def _load(self):
         if self.meta_path.exists():
-            try:
-                self._meta = json.loads(self.meta_path.read_text())
-            except Exception:
-                self._meta = []
+            self._migrate_legacy_json()
+        self._sync_vectors()
+
+    def _migrate_legacy_json(self):
+        """Import a pre-SQLite `{user_id}.json` history once, then retire the file."""
+        try:
+            legacy = json.loads(self.meta_path.read_text())
+        except Exception:
+            legacy = []
+        if legacy and self._count == 0:
+            self._count = self.store.append(self.user_id, (
+                (m["text"], m.get("tags", []), m.get("score"), embed(m["text"]).tobytes())
+                for m in legacy
+            ))
+        self.meta_path.rename(self.meta_path.with_suffix(".json.migrated"))
 
-    def _save(self):
-        self.meta_path.write_text(json.dumps(self._meta))
+    def _rows_on_disk(self) -> int:
+        if not self.index_path.exists():
+            return 0
+        return self.index_path.stat().st_size // ROW_BYTES
 
-    def add(self, mistake_text: str, tags: list[str], score: int):
-        self._meta.append({"text": mistake_text, "tags": tags, "score": score})
-        self._save()
+    def _sync_vectors(self):
+        """Bring the vector file in line with the store (missing rows, torn writes)."""
+        rows = self._rows_on_disk()
+        if rows > self._count:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(self._count * ROW_BYTES)
+        elif rows < self._count:
+            for seq, text, blob in self.store.embeddings_after(self.user_id, rows):
+                self._write_vector(seq, blob if blob else embed(text).tobytes())
+
+    def _write_vector(self, seq: int, blob: bytes):
+        # Positional write: row seq-1 always holds the same bytes, so two
+        # writers syncing the same rows can't corrupt or misalign the file.
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, blob, (seq - 1) * ROW_BYTES)
+        finally:
+            os.close(fd)
+        self._matrix = None
+
+    def _vectors(self) -> np.ndarray:
+        n = self._count
+        if self._matrix is None or self._matrix.shape[0] != n:
+            if self._rows_on_disk() < n:
+                self._sync_vectors()
+            self._matrix = np.memmap(self.index_path, dtype=np.float32, mode="r", shape=(n, EMBED_DIM))
+        return self._matrix
+
+    def add(self, mistake_text: str, tags: list[str], score: int, defer: bool = False):
+        """Record a mistake. With defer=True the row is buffered until flush()."""
+        self._pending.append((mistake_text, tags, score, embed(mistake_text).tobytes()))
+        if not defer:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows to the store in one transaction and index their vectors."""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            first = self.store.append(self.user_id, rows) - len(rows) + 1
+        except Exception:
+            self._pending = rows + self._pending
+            raise
+        if first != self._count + 1:
+            # Another writer added rows since we last looked — pull them in too.
+            self._count = first + len(rows) - 1
+            self._sync_vectors()
+            return
+        for offset, (_, _, _, blob) in enumerate(rows):
+            self._write_vector(first + offset, blob)
+        self._count = first + len(rows) - 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident bytes: mapped vectors, FAISS copy and buffered rows."""
+        size = self._count * ROW_BYTES if self._matrix is not None else 0
+        size += self._faiss_rows * ROW_BYTES
+        size += sum(ROW_BYTES + len(text) + 64 for text, *_ in self._pending)
+        return size
+
+    def _top_k(self, query_vec: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        n = self._count
+        if faiss is not None and n >= settings.faiss_min_rows:
+            if self._faiss is None:
+                self._faiss = faiss.IndexFlatIP(EMBED_DIM)
+                self._faiss_rows = 0
+            if self._faiss_rows < n:
+                self._faiss.add(np.ascontiguousarray(self._vectors()[self._faiss_rows:n]))
+                self._faiss_rows = n
+            scores, ids = self._faiss.search(query_vec[None, :], k)
+            return ids[0], scores[0]
+
+        scores = self._vectors() @ query_vec
+        if k < n:
+            ids = np.argpartition(-scores, k - 1)[:k]
+        else:
+            ids = np.arange(n)
+        ids = ids[np.argsort(-scores[ids], kind="stable")]
+        return ids, scores[ids]
 
     def search(self, query: str, k: int = 5) -> list[dict]:
-        return self._meta[-k:] if self._meta else []
+        """Return the k most similar past mistakes, best first, with a `similarity` score."""
+        self.flush()
+        if not self._count or k <= 0:
+            return []
+        ids, scores = self._top_k(embed(query), min(k, self._count))
+        hits = [(i + 1, s) for i, s in zip(ids.tolist(), scores.tolist()) if i >= 0]
+        meta = self.store.get(self.user_id, [seq for seq, _ in hits])
+        return [{**meta[seq], "similarity": float(s)} for seq, s in hits if seq in meta]
 
     def frequent_errors(self, top_n: int = 3) -> list[str]:
-        all_tags = [tag for m in self._meta for tag in m.get("tags", [])]
-        return [t for t, _ in Counter(all_tags).most_common(top_n)]
+        """The user's current weak areas, by time-decayed tag weight."""
+        return [t for t, _ in self.tag_weights(top_n)]
+
+    def tag_weights(self, top_n: Optional[int] = None) -> list[tuple[str, float]]:
+        self.flush()
+        return self.store.tag_weights(self.user_id, top_n)
 
     def __len__(self):
-        return len(self._meta)
+        return self._count + len(self._pending)
@@ -5,96 +5,105 @@ to generate personalised lesson plans.
 """
 
 from __future__ import annotations
+import asyncio
 import logging
 from typing import Optional
 
-from common.db import get_supabase
-from personalization.model import UserMistakeIndex
+from common.db import execute
+from common.profiles import profile_cache
+from personalization.catalogue import lesson_catalogue
+from personalization.model import UserMistakeIndex, mistake_store
+from personalization.registry import mistake_registry
 
 logger = logging.getLogger("recommender")
 
-# ── Lesson Catalogue (static for prototype) ──────────────────────────────────
-
-LESSONS = {
-    "grammar": [
-        {"id": "g1", "title": "Subject-Verb Agreement", "level": "beginner"},
-        {"id": "g2", "title": "Past Simple vs Present Perfect", "level": "intermediate"},
-        {"id": "g3", "title": "Conditional Sentences", "level": "advanced"},
-    ],
-    "vocabulary": [
-        {"id": "v1", "title": "Common Phrasal Verbs", "level": "beginner"},
-        {"id": "v2", "title": "Business English Vocabulary", "level": "intermediate"},
-        {"id": "v3", "title": "Idiomatic Expressions", "level": "advanced"},
-    ],
-    "pronunciation": [
-        {"id": "p1", "title": "Vowel Sounds Practice", "level": "beginner"},
-        {"id": "p2", "title": "Stress and Rhythm", "level": "intermediate"},
-        {"id": "p3", "title": "Connected Speech", "level": "advanced"},
-    ],
-    "fluency": [
-        {"id": "f1", "title": "Filler Words & Hesitations", "level": "beginner"},
-        {"id": "f2", "title": "Storytelling Techniques", "level": "intermediate"},
-        {"id": "f3", "title": "Debate & Persuasion", "level": "advanced"},
-    ],
-}
-
 
 async def get_user_profile(user_id: str) -> dict:
     try:
-        sb = get_supabase()
-        r = sb.table("profiles").select("*").eq("id", user_id).single().execute()
-        return r.data or {}
+        return await profile_cache.get(user_id)
     except Exception as e:
         logger.warning(f"Profile fetch failed: {e}")
         return {}
 
 
-async def recommend_lessons(user_id: str, n: int = 3) -> list[dict]:
+def _similar_mistake_areas(idx: UserMistakeIndex, query: str, k: int = 10) -> list[str]:
+    """Error tags of the past mistakes most similar to `query`, weighted by similarity."""
+    weights: dict[str, float] = {}
+    for m in idx.search(query, k=k):
+        for tag in m.get("tags", []):
+            weights[tag] = weights.get(tag, 0.0) + max(m["similarity"], 0.0)
+    return sorted(weights, key=weights.get, reverse=True)
+
+
+async def _weak_areas(user_id: str, query: Optional[str] = None) -> list[str]:
+    async with mistake_registry.acquire(user_id) as idx:
+        if len(idx) == 0:
+            return []
+        # embedding, vector scan and SQLite reads all block — keep them off the event loop
+        weak_areas = await asyncio.to_thread(_similar_mistake_areas, idx, query) if query else []
+        return weak_areas or [tag for tag, _ in await asyncio.to_thread(idx.tag_weights, 4)]
+
+
+async def _weak_areas_many(user_ids: list[str]) -> list[list[str]]:
+    """
+    Top error tags of many users from one store query, without loading their
+    indexes into the registry; adds still buffered for loaded users are flushed first.
+    """
+    await mistake_registry.flush(user_ids)
+    weights = await asyncio.to_thread(mistake_store().tag_weights_many, user_ids, 4)
+    return [[tag for tag, _ in weights[user_id]] for user_id in user_ids]
+
+
+async def recommend_lessons(user_id: str, n: int = 3, query: Optional[str] = None) -> list[dict]:
     """
     Recommend top-N lessons based on:
-    1. User's frequent error tags (from FAISS index)
+    1. User's past mistakes most similar to `query` (if given), else their
+       current weak areas (time-decayed error-tag weights from the mistake store)
     2. User's level (from Supabase profile)
     3. Lessons not yet completed
     """
     profile = await get_user_profile(user_id)
-    level    = profile.get("level", "beginner")
-    done_ids = set(profile.get("completed_lessons", []))
-
-    idx = UserMistakeIndex(user_id)
-    weak_areas = idx.frequent_errors(top_n=4) if len(idx) > 0 else list(LESSONS.keys())
-
-    recommendations = []
-    for area in weak_areas:
-        for lesson in LESSONS.get(area, []):
-            if lesson["id"] not in done_ids and lesson["level"] == level:
-                lesson_copy = lesson.copy()
-                lesson_copy["area"] = area
-                recommendations.append(lesson_copy)
-                if len(recommendations) >= n:
-                    return recommendations
-
-    # Fill remaining slots with any unfinished lessons at the right level
-    for area, lessons in LESSONS.items():
-        for lesson in lessons:
-            if lesson["id"] not in done_ids and lesson["level"] == level:
-                lesson_copy = lesson.copy()
-                lesson_copy["area"] = area
-                if lesson_copy not in recommendations:
-                    recommendations.append(lesson_copy)
-                if len(recommendations) >= n:
-                    return recommendations
-
-    return recommendations[:n]
+    weak_areas = await _weak_areas(user_id, query)
+    return lesson_catalogue.snapshot.rank(
+        [profile.get("level") or "beginner"],
+        [set(profile.get("completed_lessons") or [])],
+        [weak_areas],
+        n,
+    )[0]
+
+
+async def recommend_many(user_ids: list[str], n: int = 3) -> dict[str, list[dict]]:
+    """Recommendations for many users: one profile query, one tag query and one ranking pass."""
+    user_ids = list(dict.fromkeys(user_ids))
+    try:
+        profiles = await profile_cache.get_many(user_ids)
+    except Exception as e:
+        logger.warning(f"Batch profile fetch failed: {e}")
+        profiles = dict.fromkeys(user_ids, {})
+    weak_areas = await _weak_areas_many(user_ids)
+    ranked = lesson_catalogue.snapshot.rank(
+        [profiles[u].get("level") or "beginner" for u in user_ids],
+        [set(profiles[u].get("completed_lessons") or []) for u in user_ids],
+        weak_areas,
+        n,
+    )
+    return dict(zip(user_ids, ranked))
+
+
+async def complete_lessons(user_id: str, lesson_ids: list[str]) -> Optional[dict]:
+    """
+    Append `lesson_ids` to the user's completed lessons and bump their streak —
+    one atomic round trip (complete_lessons() in infra/supabase_schema.sql).
+    Returns {completed_lessons, streak, total_sessions}, or None for an unknown user.
+    """
+    rows = await execute(lambda sb: sb.rpc("complete_lessons", {"p_user_id": user_id, "p_lesson_ids": lesson_ids}))
+    profile_cache.invalidate(user_id)
+    return rows[0] if rows else None
 
 
 async def mark_lesson_complete(user_id: str, lesson_id: str):
     """Mark a lesson as complete in the user's Supabase profile."""
     try:
-        sb = get_supabase()
-        profile = (await get_user_profile(user_id))
-        done = profile.get("completed_lessons", [])
-        if lesson_id not in done:
-            done.append(lesson_id)
-        sb.table("profiles").update({"completed_lessons": done}).eq("id", user_id).execute()
+        await complete_lessons(user_id, [lesson_id])
     except Exception as e:
         logger.error(f"Failed to mark lesson complete: {e}")
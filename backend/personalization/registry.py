@@ -0,0 +1,130 @@
+"""
+Process-wide registry of loaded UserMistakeIndex objects.
+
+  • hot user indexes stay loaded between requests (no reload per call)
+  • a byte budget with LRU eviction keeps the registry inside the 512 MB box
+  • one asyncio.Lock per user serialises concurrent adds/reads
+  • adds are buffered (write-behind) and flushed in batches, on eviction,
+    periodically and on gateway shutdown
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, Optional
+
+from prometheus_client import Gauge
+
+from common.config import settings
+from personalization.model import UserMistakeIndex
+
+logger = logging.getLogger("personalization.registry")
+
+REGISTRY_BYTES = Gauge("mistake_registry_bytes", "Approximate bytes held by loaded mistake indexes")
+REGISTRY_INDEXES = Gauge("mistake_registry_indexes", "Number of loaded mistake indexes")
+
+
+class IndexRegistry:
+    def __init__(self, max_bytes: int, flush_batch: int = 32, flush_interval: float = 5.0):
+        self.max_bytes = max_bytes
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._indexes: OrderedDict[str, UserMistakeIndex] = OrderedDict()
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.evictions = 0
+
+    def _lock_for(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def acquire(self, user_id: str) -> AsyncIterator[UserMistakeIndex]:
+        """Hold the user's lock and yield their (possibly freshly loaded) index."""
+        async with self._lock_for(user_id):
+            idx = self._indexes.get(user_id)
+            if idx is None:
+                idx = await asyncio.to_thread(UserMistakeIndex, user_id)
+                self._indexes[user_id] = idx
+            self._indexes.move_to_end(user_id)
+            yield idx
+            if idx.pending >= self.flush_batch:
+                await asyncio.to_thread(idx.flush)
+        await self._enforce_budget()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(idx.nbytes for idx in self._indexes.values())
+
+    def _report(self):
+        REGISTRY_BYTES.set(self.nbytes)
+        REGISTRY_INDEXES.set(len(self._indexes))
+
+    async def _enforce_budget(self):
+        for user_id in list(self._indexes):
+            if self.nbytes <= self.max_bytes or len(self._indexes) <= 1:
+                break
+            lock = self._lock_for(user_id)
+            if lock.locked():
+                continue                      # in use — try the next-oldest
+            async with lock:
+                idx = self._indexes.get(user_id)
+                if idx is None:
+                    continue
+                await asyncio.to_thread(idx.flush)
+                del self._indexes[user_id]
+                self.evictions += 1
+            if not lock.locked():
+                self._locks.pop(user_id, None)
+        self._report()
+
+    async def flush(self, user_ids: Optional[Iterable[str]] = None):
+        """Flush buffered adds to the store — every loaded index, or only those of `user_ids`."""
+        targets = list(self._indexes) if user_ids is None else [u for u in user_ids if u in self._indexes]
+        for user_id in targets:
+            async with self._lock_for(user_id):
+                idx = self._indexes.get(user_id)
+                if idx is not None and idx.pending:
+                    try:
+                        await asyncio.to_thread(idx.flush)
+                    except Exception as e:
+                        logger.error(f"Mistake flush failed for {user_id}: {e}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the background flusher and write out everything still buffered."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "indexes": len(self._indexes),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "pending": sum(idx.pending for idx in self._indexes.values()),
+            "evictions": self.evictions,
+        }
+
+
+mistake_registry = IndexRegistry(
+    max_bytes=settings.mistake_registry_bytes,
+    flush_batch=settings.mistake_flush_batch,
+    flush_interval=settings.mistake_flush_interval,
+)
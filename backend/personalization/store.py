@@ -0,0 +1,225 @@
+"""
+Embedded mistake store — one SQLite database (WAL mode) for every user.
+
+  mistakes(user_id, seq, text, tags, score, created_at, embedding)
+  PRIMARY KEY (user_id, seq)  →  indexed per-user reads, O(log n) appends
+
+`seq` is a dense per-user sequence (1, 2, 3…) allocated inside the insert
+transaction, so concurrent writers serialise on SQLite's write lock instead of
+overwriting each other. Row `seq` of a user's memory-mapped vector file is
+`seq - 1`, which lets the vector file be rebuilt from the store at any time.
+
+  tag_stats(user_id, tag, weight, count, updated_at)
+
+Per-user error-tag statistics, updated in the same transaction as each insert
+(O(tags per mistake), independent of history length). `weight` decays
+exponentially with the configured half-life: it is stored as of `updated_at`
+and decayed forward lazily on the next update or read.
+"""
+
+import json
+import math
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional
+
+from common.config import settings
+
+SCHEMA = """
+create table if not exists mistakes (
+  user_id     text    not null,
+  seq         integer not null,
+  text        text    not null,
+  tags        text    not null default '[]',     -- JSON array
+  score       integer,
+  created_at  real    not null,
+  embedding   blob,                              -- float32[EMBED_DIM]
+  primary key (user_id, seq)
+) without rowid;
+
+create table if not exists tag_stats (
+  user_id     text    not null,
+  tag         text    not null,
+  weight      real    not null,                  -- decayed weight as of updated_at
+  count       integer not null,                  -- raw, undecayed occurrences
+  updated_at  real    not null,
+  primary key (user_id, tag)
+) without rowid;
+"""
+
+
+class MistakeStore:
+    def __init__(self, path: Path, half_life_days: float = 14.0, score_weighted: bool = False):
+        self.path = Path(path)
+        self.half_life = half_life_days * 86400.0
+        self.score_weighted = score_weighted
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute("pragma busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        self._backfill_tag_stats()
+
+    # ── tag statistics ──────────────────────────────────────────────────────
+
+    def _decay(self, elapsed: float) -> float:
+        if self.half_life <= 0 or elapsed <= 0:
+            return 1.0
+        return math.exp(-math.log(2) * elapsed / self.half_life)
+
+    def _mistake_weight(self, score: Optional[int]) -> float:
+        """Low fluency scores mark worse mistakes, so they count more when weighting is on."""
+        if not self.score_weighted or score is None:
+            return 1.0
+        return min(1.0, max(0.1, (11 - score) / 10))
+
+    def _bump_tags(self, user_id: str, tags: list[str], weight: float, at: float):
+        for tag in set(tags):
+            row = self._conn.execute(
+                "select weight, count, updated_at from tag_stats where user_id = ? and tag = ?",
+                (user_id, tag),
+            ).fetchone()
+            if row:
+                old_weight, count, updated_at = row
+                new_weight = old_weight * self._decay(at - updated_at) + weight
+                stamp = max(at, updated_at)
+            else:
+                new_weight, count, stamp = weight, 0, at
+            self._conn.execute(
+                "insert or replace into tag_stats (user_id, tag, weight, count, updated_at) "
+                "values (?, ?, ?, ?, ?)",
+                (user_id, tag, new_weight, count + 1, stamp),
+            )
+
+    def _backfill_tag_stats(self):
+        """One-off: derive tag_stats for mistakes recorded before the table existed."""
+        has_stats = self._conn.execute("select 1 from tag_stats limit 1").fetchone()
+        has_rows = self._conn.execute("select 1 from mistakes limit 1").fetchone()
+        if has_stats or not has_rows:
+            return
+        self._conn.execute("begin immediate")
+        try:
+            for user_id, tags, score, created_at in self._conn.execute(
+                "select user_id, tags, score, created_at from mistakes order by user_id, seq"
+            ).fetchall():
+                self._bump_tags(user_id, json.loads(tags), self._mistake_weight(score), created_at)
+            self._conn.execute("commit")
+        except BaseException:
+            self._conn.execute("rollback")
+            raise
+
+    def append(self, user_id: str, rows: Iterable[tuple[str, list[str], int, Optional[bytes]]]) -> int:
+        """Append (text, tags, score, embedding) rows for one user; returns the new count."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("begin immediate")
+            try:
+                seq = self._max_seq(user_id)
+                for text, tags, score, embedding in rows:
+                    seq += 1
+                    self._conn.execute(
+                        "insert into mistakes (user_id, seq, text, tags, score, created_at, embedding) "
+                        "values (?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, seq, text, json.dumps(tags), score, now, embedding),
+                    )
+                    self._bump_tags(user_id, tags, self._mistake_weight(score), now)
+                self._conn.execute("commit")
+            except BaseException:
+                self._conn.execute("rollback")
+                raise
+        return seq
+
+    def _max_seq(self, user_id: str) -> int:
+        row = self._conn.execute(
+            "select coalesce(max(seq), 0) from mistakes where user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self._max_seq(user_id)
+
+    def get(self, user_id: str, seqs: list[int]) -> dict[int, dict]:
+        """Fetch metadata for specific sequence numbers of one user."""
+        if not seqs:
+            return {}
+        marks = ",".join("?" * len(seqs))
+        with self._lock:
+            rows = self._conn.execute(
+                f"select seq, text, tags, score, created_at from mistakes "
+                f"where user_id = ? and seq in ({marks})",
+                (user_id, *seqs),
+            ).fetchall()
+        return {
+            seq: {"text": text, "tags": json.loads(tags), "score": score, "created_at": created_at}
+            for seq, text, tags, score, created_at in rows
+        }
+
+    def embeddings_after(self, user_id: str, seq: int) -> list[tuple[int, str, Optional[bytes]]]:
+        """(seq, text, embedding) for every row of a user past `seq`, in order."""
+        with self._lock:
+            return self._conn.execute(
+                "select seq, text, embedding from mistakes where user_id = ? and seq > ? order by seq",
+                (user_id, seq),
+            ).fetchall()
+
+    def tag_counts(self, user_id: str, top_n: Optional[int] = None) -> list[tuple[str, int]]:
+        """Most common error tags of a user (raw counts, no decay)."""
+        with self._lock:
+            return self._conn.execute(
+                "select tag, count from tag_stats where user_id = ? "
+                "order by count desc, tag limit ?",
+                (user_id, top_n if top_n is not None else -1),
+            ).fetchall()
+
+    def tag_weights(self, user_id: str, top_n: Optional[int] = None,
+                    now: Optional[float] = None) -> list[tuple[str, float]]:
+        """Error tags of a user ranked by time-decayed (optionally score-weighted) weight."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._conn.execute(
+                "select tag, weight, updated_at from tag_stats where user_id = ?", (user_id,)
+            ).fetchall()
+        weights = sorted(
+            ((tag, weight * self._decay(now - updated_at)) for tag, weight, updated_at in rows),
+            key=lambda tw: (-tw[1], tw[0]),
+        )
+        return weights[:top_n] if top_n is not None else weights
+
+    def tag_weights_many(self, user_ids: list[str], top_n: Optional[int] = None,
+                         now: Optional[float] = None) -> dict[str, list[tuple[str, float]]]:
+        """tag_weights() for many users, read with one `user_id in (…)` query per 500 users."""
+        now = time.time() if now is None else now
+        user_ids = list(dict.fromkeys(user_ids))
+        found: dict[str, list[tuple[str, float]]] = {user_id: [] for user_id in user_ids}
+        with self._lock:
+            for i in range(0, len(user_ids), 500):          # under SQLite's bound-parameter limit
+                chunk = user_ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for user_id, tag, weight, updated_at in self._conn.execute(
+                    f"select user_id, tag, weight, updated_at from tag_stats where user_id in ({marks})",
+                    chunk,
+                ):
+                    found[user_id].append((tag, weight * self._decay(now - updated_at)))
+        for user_id, weights in found.items():
+            weights.sort(key=lambda tw: (-tw[1], tw[0]))
+            found[user_id] = weights[:top_n] if top_n is not None else weights
+        return found
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+@lru_cache(maxsize=None)
+def get_store(path: Path) -> MistakeStore:
+    return MistakeStore(
+        path,
+        half_life_days=settings.tag_half_life_days,
+        score_weighted=settings.tag_score_weighted,
+    )
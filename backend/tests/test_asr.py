@@ -4,8 +4,14 @@ import io
 import wave
 import struct
 import pytest
+import numpy as np
+from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
-from asr.main import app, transcribe_whisper
+from asr.main import app, transcribe, transcribe_whisper
+from asr.streaming import VADSegmenter, SAMPLE_RATE, decoder_available, is_container, pcm_to_wav
+from asr.batching import MicroBatcher, QueueFullError
+from asr.audio import AudioError, AudioTooLarge, preprocess
+from common.config import settings
 
 client = TestClient(app)
 
@@ -47,6 +53,17 @@ async def test_whisper_returns_string():
     assert "language" in result
 
 
+@pytest.mark.asyncio
+async def test_local_engine_falls_back_to_remote():
+    with patch("asr.main.use_local_engine", return_value=True), \
+         patch("asr.main.transcribe_local", new_callable=AsyncMock, side_effect=RuntimeError("no model")), \
+         patch("asr.main.transcribe_hf", new_callable=AsyncMock,
+               return_value={"text": "hi", "language": "en", "segments": []}) as mock_hf:
+        result = await transcribe(pcm_to_wav(_tone_pcm(0.5)))
+    assert result["text"] == "hi"
+    mock_hf.assert_awaited_once()
+
+
 def test_transcribe_invalid_audio():
     """Garbage bytes should not crash the service."""
     resp = client.post("/asr/transcribe", content=b"not_audio_data")
@@ -54,6 +71,200 @@ def test_transcribe_invalid_audio():
     assert resp.status_code in (200, 500)
 
 
+# ── Preprocessing ────────────────────────────────────────────────────────────
+
+def _wav(samples: np.ndarray, rate: int, channels: int = 1) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def test_preprocess_resamples_downmixes_and_trims():
+    rate = 48000
+    t = np.arange(rate) / rate
+    tone = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    quiet = np.zeros(rate // 2, dtype=np.int16)
+    mono = np.concatenate([quiet, tone, quiet])
+    stereo = np.repeat(mono, 2)                             # interleaved L/R
+    audio = preprocess(_wav(stereo, rate, channels=2))
+    assert audio.dtype == np.float32
+    assert 1.0 <= audio.size / SAMPLE_RATE < 1.5            # silence trimmed, 16 kHz
+    assert abs(float(np.max(np.abs(audio))) - 0.9) < 0.01   # gain normalised
+
+
+def test_preprocess_keeps_quiet_speech():
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tone = (100 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)    # RMS ≈ 0.002
+    quiet = np.zeros(SAMPLE_RATE // 2, dtype=np.int16)
+    audio = preprocess(_wav(np.concatenate([quiet, tone, quiet]), SAMPLE_RATE))
+    assert 1.0 <= audio.size / SAMPLE_RATE < 1.5
+
+
+def test_float_wav_falls_back_to_ffmpeg():
+    samples = np.zeros(1600, dtype="<f4").tobytes()
+    fmt = struct.pack("<HHIIHH", 3, 1, SAMPLE_RATE, SAMPLE_RATE * 4, 4, 32)     # WAVE_FORMAT_IEEE_FLOAT
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(samples)) + samples
+    float_wav = b"RIFF" + struct.pack("<I", len(body)) + body
+    with patch("asr.audio._decode_ffmpeg", return_value=np.zeros(1600, dtype=np.float32)) as ffmpeg:
+        assert preprocess(float_wav).size == 0
+    ffmpeg.assert_called_once_with(float_wav)
+
+
+def test_noise_only_input_stays_silent():
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 100, 2 * SAMPLE_RATE)                      # RMS ≈ 0.003 hiss, no speech
+    assert preprocess(_wav(noise, SAMPLE_RATE)).size == 0
+    noise[SAMPLE_RATE // 2: SAMPLE_RATE] += 1500 * np.sin(np.arange(SAMPLE_RATE // 2) / 5)
+    audio = preprocess(_wav(noise, SAMPLE_RATE))
+    assert 0.5 <= audio.size / SAMPLE_RATE < 1.0
+
+
+def test_duration_limit_checked_before_samples_are_decoded():
+    with patch.object(settings, "asr_max_seconds", 0.5), \
+         patch("wave.Wave_read.readframes", side_effect=AssertionError("samples read")):
+        with pytest.raises(AudioTooLarge):
+            preprocess(_make_silence_wav(1.0))
+    too_long = np.zeros(int(1.2 * SAMPLE_RATE), dtype="<f4").tobytes()
+    with patch.object(settings, "asr_max_seconds", 1.0), \
+         patch("asr.audio.subprocess.run") as run:
+        run.return_value.stdout = too_long                      # ffmpeg stopped at the -t cap
+        with pytest.raises(AudioTooLarge):
+            preprocess(b"OggS" + b"\0" * 100)
+    args = run.call_args.args[0]
+    assert args[args.index("-t") + 1] == "1.5"
+
+
+def test_preprocess_silence_is_empty():
+    assert preprocess(_make_silence_wav(2.0)).size == 0
+
+
+def test_preprocess_rejects_oversized_and_invalid():
+    with patch.object(settings, "asr_max_bytes", 100):
+        with pytest.raises(AudioTooLarge):
+            preprocess(_make_silence_wav(1.0))
+    with pytest.raises(AudioError):
+        preprocess(b"RIFF\x00\x00\x00\x00WAVEgarbage")
+
+
+@pytest.mark.asyncio
+async def test_silence_short_circuits_before_upstream():
+    with patch("asr.main.transcribe_hf", new_callable=AsyncMock) as mock_hf:
+        result = await transcribe(_make_silence_wav(2.0))
+    assert result["text"] == ""
+    mock_hf.assert_not_awaited()
+
+
+# ── Streaming (VAD) ──────────────────────────────────────────────────────────
+
+def _tone_pcm(duration_s: float, amplitude: int = 6000) -> bytes:
+    t = np.arange(int(SAMPLE_RATE * duration_s)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+
+
+def _silence_pcm(duration_s: float) -> bytes:
+    return b"\x00\x00" * int(SAMPLE_RATE * duration_s)
+
+
+def test_vad_splits_speech_on_pauses():
+    seg = VADSegmenter(silence_ms=300)
+    stream = _tone_pcm(0.6) + _silence_pcm(0.5) + _tone_pcm(0.8) + _silence_pcm(0.2)
+    segments = []
+    for off in range(0, len(stream), 3200):            # 100 ms chunks
+        segments += seg.feed(stream[off:off + 3200])
+    segments += seg.flush()
+    assert [s.index for s in segments] == [0, 1]
+    assert segments[0].end <= segments[1].start
+    assert 0.5 < segments[1].end - segments[1].start < 1.2
+
+
+def test_vad_ignores_silence():
+    seg = VADSegmenter()
+    assert seg.feed(_silence_pcm(2.0)) == []
+    assert seg.flush() == []
+
+
+@patch("asr.main.transcribe_hf", new_callable=AsyncMock,
+       side_effect=[{"text": "hello there"}, {"text": "how are you"}])
+def test_websocket_streams_partials_and_stitched_final(mock_hf):
+    stream = _tone_pcm(0.6) + _silence_pcm(0.6) + _tone_pcm(0.6)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_bytes(stream)
+        first = ws.receive_json()
+        assert first["type"] == "partial"
+        assert first["text"] == "hello there"
+        ws.send_text("DONE")
+        msgs = [ws.receive_json(), ws.receive_json()]
+    final = msgs[-1]
+    assert final["type"] == "final"
+    assert final["text"] == "hello there how are you"
+    assert [s["id"] for s in final["segments"]] == [0, 1]
+    assert mock_hf.await_count == 2
+
+
+
+def test_container_streams_are_detected():
+    assert is_container(b"\x1aE\xdf\xa3" + b"\x00" * 8)           # WebM (MediaRecorder)
+    assert is_container(b"OggS\x00\x02") and is_container(pcm_to_wav(b"\x00\x00"))
+    assert not is_container(_tone_pcm(0.1))
+
+
+@patch("asr.main.decoder_available", return_value=False)
+@patch("asr.main.transcribe_hf", new_callable=AsyncMock, return_value={"text": "hello there"})
+def test_websocket_container_without_ffmpeg_is_transcribed_whole(mock_hf, _):
+    wav = pcm_to_wav(_tone_pcm(0.6))
+    with client.websocket_connect("/ws") as ws:
+        for off in range(0, len(wav), 4000):                      # MediaRecorder-style chunks
+            ws.send_bytes(wav[off:off + 4000])
+        ws.send_text("DONE")
+        final = ws.receive_json()
+    assert final["type"] == "final" and final["text"] == "hello there"
+    assert mock_hf.await_count == 1
+
+
+@pytest.mark.skipif(not decoder_available(), reason="ffmpeg not installed")
+@patch("asr.main.transcribe_hf", new_callable=AsyncMock,
+       side_effect=[{"text": "hello there"}, {"text": "how are you"}])
+def test_websocket_decodes_container_stream_before_vad(mock_hf):
+    wav = pcm_to_wav(_tone_pcm(0.6) + _silence_pcm(0.6) + _tone_pcm(0.6))
+    with client.websocket_connect("/ws") as ws:
+        for off in range(0, len(wav), 4000):
+            ws.send_bytes(wav[off:off + 4000])
+        ws.send_text("DONE")
+        msgs = [ws.receive_json() for _ in range(3)]
+    assert msgs[-1]["type"] == "final" and msgs[-1]["text"] == "hello there how are you"
+
+# ── Micro-batching ───────────────────────────────────────────────────────────
+
+@pytest.mark.asyncio
+async def test_batcher_groups_concurrent_requests():
+    sizes = []
+
+    def run_batch(items):
+        sizes.append(len(items))
+        return [i * 10 for i in items]
+
+    batcher = MicroBatcher(run_batch, lambda: None, window_ms=50, max_batch=4)
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+    await batcher.close()
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert sizes == [4, 2]
+
+
+@pytest.mark.asyncio
+async def test_batcher_rejects_when_queue_full():
+    batcher = MicroBatcher(lambda items: items, lambda: None, window_ms=50, max_batch=1, max_queue=1)
+    first = asyncio.ensure_future(batcher.submit(1))
+    await asyncio.sleep(0)                    # queued, worker not yet scheduled
+    with pytest.raises(QueueFullError):
+        await batcher.submit(2)
+    assert await first == 1
+    await batcher.close()
+
+
 # ── ASR Accuracy Benchmark ───────────────────────────────────────────────────
 # Run separately with: pytest -k benchmark --benchmark
 BENCHMARK_PAIRS = [
@@ -2,7 +2,17 @@
 import pytest
 from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
-from coach.main import app, _rule_based_feedback
+import asyncio
+import json
+import re
+from datetime import date, datetime, timedelta
+from coach.main import app, _rule_based_feedback, _rules_fast_path, call_llama, call_llama_pack
+from coach.batch import parse_pack_output
+from coach.streaming import FieldStream
+from coach.router import AllProvidersFailed, Provider, ProviderRouter
+from coach.rules import rule_engine
+from coach.sessions import SessionWriter
+from coach.cache import FeedbackCache, feedback_cache
 
 client = TestClient(app)
 
@@ -67,6 +77,450 @@ def test_coach_empty_transcript():
     assert resp.status_code == 400
 
 
+# ── Feedback Cache ───────────────────────────────────────────────────────────
+
+def test_cache_key_normalizes_transcript():
+    a = FeedbackCache.key("She don't like coffee.", "beginner", "v1")
+    b = FeedbackCache.key("  she  DON'T like coffee ", "beginner", "v1")
+    assert a == b
+    assert a != FeedbackCache.key("She don't like coffee.", "advanced", "v1")
+    assert a != FeedbackCache.key("She don't like coffee.", "beginner", "v2")
+
+
+def test_cache_lru_and_ttl():
+    cache = FeedbackCache(max_entries=2, ttl=60)
+    cache.put("a", {"score": 1})
+    cache.put("b", {"score": 2})
+    cache.get("a")
+    cache.put("c", {"score": 3})          # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == {"score": 1}
+
+    expired = FeedbackCache(ttl=0)
+    expired.put("a", {"score": 1})
+    assert expired.get("a") is None
+    assert expired.stats()["misses"] == 1
+
+
+def test_cache_disk_tier_survives_restart(tmp_path):
+    FeedbackCache(disk_dir=str(tmp_path)).put("k" * 64, MOCK_FEEDBACK)
+    fresh = FeedbackCache(disk_dir=str(tmp_path))
+    assert fresh.get("k" * 64) == MOCK_FEEDBACK
+    assert fresh.stats()["disk_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_call_llama_served_from_cache():
+    feedback_cache.clear()
+    with patch("coach.main.router.generate", new_callable=AsyncMock, return_value=MOCK_FEEDBACK) as mock_hf:
+        first = await call_llama("Yesterday I visit my grandmother.", "beginner")
+        second = await call_llama("yesterday i visit my grandmother", "beginner")
+    assert first == second == MOCK_FEEDBACK
+    assert mock_hf.await_count == 1
+
+
+# ── Rule Engine ──────────────────────────────────────────────────────────────
+
+def test_rule_engine_is_compiled_from_hundreds_of_rules():
+    assert len(rule_engine) >= 300
+    check = rule_engine.check("He don't like informations and I didn't went there since 3 years.")
+    assert check.feedback["correction"] == "He doesn't like information and I didn't go there for 3 years."
+    assert {"grammar", "vocabulary"} <= set(check.feedback["tags"])
+
+
+def test_rule_engine_respects_context_and_confidence():
+    assert rule_engine.check("Does he go to school on Monday?").matches == []
+    assert rule_engine.check("We visited an hour-long show at a university.").matches == []
+    assert rule_engine.check("It was a apple.").feedback["correction"] == "It was an apple."
+    assert rule_engine.check("Yesterday I visit my grandmother.").confidence == 0.0   # nothing it can vouch for
+    assert rule_engine.check("um I think so").confidence < 0.9                       # a filler alone doesn't skip the LLM
+
+
+@pytest.mark.asyncio
+async def test_confident_rules_skip_the_llm():
+    feedback_cache.clear()
+    with patch("coach.main.router.generate", new_callable=AsyncMock) as llm:
+        result = await call_llama("She play tennis every day.", "beginner")
+    assert result["correction"] == "She plays tennis every day."
+    llm.assert_not_awaited()
+
+
+@pytest.mark.parametrize("sentence", [
+    "I live in Monday Street near the station.",
+    "The teacher insisted that he have lunch first.",
+    "In my book the letter I is always a capital.",
+    "The peoples of Europe share a long history.",
+    "The river fishes are small and silver.",
+    "She was married with two children by then.",
+])
+def test_valid_sentences_do_not_take_the_fast_path(sentence):
+    assert _rules_fast_path(sentence) is None
+
+
+@pytest.mark.asyncio
+async def test_agreement_rules_stand_aside_for_past_time():
+    assert rule_engine.check("Yesterday he go to school.").feedback["correction"] is None
+    assert rule_engine.check("Two days ago she play tennis.").matches == []
+    feedback_cache.clear()
+    with patch("coach.main.router.generate", new_callable=AsyncMock, return_value=MOCK_FEEDBACK) as llm:
+        await call_llama("Yesterday he go to school.", "beginner")
+    llm.assert_awaited_once()
+
+
+# ── Batch Coaching ───────────────────────────────────────────────────────────
+
+def _pack_output(ids):
+    return json.dumps([{"id": i, **MOCK_FEEDBACK} for i in ids])
+
+
+def test_parse_pack_output_keeps_complete_items():
+    truncated = _pack_output([1, 2])[:-1] + ', {"id": 3, "explanation": "cut o'
+    parsed = parse_pack_output(truncated, 3)
+    assert sorted(parsed) == [0, 1]
+    assert parsed[0]["score"] == 7 and parsed[1]["tags"] == ["grammar"]
+
+
+@pytest.mark.asyncio
+async def test_pack_retries_only_missing_items():
+    feedback_cache.clear()
+    async def generate(system, user, max_tokens=220, parse=None):
+        return parse(_pack_output([1, 3]))
+
+    with patch("coach.main.router.generate", side_effect=generate), \
+         patch("coach.main.call_llama", new_callable=AsyncMock, return_value={**MOCK_FEEDBACK, "score": 2}) as single:
+        results = await call_llama_pack(["one", "two", "three"], "beginner")
+    assert [r["score"] for r in results] == [7, 2, 7]
+    single.assert_awaited_once_with("two", "beginner")
+
+
+@patch("coach.main.save_session", new_callable=AsyncMock)
+@patch("coach.main.get_user_levels", new_callable=AsyncMock, return_value={"u1": "beginner", "u2": "advanced"})
+def test_batch_endpoint_streams_every_item(mock_levels, mock_save):
+    feedback_cache.clear()
+    items = [{"user_id": "u1", "transcript": f"I goes to school {i}"} for i in range(5)]
+    items += [{"user_id": "u2", "transcript": "Me and him was late"}, {"user_id": "u2", "transcript": "  "}]
+
+    async def fake_generate(system, user, max_tokens=220, parse=None):
+        return parse(_pack_output(range(1, len(re.findall(r"^\d+\. ", user, re.M)) + 1)))
+
+    with patch("coach.main.router.generate", side_effect=fake_generate) as gen:
+        resp = client.post("/batch", json={"items": items})
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(7))
+    assert next(line for line in lines if line["index"] == 6)["error"]
+    assert all(line["feedback"]["score"] == 7 for line in lines if line["index"] != 6)
+    assert gen.await_count == 3                      # u1: packs of 4 + 1, u2: 1
+    mock_levels.assert_awaited_once()
+
+
+
+@patch("coach.main.save_session", new_callable=AsyncMock)
+@patch("coach.main.get_user_levels", new_callable=AsyncMock, return_value={"u1": "beginner"})
+def test_batch_malformed_item_falls_back_without_ending_stream(mock_levels, mock_save):
+    feedback_cache.clear()
+    items = [{"user_id": "u1", "transcript": f"Yesterday I visit my grandmother {i}"} for i in range(3)]
+
+    async def fake_pack(transcripts, level):
+        return [MOCK_FEEDBACK, {"correction": None, "score": "7/10"}, MOCK_FEEDBACK]
+
+    with patch("coach.main.call_llama_pack", side_effect=fake_pack):
+        resp = client.post("/batch", json={"items": items})
+    lines = sorted((json.loads(line) for line in resp.text.splitlines()), key=lambda line: line["index"])
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["feedback"]["score"] == MOCK_FEEDBACK["score"]
+    assert 1 <= lines[1]["feedback"]["score"] <= 10 and lines[1]["feedback"]["explanation"]
+    assert mock_save.await_count == 3
+
+# ── Streaming ────────────────────────────────────────────────────────────────
+
+def test_field_stream_emits_each_field_when_complete():
+    text = 'Sure! {"correction": "She plays, \\"daily\\".", "vocabulary": ["a", "b"], "score": 7}'
+    parser, seen = FieldStream(), []
+    for i, ch in enumerate(text):
+        for field, value in parser.feed(ch):
+            seen.append((field, value, i))
+    assert [f for f, _, _ in seen] == ["correction", "vocabulary", "score"]
+    assert seen[0][1] == 'She plays, "daily".'
+    assert seen[0][2] < text.index('"vocabulary"')      # emitted before the next field started
+    assert parser.done
+
+
+def _sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _token_stream(text, fail_at=None):
+    async def stream(system, user, max_tokens=220):
+        for i in range(0, len(text), 5):
+            if fail_at is not None and i >= fail_at:
+                raise RuntimeError("connection reset")
+            yield text[i:i + 5]
+    return stream
+
+
+@patch("coach.main.save_session", new_callable=AsyncMock)
+@patch("coach.main.get_user_level", new_callable=AsyncMock, return_value="beginner")
+def test_stream_endpoint_sends_fields_then_done(mock_level, mock_save):
+    feedback_cache.clear()
+    with patch("coach.main.router.stream", side_effect=_token_stream(json.dumps(MOCK_FEEDBACK))):
+        resp = client.post("/stream", json={"user_id": "u1", "transcript": "Yesterday I visit my grandmother."})
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(resp.text)
+    assert [e for e, _ in events] == list(MOCK_FEEDBACK) + ["done"]
+    assert events[-1][1] == MOCK_FEEDBACK
+    assert feedback_cache.stats()["entries"] == 1
+
+
+@patch("coach.main.save_session", new_callable=AsyncMock)
+@patch("coach.main.get_user_level", new_callable=AsyncMock, return_value="beginner")
+def test_broken_stream_fills_missing_fields_from_rules(mock_level, mock_save):
+    feedback_cache.clear()
+    text = json.dumps(MOCK_FEEDBACK)
+    with patch("coach.main.router.stream", side_effect=_token_stream(text, fail_at=text.index('"encouragement"'))):
+        resp = client.post("/stream", json={"user_id": "u1", "transcript": "My brother are happy"})
+    events = dict(_sse_events(resp.text))
+    assert events["correction"] == MOCK_FEEDBACK["correction"]      # from the model
+    assert events["encouragement"] and events["score"] >= 1          # from the rule engine
+    assert set(events["done"]) == set(MOCK_FEEDBACK)
+    assert feedback_cache.stats()["entries"] == 0                    # partial answers aren't cached
+
+
+# ── Provider Routing ─────────────────────────────────────────────────────────
+
+class FakeProvider(Provider):
+    def __init__(self, name, delay=0.0, fail=False):
+        super().__init__()
+        self.name, self.delay, self.fail, self.calls = name, delay, fail, 0
+
+    async def generate(self, system, user, max_tokens):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("503")
+        return json.dumps({**MOCK_FEEDBACK, "explanation": self.name})
+
+
+@pytest.mark.asyncio
+async def test_router_hedges_slow_provider():
+    slow, fast = FakeProvider("slow", delay=2.0), FakeProvider("fast", delay=0.01)
+    router = ProviderRouter([slow, fast])
+    with patch("coach.router.settings.llm_hedge_default_ms", 50), patch("coach.router.settings.llm_hedge_min_ms", 10):
+        start = asyncio.get_running_loop().time()
+        result = await router.generate("sys", "user", parse=json.loads)
+    assert result["explanation"] == "fast"
+    assert asyncio.get_running_loop().time() - start < 0.5
+    assert fast.ewma is not None and slow.ewma is None       # the loser was cancelled, not counted
+    assert router.ranked()[0] is fast                         # and is now preferred
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over_immediately():
+    router = ProviderRouter([FakeProvider("broken", fail=True), FakeProvider("backup", delay=0.01)])
+    start = asyncio.get_running_loop().time()
+    assert (await router.generate("sys", "user", parse=json.loads))["explanation"] == "backup"
+    assert asyncio.get_running_loop().time() - start < 0.5     # no waiting for a hedge timer
+
+
+@pytest.mark.asyncio
+async def test_router_circuit_opens_after_repeated_failures():
+    broken = FakeProvider("broken", fail=True)
+    router = ProviderRouter([broken])
+    with patch("coach.router.settings.llm_breaker_failures", 2):
+        for _ in range(3):
+            with pytest.raises(AllProvidersFailed):
+                await router.generate("sys", "user")
+    assert broken.calls == 2 and router.ranked() == []
+    broken.open_until = 1.0                                   # cooldown elapsed → one trial allowed
+    assert router.ranked() == [broken]
+
+
+@pytest.mark.asyncio
+async def test_router_circuit_opens_for_a_hung_provider():
+    hung = FakeProvider("hung", delay=10.0)
+    router = ProviderRouter([hung])
+    with patch("coach.router.settings.llm_breaker_failures", 2), patch("coach.router.settings.llm_timeout", 0.05):
+        for _ in range(3):
+            with pytest.raises(AllProvidersFailed):
+                await router.generate("sys", "user")
+    assert hung.calls == 2 and router.ranked() == []          # the third call didn't wait on it again
+
+
+@pytest.mark.asyncio
+async def test_router_unusable_output_counts_as_failure():
+    router = ProviderRouter([FakeProvider("a"), FakeProvider("b")])
+
+    def reject(text):
+        raise ValueError("no JSON")
+
+    with pytest.raises(AllProvidersFailed):
+        await router.generate("sys", "user", parse=reject)
+    assert all(p.failures == 1 for p in router.providers)
+
+
+# ── Session Write-behind ─────────────────────────────────────────────────────
+
+@pytest.mark.asyncio
+async def test_session_writer_batches_by_size_and_drains_on_close():
+    batches = []
+    writer = SessionWriter(insert=batches.append, batch_size=3, flush_interval=60)
+    writer.start()
+    for i in range(3):
+        writer.enqueue({"n": i})
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        if batches:
+            break
+    assert [len(b) for b in batches] == [3]             # size-triggered, not waiting for the interval
+    writer.enqueue({"n": 3})
+    await writer.close()
+    assert [r["n"] for b in batches for r in b] == list(range(4)) and len(writer) == 0
+
+
+@pytest.mark.asyncio
+async def test_session_writer_retries_with_backoff_and_keeps_failed_rows():
+    calls = []
+
+    def flaky(rows):
+        calls.append(len(rows))
+        if len(calls) < 3:
+            raise ConnectionError("supabase unavailable")
+
+    writer = SessionWriter(insert=flaky, batch_size=10, retries=1, backoff=0.01)
+    writer.enqueue({"n": 1})
+    assert await writer.flush() == 0 and len(writer) == 1      # two attempts failed, row kept
+    assert writer.lag > 0
+    assert await writer.flush() == 1 and calls == [1, 1, 1]
+
+
+def test_session_writer_caps_memory():
+    writer = SessionWriter(insert=lambda rows: None, batch_size=100, max_pending=3)
+    for i in range(5):
+        writer.enqueue({"n": i})
+    assert len(writer) == 3 and writer.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_session_writer_drops_poison_row_and_writes_the_rest():
+    class FKViolation(Exception):
+        code = "23503"
+
+    written = []
+
+    def insert(rows):
+        if any(r["user_id"] == "mobile-user" for r in rows):
+            raise FKViolation("insert violates foreign key constraint")
+        written.extend(rows)
+
+    writer = SessionWriter(insert=insert, batch_size=50, retries=3, backoff=0.01)
+    for i in range(11):
+        writer.enqueue({"user_id": "mobile-user" if i == 4 else f"u{i}", "n": i})
+    assert await writer.flush() == 10
+    assert sorted(r["n"] for r in written) == [n for n in range(11) if n != 4]
+    assert len(writer) == 0 and writer.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_session_writer_retries_a_stalled_insert():
+    import threading
+    release, calls, written = threading.Event(), [], []
+
+    def insert(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            release.wait(5)                      # hung Supabase call
+        written.extend(rows)
+
+    writer = SessionWriter(insert=insert, batch_size=10, retries=2, backoff=0.01, timeout=0.05)
+    for i in range(3):
+        writer.enqueue({"user_id": f"u{i}"})
+    try:
+        assert await writer.flush() == 3
+    finally:
+        release.set()
+    assert calls == [3, 3] and len(writer) == 0
+
+
+@pytest.fixture
+def history_db(monkeypatch):
+    import common.db as db
+    from common.localdb import LocalSupabase
+    local = LocalSupabase({"coaching_sessions": [
+        {"id": i, "user_id": "u1", "transcript": f"t{i}", "score": 5, "tags": [], "correction": None,
+         "explanation": "long text", "created_at": f"2026-01-0{(i + 1) // 2}T00:00:00+00:00"}
+        for i in range(1, 8)                    # pairs share a timestamp
+    ] + [{"id": 99, "user_id": "u2", "transcript": "other", "created_at": "2026-01-09T00:00:00+00:00"}]})
+    monkeypatch.setattr(db, "get_supabase", lambda: local)
+    return local
+
+
+def test_history_is_newest_first_and_projected(history_db):
+    body = client.get("/history/u1?limit=2").json()
+    assert [s["transcript"] for s in body["sessions"]] == ["t7", "t6"]
+    assert "explanation" not in body["sessions"][0] and "user_id" not in body["sessions"][0]
+    assert body["next_cursor"]
+
+
+def test_history_keyset_pages_cover_everything_once(history_db):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/history/u1", params=params).json()
+        seen += [s["id"] for s in body["sessions"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+
+
+def test_history_bad_cursor_rejected(history_db):
+    assert client.get("/history/u1?cursor=not-a-cursor").status_code == 400
+
+
+def test_history_export_streams_ndjson(history_db, monkeypatch):
+    monkeypatch.setattr("coach.main.settings.history_export_page", 2)
+    resp = client.get("/history/u1/export")
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["id"] for r in rows] == [7, 6, 5, 4, 3, 2, 1]
+
+
+def test_progress_reads_rollups_kept_on_insert(monkeypatch):
+    import common.db as db
+    from common.localdb import LocalSupabase
+    from coach.sessions import _insert_rows
+    local = LocalSupabase()
+    monkeypatch.setattr(db, "get_supabase", lambda: local)
+    monkeypatch.setattr("coach.sessions.get_supabase", lambda: local)
+    today = datetime.utcnow().date()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    _insert_rows([
+        {"user_id": "u1", "transcript": "a", "score": 6, "tags": ["grammar"], "created_at": f"{yesterday}T10:00:00"},
+        {"user_id": "u1", "transcript": "b", "score": 9, "tags": ["grammar", "fluency"], "created_at": f"{today}T08:00:00"},
+    ])
+    _insert_rows([{"user_id": "u1", "transcript": "c", "score": None, "tags": [], "created_at": f"{today}T09:00:00"}])
+    assert len(local.tables["session_rollups"]) == 2
+
+    body = client.get("/progress/u1").json()
+    assert body["sessions"] == 3 and body["mean_score"] == 7.5 and body["best_score"] == 9
+    assert body["streak"] == 2 and body["tags"] == {"grammar": 2, "fluency": 1}
+    assert [d["sessions"] for d in body["daily"]] == [1, 2]
+    assert body["daily"][1]["mean_score"] == 9.0
+
+
+def test_progress_streak_allows_no_session_yet_today():
+    from coach.progress import summarize
+    today = date(2026, 3, 10)
+    rollups = [{"day": d, "sessions": 1, "score_sum": 5, "scored": 1, "best_score": 5, "tag_counts": {}}
+               for d in ("2026-03-06", "2026-03-08", "2026-03-09")]
+    summary = summarize(rollups, days=2, today=today)
+    assert summary["streak"] == 2 and summary["active_days"] == 3
+    assert [d["day"] for d in summary["daily"]] == ["2026-03-09"]
+
 # ── Correctness Checklist (manual evaluation) ─────────────────────────────────
 # For 20 sample transcripts, verify:
 # [ ] Corrections are grammatically accurate
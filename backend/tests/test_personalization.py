@@ -0,0 +1,359 @@
+"""Tests for Personalization (mistake index + recommender)."""
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+import personalization.model as model
+from personalization.model import UserMistakeIndex, EMBED_DIM, ROW_BYTES, embed
+from personalization.registry import IndexRegistry
+from personalization.recommender import recommend_lessons
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model, "INDEX_DIR", tmp_path)
+    return tmp_path
+
+
+MISTAKES = [
+    ("I go to school yesterday.", ["grammar"], 5),
+    ("She don't like coffee.", ["grammar"], 4),
+    ("The weather is very heat today.", ["vocabulary"], 4),
+    ("Um, I, uh, want to say that, you know, it is good.", ["fluency"], 4),
+]
+
+
+def _seeded(user_id="u1") -> UserMistakeIndex:
+    idx = UserMistakeIndex(user_id)
+    for text, tags, score in MISTAKES:
+        idx.add(text, tags, score)
+    return idx
+
+
+def test_embed_is_unit_length():
+    vec = embed("She don't like coffee.")
+    assert vec.dtype.name == "float32"
+    assert vec.shape == (EMBED_DIM,)
+    assert abs(float((vec ** 2).sum()) - 1.0) < 1e-5
+
+
+def test_search_ranks_by_similarity():
+    idx = _seeded()
+    results = idx.search("He don't like tea.", k=2)
+    assert len(results) == 2
+    assert results[0]["text"] == "She don't like coffee."
+    assert results[0]["similarity"] >= results[1]["similarity"]
+
+
+def test_add_appends_vectors_incrementally():
+    idx = _seeded()
+    size = idx.index_path.stat().st_size
+    idx.add("I am agree with you.", ["grammar"], 5)
+    assert idx.index_path.stat().st_size == size + EMBED_DIM * 4
+    assert idx.search("I am agree with him", k=1)[0]["text"] == "I am agree with you."
+
+
+def test_reload_and_backfill_legacy_json(index_dir):
+    legacy = [{"text": t, "tags": g, "score": s} for t, g, s in MISTAKES]
+    (index_dir / "legacy.json").write_text(json.dumps(legacy))
+    idx = UserMistakeIndex("legacy")
+    assert len(idx) == len(MISTAKES)
+    assert idx.search("weather is heat", k=1)[0]["tags"] == ["vocabulary"]
+    assert not (index_dir / "legacy.json").exists()
+    assert len(UserMistakeIndex("legacy")) == len(MISTAKES)   # imported once only
+
+
+def test_concurrent_writers_do_not_lose_adds():
+    a = UserMistakeIndex("shared")
+    b = UserMistakeIndex("shared")
+    a.add("I go to school yesterday.", ["grammar"], 5)
+    b.add("The weather is very heat today.", ["vocabulary"], 4)
+    a.add("She don't like coffee.", ["grammar"], 4)
+    assert len(a) == 3
+    assert len(UserMistakeIndex("shared")) == 3
+    assert a.search("weather heat", k=1)[0]["text"] == "The weather is very heat today."
+
+
+def test_frequent_errors_aggregated_in_store():
+    idx = _seeded()
+    assert idx.frequent_errors(top_n=1) == ["grammar"]
+    assert set(idx.frequent_errors(top_n=5)) == {"grammar", "vocabulary", "fluency"}
+    assert UserMistakeIndex("other").frequent_errors() == []
+
+
+def test_search_empty_index():
+    assert UserMistakeIndex("nobody").search("anything") == []
+
+
+@pytest.mark.asyncio
+async def test_recommend_matches_similar_mistakes():
+    _seeded("u2")
+    with patch("personalization.recommender.get_user_profile", new_callable=AsyncMock,
+               return_value={"level": "beginner", "completed_lessons": []}):
+        lessons = await recommend_lessons("u2", n=1, query="The food is very heat.")
+    assert lessons[0]["area"] == "vocabulary"
+
+
+# ── Index Registry ───────────────────────────────────────────────────────────
+
+@pytest.mark.asyncio
+async def test_registry_serialises_concurrent_adds():
+    registry = IndexRegistry(max_bytes=1 << 20, flush_batch=1000)
+
+    async def add(i):
+        async with registry.acquire("busy") as idx:
+            idx.add(f"Mistake number {i}", ["grammar"], 5, defer=True)
+
+    await asyncio.gather(*(add(i) for i in range(20)))
+    assert registry.stats()["pending"] == 20
+    await registry.close()
+    assert registry.stats()["pending"] == 0
+    assert len(UserMistakeIndex("busy")) == 20
+
+
+@pytest.mark.asyncio
+async def test_registry_evicts_lru_within_budget():
+    registry = IndexRegistry(max_bytes=3 * ROW_BYTES, flush_batch=1000)
+    for user in ("a", "b", "c"):
+        async with registry.acquire(user) as idx:
+            idx.add("I go to school yesterday.", ["grammar"], 5, defer=True)
+            idx.add("She don't like coffee.", ["grammar"], 4, defer=True)
+    stats = registry.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] >= 1
+    assert len(UserMistakeIndex("a")) == 2      # evicted indexes were flushed first
+
+
+# ── Tag Statistics ───────────────────────────────────────────────────────────
+
+def test_tag_weights_decay_over_time():
+    idx = UserMistakeIndex("decay")
+    idx.add("I go to school yesterday.", ["grammar"], 5)
+    week = 7 * 86400
+    store = idx.store
+    (tag, weight), = store.tag_weights("decay", now=time.time() + store.half_life)
+    assert tag == "grammar"
+    assert weight == pytest.approx(0.5, rel=1e-3)
+    assert store.tag_weights("decay", now=time.time() + week)[0][1] > weight
+
+
+def test_tag_weights_many_matches_per_user_reads():
+    first, second = _seeded("m1"), UserMistakeIndex("m2")
+    second.add("He have a car.", ["grammar", "vocabulary"], 3)
+    store, now = first.store, time.time()
+    bulk = store.tag_weights_many(["m2", "m1", "nobody", "m1"], top_n=2, now=now)
+    assert list(bulk) == ["m2", "m1", "nobody"]
+    assert bulk["m1"] == store.tag_weights("m1", top_n=2, now=now)
+    assert bulk["m2"] == store.tag_weights("m2", top_n=2, now=now) and bulk["nobody"] == []
+
+
+def test_recent_mistakes_outrank_old_ones(monkeypatch):
+    idx = UserMistakeIndex("recent")
+    old = time.time() - 60 * 86400
+    monkeypatch.setattr(time, "time", lambda: old)
+    for _ in range(3):
+        idx.add("She don't like coffee.", ["grammar"], 4)
+    monkeypatch.undo()
+    idx.add("The weather is very heat today.", ["vocabulary"], 4)
+    assert idx.store.tag_counts("recent")[0] == ("grammar", 3)
+    assert idx.frequent_errors(top_n=1) == ["vocabulary"]
+
+
+# ── Data access (local stand-in) ─────────────────────────────────────────────
+
+@pytest.fixture
+def local_db(monkeypatch):
+    import common.db as db
+    from common.localdb import LocalSupabase
+    from common.profiles import profile_cache
+    profile_cache.clear()
+    local = LocalSupabase({"profiles": [
+        {"id": "u9", "username": "sam", "level": "intermediate", "completed_lessons": ["g2"], "streak": 3},
+    ]})
+    monkeypatch.setattr(db, "get_supabase", lambda: local)
+    return local
+
+
+@pytest.mark.asyncio
+async def test_profile_fetch_is_projected(local_db):
+    from personalization.recommender import get_user_profile
+    assert await get_user_profile("u9") == {"id": "u9", "level": "intermediate", "completed_lessons": ["g2"]}
+    assert await get_user_profile("missing") == {}
+
+
+@pytest.mark.asyncio
+async def test_mark_lesson_complete_local(local_db):
+    from personalization.recommender import mark_lesson_complete
+    from personalization.recommender import get_user_profile
+    assert (await get_user_profile("u9"))["completed_lessons"] == ["g2"]      # now cached
+    await mark_lesson_complete("u9", "v2")
+    await mark_lesson_complete("u9", "v2")
+    assert local_db.tables["profiles"][0]["completed_lessons"] == ["g2", "v2"]
+    assert (await get_user_profile("u9"))["completed_lessons"] == ["g2", "v2"]
+
+
+@pytest.mark.asyncio
+async def test_complete_lessons_is_atomic_and_bulk(local_db):
+    from personalization.recommender import complete_lessons
+    results = await asyncio.gather(
+        complete_lessons("u9", ["v1", "g2"]),
+        complete_lessons("u9", ["p1", "v1", "p1"]),
+    )
+    profile = local_db.tables["profiles"][0]
+    assert sorted(profile["completed_lessons"]) == ["g2", "p1", "v1"]
+    assert profile["completed_lessons"][0] == "g2"
+    assert profile["streak"] == 1 and profile["total_sessions"] == 1     # once per day
+    assert results[1]["completed_lessons"] == profile["completed_lessons"] or \
+        results[0]["completed_lessons"] == profile["completed_lessons"]
+    assert await complete_lessons("nobody", ["g1"]) is None
+
+
+def test_db_backend_is_supabase_unless_local_is_explicit(monkeypatch):
+    import common.db as db
+    from common.localdb import LocalSupabase
+    created = []
+    monkeypatch.setattr(db, "create_client", lambda url, key: created.append((url, key)) or "client")
+    monkeypatch.setattr(db.settings, "supabase_url", "")
+    monkeypatch.setattr(db.settings, "supabase_key", "")
+    db.get_supabase.cache_clear()
+    try:
+        with pytest.raises(RuntimeError):                    # no silent fallback to the stand-in
+            db.get_supabase()
+        monkeypatch.setattr(db.settings, "supabase_url", "https://example.supabase.co")
+        monkeypatch.setattr(db.settings, "supabase_key", "anon")
+        assert db.get_supabase() == "client" and created == [("https://example.supabase.co", "anon")]
+        db.get_supabase.cache_clear()
+        monkeypatch.setattr(db.settings, "db_backend", "local")
+        assert isinstance(db.get_supabase(), LocalSupabase)
+    finally:
+        db.get_supabase.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_db_execute_times_out(local_db):
+    import common.db as db
+
+    class Slow:
+        def execute(self):
+            time.sleep(0.3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await db.execute(lambda sb: Slow(), timeout=0.05)
+
+
+# ── Profile cache ────────────────────────────────────────────────────────────
+
+@pytest.mark.asyncio
+async def test_profile_cache_single_flight_and_ttl():
+    from common.profiles import ProfileCache
+    calls = []
+
+    async def load(user_id):
+        calls.append(user_id)
+        await asyncio.sleep(0.02)
+        return {"id": user_id, "level": "advanced"}
+
+    cache = ProfileCache(load=load, ttl=0.1)
+    results = await asyncio.gather(*(cache.get("u1") for _ in range(10)))
+    assert calls == ["u1"] and all(r["level"] == "advanced" for r in results)
+    await cache.get("u1")
+    assert cache.stats()["hit"] == 1 and cache.stats()["shared"] == 9
+    await asyncio.sleep(0.12)
+    await cache.get("u1")
+    assert calls == ["u1", "u1"]
+
+
+@pytest.mark.asyncio
+async def test_profile_cache_invalidation_and_bound():
+    from common.profiles import ProfileCache
+    version = {"n": 0}
+
+    async def load(user_id):
+        n = version["n"]                       # read, then slow to return
+        await asyncio.sleep(0.02)
+        return {"id": user_id, "n": n}
+
+    cache = ProfileCache(load=load, max_entries=2)
+    fetch = asyncio.create_task(cache.get("u1"))
+    await asyncio.sleep(0)
+    version["n"] = 1
+    cache.invalidate("u1")                     # profile changed while the old value was in flight
+    assert (await fetch)["n"] == 0
+    assert (await cache.get("u1"))["n"] == 1
+    for user_id in ("u2", "u3"):
+        await cache.get(user_id)
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_profile_cache_get_many_fetches_only_misses():
+    from common.profiles import ProfileCache
+    batches = []
+
+    async def load(user_id):
+        return {"id": user_id, "level": "beginner"}
+
+    async def load_many(user_ids):
+        batches.append(list(user_ids))
+        return {u: {"id": u, "level": "advanced"} for u in user_ids if u != "ghost"}
+
+    cache = ProfileCache(load=load, load_many=load_many)
+    await cache.get("u1")
+    profiles = await cache.get_many(["u1", "u2", "ghost", "u2"])
+    assert batches == [["u2", "ghost"]]
+    assert profiles["u1"]["level"] == "beginner" and profiles["u2"]["level"] == "advanced"
+    assert profiles["ghost"] == {}
+    await cache.get_many(["ghost"])
+    assert len(batches) == 1
+
+
+# ── Lesson catalogue ─────────────────────────────────────────────────────────
+
+def test_catalogue_rank_prefers_weak_areas_then_catalogue_order():
+    from personalization.catalogue import BUILTIN_LESSONS, CatalogueSnapshot
+    snap = CatalogueSnapshot(BUILTIN_LESSONS)
+    assert [lesson["id"] for lesson in snap.lookup("grammar", "beginner")] == ["g1"]
+    ranked = snap.rank(
+        ["beginner", "beginner", "advanced", "expert"],
+        [set(), {"f1"}, {"g3"}, set()],
+        [["fluency", "vocabulary"], ["fluency", "unknown"], [], ["grammar"]],
+        n=3,
+    )
+    assert [lesson["id"] for lesson in ranked[0]] == ["f1", "v1", "g1"]
+    assert [lesson["id"] for lesson in ranked[1]] == ["g1", "v1", "p1"]
+    assert [lesson["id"] for lesson in ranked[2]] == ["v3", "p3", "f3"]
+    assert ranked[3] == []
+    assert ranked[0][0] == {"id": "f1", "title": "Filler Words & Hesitations", "area": "fluency", "level": "beginner"}
+
+
+@pytest.mark.asyncio
+async def test_catalogue_reloads_from_db_only_on_change(local_db):
+    from personalization.catalogue import LessonCatalogue
+    catalogue = LessonCatalogue()
+    builtin = catalogue.version
+    assert await catalogue.reload() is False                 # empty table keeps the built-in catalogue
+    local_db.tables["lessons"] = [
+        {"id": "x1", "title": "Small Talk", "area": "fluency", "level": "beginner", "content": {}},
+        {"id": "x2", "title": "Articles", "area": "grammar", "level": "beginner", "content": {}},
+    ]
+    assert await catalogue.reload() is True
+    assert catalogue.version != builtin and catalogue.stats()["source"] == "database"
+    assert await catalogue.reload() is False
+    local_db.tables["lessons"][0]["title"] = "Small Talk Basics"
+    assert await catalogue.reload() is True
+
+
+@pytest.mark.asyncio
+async def test_recommend_batch_uses_profiles_and_mistakes(local_db):
+    from personalization.recommender import recommend_many
+    from personalization.registry import mistake_registry
+    local_db.tables["profiles"].append({"id": "u10", "level": "beginner", "completed_lessons": ["g1"]})
+    _seeded("u10")
+    loaded = mistake_registry.stats()["indexes"]
+    results = await recommend_many(["u9", "u10", "ghost", "u9"], n=2)
+    assert list(results) == ["u9", "u10", "ghost"]
+    assert all(lesson["level"] == "intermediate" for lesson in results["u9"]) and "g2" not in [lesson["id"] for lesson in results["u9"]]
+    assert {lesson["area"] for lesson in results["u10"]} == {"vocabulary", "fluency"} and "g1" not in [lesson["id"] for lesson in results["u10"]]
+    assert [lesson["id"] for lesson in results["ghost"]] == ["g1", "v1"]
+    assert mistake_registry.stats()["indexes"] == loaded       # batch reads never load indexes
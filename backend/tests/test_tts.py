@@ -1,7 +1,13 @@
 """Tests for TTS microservice."""
+import asyncio
 import pytest
+import numpy as np
 from fastapi.testclient import TestClient
-from tts.main import app, parse_ssml
+from tts.main import app, parse_ssml, split_text
+from unittest.mock import patch, AsyncMock
+from tts.pool import TTSPool
+from tts.cache import AudioCache
+from tts import encode as tts_encode
 
 client = TestClient(app)
 
@@ -61,6 +67,218 @@ def test_parse_ssml_prosody():
     assert "<prosody" not in result
 
 
+# ── Worker Pool ──────────────────────────────────────────────────────────────
+
+class FakeEngine:
+    name = "fake"
+    sample_rate = 16000
+    inits = 0
+
+    def __init__(self, worker_id):
+        FakeEngine.inits += 1
+
+    def render(self, text, voice, speed):
+        return np.full(len(text) * 100, 0.25, dtype=np.float32)
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_initialised_engines():
+    FakeEngine.inits = 0
+    pool = TTSPool(size=2, engine_cls=FakeEngine)
+    wavs = await asyncio.gather(*(pool.synthesize(f"hello {i}", "af_heart", 1.0) for i in range(6)))
+    stats = pool.stats()
+    pool.shutdown()
+    assert FakeEngine.inits == 2
+    assert all(w[:4] == b"RIFF" and len(w) > 1000 for w in wavs)
+    assert stats["queue_depth"] == 0 and stats["workers"] == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_caps_workers_for_single_engine_backends():
+    class SharedEngine(FakeEngine):
+        max_workers = 1
+
+    pool = TTSPool(size=4, engine_cls=SharedEngine)
+    await asyncio.gather(*(pool.synthesize(f"hi {i}", "af_heart", 1.0) for i in range(3)))
+    stats = pool.stats()
+    pool.shutdown()
+    assert stats["workers"] == 1
+
+
+# ── Audio Cache ──────────────────────────────────────────────────────────────
+
+def test_audio_cache_key_and_byte_budget():
+    assert AudioCache.key("Great  job! ", "af_heart", 1.0, "mp3") == AudioCache.key("Great job!", "af_heart", 1.0, "MP3")
+    assert AudioCache.key("Great job!", "af_heart", 1.0, "mp3") != AudioCache.key("Great job!", "am_adam", 1.0, "mp3")
+    cache = AudioCache(max_bytes=250)
+    for k in "abc":
+        cache.put(k, b"x" * 100, "audio/wav")
+    assert cache.get("a") is None                  # evicted to stay under 250 bytes
+    assert cache.get("c") == (b"x" * 100, "audio/wav")
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_audio_cache_disk_tier(tmp_path):
+    AudioCache(max_bytes=1000, disk_dir=str(tmp_path)).put("k" * 64, b"RIFFdata", "audio/wav")
+    fresh = AudioCache(max_bytes=1000, disk_dir=str(tmp_path))
+    assert fresh.get("k" * 64) == (b"RIFFdata", "audio/wav")
+
+
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+@patch("tts.main.tts_pool.render", new_callable=AsyncMock, return_value=(np.full(1000, 0.25, dtype=np.float32), 16000))
+def test_repeated_phrase_served_from_cache_with_etag(mock_render):
+    body = {"text": "Well done!", "format": "wav"}
+    first = client.post("/", json=body)
+    second = client.post("/", json=body)
+    assert first.headers["x-cache"] == "MISS" and second.headers["x-cache"] == "HIT"
+    assert first.content[44:] == second.content[44:]     # same PCM; only the streamed header's sizes differ
+    assert mock_render.await_count == 1
+    assert "max-age" in second.headers["cache-control"]
+    revalidated = client.get("/", params=body, headers={"If-None-Match": second.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+# ── Streaming ────────────────────────────────────────────────────────────────
+
+def test_split_text_sentences_and_clauses():
+    chunks = split_text("Great effort today. When you describe the past, use the past tense; "
+                        "for example, say 'I went' rather than 'I go'. Ok!")
+    assert chunks[0] == "Great effort today."
+    assert "When you describe the past," in chunks
+    assert chunks[-1].endswith("Ok!") and len(chunks[-1]) > 3      # short tail merged, not spoken alone
+    assert split_text("Hi.") == ["Hi."]
+
+
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+def test_streams_each_clause_as_it_renders():
+    rendered = []
+
+    async def fake_render(text, voice, speed):
+        rendered.append(text)
+        return np.full(len(text) * 10, 0.5, dtype=np.float32), 16000
+
+    text = "This is the first sentence. And this is the second one, with a clause."
+    with patch("tts.main.tts_pool.render", side_effect=fake_render):
+        resp = client.post("/", json={"text": text, "format": "wav"})
+    assert resp.status_code == 200 and resp.headers["x-cache"] == "MISS"
+    assert rendered == split_text(text) and len(rendered) == 3
+    assert resp.content[:4] == b"RIFF" and resp.content[40:44] == b"\xff\xff\xff\xff"
+    assert len(resp.content) == 44 + 2 * sum(len(t) * 10 for t in rendered)
+
+
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+def test_first_clause_failure_is_a_server_error():
+    from tts.pool import QueueFullError
+    with patch("tts.main.tts_pool.render", new_callable=AsyncMock, side_effect=RuntimeError("engine died")):
+        assert client.post("/", json={"text": "Hello there, friend.", "format": "wav"}).status_code == 500
+    with patch("tts.main.tts_pool.render", new_callable=AsyncMock, side_effect=QueueFullError("full")):
+        assert client.post("/", json={"text": "Hello there, friend.", "format": "wav"}).status_code == 503
+
+
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+def test_later_clause_failure_aborts_the_stream():
+    from tts.main import StreamAborted, audio_cache
+    calls = []
+
+    async def fake_render(text, voice, speed):
+        calls.append(text)
+        if len(calls) == 2:
+            raise RuntimeError("engine died")
+        return np.full(160, 0.5, dtype=np.float32), 16000
+
+    text = "This is the first sentence. And this is the second one, with a clause."
+    with patch("tts.main.tts_pool.render", side_effect=fake_render), pytest.raises(StreamAborted):
+        client.post("/", json={"text": text, "format": "wav"})
+    assert audio_cache.get(audio_cache.key(text, "af_heart", 1.0, "wav")) is None
+
+
+def test_empty_text_rejected_before_synthesis():
+    assert client.post("/", json={"text": "   ", "format": "wav"}).status_code == 400
+
+
+# ── Output Encoding ──────────────────────────────────────────────────────────
+
+def test_format_names():
+    assert tts_encode.normalize_format("MP3") == "mp3"
+    assert tts_encode.normalize_format("ogg") == "opus"
+    assert tts_encode.normalize_format("flac") is None
+    assert client.post("/", json={"text": "Hello", "format": "flac"}).status_code == 400
+
+
+@pytest.mark.skipif(not tts_encode.encoder_available(), reason="ffmpeg not installed")
+@pytest.mark.parametrize("fmt", ["mp3", "opus"])
+def test_compressed_output_is_smaller(fmt):
+    audio = np.sin(np.linspace(0, 2000, 24000)).astype(np.float32) * 0.5
+    data = asyncio.run(tts_encode.encode(audio, 24000, fmt))
+    tts_encode.shutdown_encoder()
+    assert 0 < len(data) < len(tts_encode.wav_bytes(audio, 24000)) // 4
+
+
+class FakeStreamEncoder:
+    """Stands in for ffmpeg: each written clause comes back as one "frame"."""
+    instances = []
+
+    def __init__(self, sample_rate, fmt):
+        self.out, self.writes, self.closed = bytearray(), 0, False
+        FakeStreamEncoder.instances.append(self)
+
+    async def start(self):
+        pass
+
+    async def write(self, audio):
+        self.writes += 1
+        self.out += b"\xff\xfb" + b"m" * len(audio)
+
+    def ready(self):
+        data, self.out = bytes(self.out), bytearray()
+        return data
+
+    async def finish(self):
+        return b"pad"
+
+    async def close(self):
+        self.closed = True
+
+
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+@patch("tts.main.output_format", lambda fmt: fmt)
+@patch("tts.main.StreamEncoder", FakeStreamEncoder)
+@patch("tts.main.tts_pool.render", new_callable=AsyncMock, return_value=(np.zeros(50, dtype=np.float32), 16000))
+def test_mp3_streamed_through_one_encoder_and_cached(mock_render):
+    FakeStreamEncoder.instances = []
+    body = {"text": "First clause is here, and the second follows.", "format": "mp3"}
+    first = client.post("/", json=body)
+    assert first.headers["content-type"] == "audio/mpeg"
+    assert first.content == (b"\xff\xfb" + b"m" * 50) * 2 + b"pad"
+    (encoder,) = FakeStreamEncoder.instances
+    assert encoder.writes == 2 and encoder.closed
+    second = client.post("/", json=body)
+    assert second.headers["x-cache"] == "HIT" and second.content == first.content
+
+
+@pytest.mark.skipif(not tts_encode.encoder_available(), reason="ffmpeg not installed")
+@patch("tts.main.audio_cache", AudioCache(max_bytes=1 << 20))
+def test_streamed_mp3_duration_matches_clauses():
+    import subprocess
+    lengths = []
+
+    async def fake_render(text, voice, speed):
+        audio = (np.sin(np.arange(len(text) * 400) / 8) * 0.3).astype(np.float32)
+        lengths.append(audio.size)
+        return audio, 16000
+
+    text = "One clause is here, then another one, and a third one; a fourth. A fifth one, and the sixth."
+    with patch("tts.main.tts_pool.render", side_effect=fake_render):
+        resp = client.post("/", json={"text": text, "format": "mp3"})
+    assert resp.status_code == 200 and len(lengths) >= 5
+    pcm = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", "16000", "pipe:1"],
+        input=resp.content, capture_output=True, check=True,
+    ).stdout
+    # one encoder delay + final padding in total (< 2 frames), not one per clause
+    assert abs(len(pcm) // 2 - sum(lengths)) < 2 * 1152
+
+
 # ── TTS Naturalness Checklist (manual) ──────────────────────────────────────
 # Run: python -m pytest backend/tests/test_tts.py -v
 # Then listen to output WAVs and rate:
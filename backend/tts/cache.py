@@ -0,0 +1,143 @@
+"""
+Synthesized-audio cache, keyed by sha256(normalized text | voice | speed | format).
+
+  • in-memory LRU bounded by total bytes (hot phrases: encouragements, titles)
+  • disk tier, one file per key, bounded by total bytes (oldest pruned first)
+The key doubles as the HTTP ETag, so browsers and CDNs can revalidate cheaply.
+"""
+
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from prometheus_client import Counter
+
+from common.config import settings
+
+logger = logging.getLogger("tts.cache")
+
+CACHE_HITS = Counter("tts_cache_hits_total", "TTS audio cache hits", ["tier"])
+CACHE_MISSES = Counter("tts_cache_misses_total", "TTS audio cache misses")
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class AudioCache:
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._mem: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self.disk_dir.glob("*/*.audio"))
+
+    @staticmethod
+    def key(text: str, voice: str, speed: float, fmt: str) -> str:
+        raw = f"{normalize_text(text)}\x1f{voice}\x1f{round(speed, 2)}\x1f{fmt.lower()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.audio"
+
+    def get(self, key: str) -> Optional[tuple[bytes, str]]:
+        """(audio bytes, media type) or None."""
+        entry = self._mem.get(key)
+        if entry is not None:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            CACHE_HITS.labels(tier="memory").inc()
+            return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._remember(key, entry)
+            self.disk_hits += 1
+            CACHE_HITS.labels(tier="disk").inc()
+            return entry
+        self.misses += 1
+        CACHE_MISSES.inc()
+        return None
+
+    def put(self, key: str, audio: bytes, media_type: str):
+        self._remember(key, (audio, media_type))
+        if self.disk_dir:
+            self._disk_put(key, audio, media_type)
+
+    def _remember(self, key: str, entry: tuple[bytes, str]):
+        if len(entry[0]) > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old[0])
+        self._mem[key] = entry
+        self._mem_bytes += len(entry[0])
+        while self._mem_bytes > self.max_bytes:
+            _, (audio, _) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(audio)
+
+    # Disk entries are "<media type>\n<audio bytes>".
+    def _disk_get(self, key: str) -> Optional[tuple[bytes, str]]:
+        if not self.disk_dir:
+            return None
+        try:
+            data = self._disk_path(key).read_bytes()
+        except OSError:
+            return None
+        media_type, _, audio = data.partition(b"\n")
+        return audio, media_type.decode()
+
+    def _disk_put(self, key: str, audio: bytes, media_type: str):
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(media_type.encode() + b"\n" + audio)
+            os.replace(tmp, path)
+            self._disk_bytes += len(audio) + len(media_type) + 1
+        except OSError as e:
+            logger.warning(f"Disk audio cache write failed: {e}")
+            return
+        if self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = sorted(self.disk_dir.glob("*/*.audio"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for p in files:
+            if total <= target:
+                break
+            size = p.stat().st_size
+            p.unlink(missing_ok=True)
+            total -= size
+        self._disk_bytes = total
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._mem),
+            "bytes": self._mem_bytes,
+            "disk_bytes": self._disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+audio_cache = AudioCache(
+    max_bytes=settings.tts_cache_bytes,
+    disk_dir=settings.tts_cache_dir or None,
+    disk_max_bytes=settings.tts_cache_disk_bytes,
+)
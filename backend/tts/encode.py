@@ -0,0 +1,184 @@
+"""
+Output encoding for synthesized speech.
+
+  wav   16-bit PCM, built in-process
+  mp3   libmp3lame at `tts_mp3_bitrate`
+  opus  Opus in Ogg at `tts_opus_bitrate` ("ogg" is accepted as an alias)
+
+Whole clips are encoded by ffmpeg subprocesses waited on from a small thread
+pool, so neither the event loop nor the TTS worker threads block on an
+encoder. A streamed response feeds every clause into ONE ffmpeg process
+(`StreamEncoder`) and forwards its output as it arrives: one encoder means one
+priming delay and one final padding, so clause boundaries play without gaps.
+The bytes saved against the equivalent WAV are counted per format.
+"""
+
+import asyncio
+import logging
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from prometheus_client import Counter
+
+from common.config import settings
+from tts.pool import pcm16, wav_bytes
+
+logger = logging.getLogger("tts.encode")
+
+MEDIA_TYPES = {"wav": "audio/wav", "mp3": "audio/mpeg", "opus": "audio/ogg"}
+ALIASES = {"ogg": "opus"}
+
+BYTES_SAVED = Counter("tts_bytes_saved_total", "Bytes saved by compressed TTS output vs. WAV", ["format"])
+ENCODED_BYTES = Counter("tts_encoded_bytes_total", "Bytes of encoded TTS output", ["format"])
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+class EncodeError(RuntimeError):
+    """The encoder is unavailable or failed."""
+
+
+def normalize_format(fmt: str) -> Optional[str]:
+    """Canonical format name, or None when unsupported."""
+    fmt = ALIASES.get(fmt.lower(), fmt.lower())
+    return fmt if fmt in MEDIA_TYPES else None
+
+
+@lru_cache(maxsize=1)
+def encoder_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def output_format(fmt: str) -> str:
+    """The format that will actually be produced — WAV when ffmpeg is missing."""
+    return fmt if fmt == "wav" or encoder_available() else "wav"
+
+
+def _ffmpeg_args(sample_rate: int, fmt: str, bitrate: str) -> list[str]:
+    """s16le mono PCM on stdin → mp3 / Ogg-Opus on stdout."""
+    codec = (["-c:a", "libmp3lame", "-f", "mp3"] if fmt == "mp3"
+             else ["-c:a", "libopus", "-application", "voip", "-f", "ogg"])
+    return ["ffmpeg", "-nostdin", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+            *codec, "-b:a", bitrate, "pipe:1"]
+
+
+def _bitrate(fmt: str) -> str:
+    return settings.tts_mp3_bitrate if fmt == "mp3" else settings.tts_opus_bitrate
+
+
+def _count(fmt: str, pcm_bytes: int, encoded_bytes: int):
+    ENCODED_BYTES.labels(format=fmt).inc(encoded_bytes)
+    BYTES_SAVED.labels(format=fmt).inc(max(0, pcm_bytes + 44 - encoded_bytes))
+
+
+def encode_sync(pcm: bytes, sample_rate: int, fmt: str, bitrate: str) -> bytes:
+    """s16le mono PCM → mp3 / Ogg-Opus bytes. Runs in a pool thread."""
+    return subprocess.run(
+        _ffmpeg_args(sample_rate, fmt, bitrate),
+        input=pcm, capture_output=True, check=True, timeout=60,
+    ).stdout
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.tts_encode_workers, thread_name_prefix="tts-encode")
+    return _pool
+
+
+async def encode(audio: np.ndarray, sample_rate: int, fmt: str) -> bytes:
+    """Encode float32 mono samples; raises EncodeError on failure."""
+    if fmt == "wav":
+        return wav_bytes(audio, sample_rate)
+    if not encoder_available():
+        raise EncodeError("ffmpeg not found")
+    pcm = pcm16(audio)
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(_get_pool(), encode_sync, pcm, sample_rate, fmt, _bitrate(fmt))
+    except (OSError, subprocess.SubprocessError) as e:
+        raise EncodeError(f"{fmt} encoding failed: {e}") from e
+    _count(fmt, len(pcm), len(data))
+    return data
+
+
+class StreamEncoder:
+    """
+    One ffmpeg process per streamed response: clauses are written in as they
+    render and the encoded stream is collected as ffmpeg produces it.
+    """
+
+    def __init__(self, sample_rate: int, fmt: str):
+        self.sample_rate = sample_rate
+        self.fmt = fmt
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._buffer = bytearray()
+        self._pcm_bytes = 0
+        self._encoded_bytes = 0
+
+    async def start(self):
+        if not encoder_available():
+            raise EncodeError("ffmpeg not found")
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                *_ffmpeg_args(self.sample_rate, self.fmt, _bitrate(self.fmt)),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError as e:
+            raise EncodeError(f"{self.fmt} encoder failed to start: {e}") from e
+        self._reader = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        # read concurrently with the writes, so a full stdout pipe never stalls ffmpeg
+        while chunk := await self._proc.stdout.read(8192):
+            self._buffer += chunk
+
+    async def write(self, audio: np.ndarray):
+        pcm = pcm16(audio)
+        try:
+            self._proc.stdin.write(pcm)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise EncodeError(f"{self.fmt} encoder exited early: {e}") from e
+        self._pcm_bytes += len(pcm)
+
+    def ready(self) -> bytes:
+        """Encoded bytes produced so far and not yet taken."""
+        data, self._buffer = bytes(self._buffer), bytearray()
+        self._encoded_bytes += len(data)
+        return data
+
+    async def finish(self) -> bytes:
+        """Close the input and return the rest of the stream (encoder padding included)."""
+        if not self._proc.stdin.is_closing():
+            self._proc.stdin.close()
+        await self._reader
+        code = await self._proc.wait()
+        if code != 0:
+            raise EncodeError(f"{self.fmt} encoding failed (ffmpeg exit {code})")
+        data = self.ready()
+        _count(self.fmt, self._pcm_bytes, self._encoded_bytes)
+        return data
+
+    async def close(self):
+        if self._reader is not None and not self._reader.done():
+            self._reader.cancel()
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+        self._proc = None
+
+
+def shutdown_encoder():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -1,8 +1,20 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import io, os, re, asyncio, logging
+import asyncio, re, logging
+from collections import deque
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+from common.config import settings
+from tts.pool import QueueFullError, tts_pool, pcm16, wav_bytes, wav_stream_header
+from tts.cache import audio_cache
+from tts.encode import (
+    MEDIA_TYPES, EncodeError, StreamEncoder, encode, encoder_available, normalize_format, output_format,
+)
 
 logger = logging.getLogger("tts")
 
@@ -20,6 +32,25 @@ def parse_ssml(text):
     text = re.sub(r'<[^>]+>', '', text)
     return text.strip()
 
+def split_text(text, min_chars=12):
+    """Split into sentences, then clauses, merging fragments shorter than
+    `min_chars` into the next piece so prosody doesn't get choppy."""
+    pieces = []
+    for sentence in re.split(r'(?<=[.!?…])\s+', text.strip()):
+        pieces.extend(p for p in re.split(r'(?<=[,;:—])\s+', sentence) if p.strip())
+    chunks, buf = [], ""
+    for piece in pieces:
+        buf = f"{buf} {piece}".strip() if buf else piece
+        if len(buf) >= min_chars:
+            chunks.append(buf)
+            buf = ""
+    if buf:
+        if chunks and len(buf) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {buf}"
+        else:
+            chunks.append(buf)
+    return chunks
+
 class TTSRequest(BaseModel):
     text: str
     ssml: bool = False
@@ -29,7 +60,13 @@ class TTSRequest(BaseModel):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "kokoro": False}
+    return {
+        "status": "ok",
+        "kokoro": tts_pool.engine_name == "kokoro",
+        "pool": tts_pool.stats(),
+        "cache": audio_cache.stats(),
+        "encoder": encoder_available(),
+    }
 
 @app.get("/voices")
 async def voices():
@@ -38,29 +75,207 @@ async def voices():
         {"id": "am_adam",  "name": "Adam (Male, American)"},
     ]}
 
-@app.post("/")
-async def synthesize(req: TTSRequest):
-    text = parse_ssml(req.text) if req.ssml else req.text
+class PrewarmRequest(BaseModel):
+    phrases: list[str]
+    voice: str = "af_heart"
+    speed: float = 1.0
+    format: str = "mp3"
+
+
+_inflight: dict[str, asyncio.Future] = {}
+
+
+class StreamAborted(RuntimeError):
+    """A clause failed mid-stream; raised so the connection is reset, not ended cleanly."""
+
+
+async def _render(text: str, voice: str, speed: float, fmt: str) -> tuple[bytes, str]:
     try:
-        import pyttsx3, tempfile
-        def _run():
-            engine = pyttsx3.init()
-            engine.setProperty("rate", 150)
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-                path = f.name
-            engine.save_to_file(text, path)
-            engine.runAndWait()
-            with open(path, "rb") as f:
-                data = f.read()
-            os.unlink(path)
-            return data
-        audio = await asyncio.get_event_loop().run_in_executor(None, _run)
-        media_type = "audio/wav"
+        audio, rate = await tts_pool.render(text, voice, speed)
     except Exception as e:
         logger.error(f"TTS failed: {e}")
-        audio = b""
-        media_type = "audio/wav"
+        return b"", "audio/wav"
+    try:
+        return await encode(audio, rate, fmt), MEDIA_TYPES[fmt]
+    except EncodeError as e:
+        logger.warning(f"{e}; sending WAV")
+        return wav_bytes(audio, rate), "audio/wav"
+
+
+async def get_audio(text: str, voice: str, speed: float, fmt: str) -> tuple[bytes, str, str, bool]:
+    """(audio, media type, cache key, hit). Concurrent misses for one key render once."""
+    fmt = normalize_format(fmt) or "mp3"
+    key = audio_cache.key(text, voice, speed, fmt)
+    cached = audio_cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1], key, True
+    pending = _inflight.get(key)
+    if pending is not None:
+        audio, media_type = await asyncio.shield(pending)
+        return audio, media_type, key, False
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        audio, media_type = await _render(text, voice, speed, fmt)
+        if audio:
+            audio_cache.put(key, audio, media_type)
+        future.set_result((audio, media_type))
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        _inflight.pop(key, None)
+    return audio, media_type, key, False
+
+
+async def _stream(text: str, voice: str, speed: float, fmt: str, key: str) -> AsyncIterator[bytes]:
+    """
+    Render clause by clause and yield audio as soon as each piece is ready;
+    up to `tts_stream_lookahead` pieces render ahead of the one being sent.
+    WAV goes out as raw PCM per clause; mp3 and Ogg/Opus come from one ffmpeg
+    process fed every clause in turn (see tts/encode.py), so the encoded
+    stream has no gaps at clause boundaries. The full output is then cached.
+    A failed clause raises StreamAborted: a truncated file must not look complete.
+    """
+    chunks = iter(split_text(text))
+    pending: deque[asyncio.Task] = deque()
+
+    def _schedule():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            pending.append(asyncio.create_task(tts_pool.render(chunk, voice, speed)))
+
+    for _ in range(max(1, settings.tts_stream_lookahead)):
+        _schedule()
+    samples, sent, rate = [], [], None
+    encoder: Optional[StreamEncoder] = None
+    try:
+        while pending:
+            try:
+                audio, rate = await pending.popleft()
+                _schedule()
+                if fmt == "wav":
+                    data = (b"" if samples else wav_stream_header(rate)) + pcm16(audio)
+                else:
+                    if encoder is None:
+                        encoder = StreamEncoder(rate, fmt)
+                        await encoder.start()
+                    await encoder.write(audio)
+                    data = encoder.ready()
+            except Exception as e:
+                logger.error(f"TTS chunk {len(samples) + 1} failed: {e}")
+                raise StreamAborted(f"clause {len(samples) + 1} failed") from e
+            samples.append(audio)
+            if data:
+                sent.append(data)
+                yield data
+        if not samples:
+            return
+        if fmt == "wav":
+            full = wav_bytes(np.concatenate(samples), rate)
+        else:
+            try:
+                data = await encoder.finish()
+            except EncodeError as e:
+                logger.error(str(e))
+                raise StreamAborted("encoder failed") from e
+            if data:
+                sent.append(data)
+                yield data
+            full = b"".join(sent)
+        audio_cache.put(key, full, MEDIA_TYPES[fmt])
+    finally:
+        for task in pending:
+            task.cancel()
+        if encoder is not None:
+            await encoder.close()
+
+
+async def _respond(request: Request, text: str, voice: str, speed: float, fmt: str) -> Response:
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="Text is empty.")
+    fmt = normalize_format(fmt)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported format; use one of {', '.join(MEDIA_TYPES)}.")
+    key = audio_cache.key(text, voice, speed, fmt)
+    etag = f'W/"{key}"'           # weak: a streamed and a cached copy differ only in WAV header sizes
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={settings.tts_cache_max_age}, immutable"}
+    if key in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    cached = audio_cache.get(key)
+    if cached is None and key in _inflight:
+        cached = await asyncio.shield(_inflight[key])      # being pre-warmed right now
+    if cached is not None:
+        audio, media_type = cached
+        if audio:
+            return Response(content=audio, media_type=media_type, headers={**headers, "X-Cache": "HIT"})
+
+    out = output_format(fmt)
+    body = _stream(text, voice, speed, out, key)
+    try:
+        first = await body.__anext__()         # nothing sent yet, so a failure can still be a 5xx
+    except StopAsyncIteration:
+        first = b""
+    except StreamAborted as e:
+        status = 503 if isinstance(e.__cause__, QueueFullError) else 500
+        raise HTTPException(status_code=status, detail="Speech synthesis failed.")
     return StreamingResponse(
-        io.BytesIO(audio),
-        media_type=media_type
+        _prepend(first, body),
+        media_type=MEDIA_TYPES[out],
+        headers={**headers, "X-Cache": "MISS"},
     )
+
+
+async def _prepend(first: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    try:
+        if first:
+            yield first
+        async for data in rest:
+            yield data
+    finally:
+        await rest.aclose()
+
+
+@app.post("/")
+async def synthesize(req: TTSRequest, request: Request):
+    text = parse_ssml(req.text) if req.ssml else req.text
+    return await _respond(request, text, req.voice, req.speed, req.format)
+
+
+# GET twin of POST / — cacheable by browsers and CDNs.
+@app.get("/")
+async def synthesize_get(request: Request, text: str, voice: str = "af_heart",
+                         speed: float = 1.0, format: str = "mp3", ssml: bool = False):
+    text = parse_ssml(text) if ssml else text
+    return await _respond(request, text, voice, speed, format)
+
+
+async def prewarm(phrases: list[str], voice: str = "af_heart", speed: float = 1.0, fmt: str = "mp3") -> int:
+    """Render any phrases that aren't cached yet; returns how many were rendered."""
+    rendered = 0
+    for phrase in phrases:
+        if phrase.strip():
+            _, _, _, hit = await get_audio(phrase, voice, speed, fmt)
+            rendered += not hit
+    return rendered
+
+
+async def prewarm_from_file(path: Optional[str] = None) -> int:
+    path = path or settings.tts_prewarm_file
+    if not path:
+        return 0
+    try:
+        phrases = Path(path).read_text().splitlines()
+    except OSError as e:
+        logger.warning(f"TTS pre-warm list unreadable: {e}")
+        return 0
+    rendered = await prewarm(phrases)
+    logger.info(f"TTS pre-warm rendered {rendered} of {len(phrases)} phrases")
+    return rendered
+
+
+@app.post("/prewarm")
+async def prewarm_endpoint(req: PrewarmRequest):
+    rendered = await prewarm(req.phrases, req.voice, req.speed, req.format)
+    return {"requested": len(req.phrases), "rendered": rendered}
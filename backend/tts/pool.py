@@ -0,0 +1,215 @@
+"""
+TTS worker pool — a fixed set of threads, each owning an engine that was
+initialised once when the worker started:
+  • Kokoro: resident KPipeline (Settings.kokoro_lang), renders straight to a
+    float32 array in memory
+  • pyttsx3: always ONE worker — pyttsx3.init() caches its engine per driver,
+    so threads would share one non-thread-safe engine; it can only write to a
+    file, so the worker reuses a single scratch file on tmpfs (/dev/shm)
+    instead of creating and deleting a temp file per request
+Jobs wait in a shared queue whose depth is exposed for /health and metrics.
+"""
+
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+import queue
+import struct
+import tempfile
+import threading
+import wave
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from prometheus_client import Gauge
+
+from common.config import settings
+
+logger = logging.getLogger("tts.pool")
+
+QUEUE_DEPTH = Gauge("tts_queue_depth", "TTS jobs waiting for a worker")
+
+
+class QueueFullError(RuntimeError):
+    """Raised when `max_queue` synthesis jobs are already waiting."""
+
+
+class KokoroEngine:
+    name = "kokoro"
+    sample_rate = 24000
+    max_workers: Optional[int] = None
+
+    def __init__(self, worker_id: int):
+        from kokoro import KPipeline
+        self.pipeline = KPipeline(lang_code=settings.kokoro_lang)
+
+    def render(self, text: str, voice: str, speed: float) -> np.ndarray:
+        chunks = [np.asarray(audio, dtype=np.float32) for _, _, audio in self.pipeline(text, voice=voice, speed=speed)]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+
+class Pyttsx3Engine:
+    name = "pyttsx3"
+    sample_rate = 22050          # espeak default; the real rate is read from the file
+    max_workers = 1              # pyttsx3.init() returns the same engine to every thread
+
+    def __init__(self, worker_id: int):
+        import pyttsx3
+        self.engine = pyttsx3.init()
+        scratch_dir = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+        self.path = str(scratch_dir / f"tts-{os.getpid()}-{worker_id}.wav")
+
+    def render(self, text: str, voice: str, speed: float) -> np.ndarray:
+        self.engine.setProperty("rate", int(150 * speed))
+        self.engine.save_to_file(text, self.path)
+        self.engine.runAndWait()
+        with wave.open(self.path) as wf:
+            self.sample_rate = wf.getframerate()
+            channels = wf.getnchannels()
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2")
+        if channels > 1:
+            pcm = pcm.reshape(-1, channels).mean(axis=1)
+        return pcm.astype(np.float32) / 32768.0
+
+
+def pick_engine():
+    name = settings.tts_engine.lower()
+    if name == "auto":
+        name = "kokoro" if importlib.util.find_spec("kokoro") else "pyttsx3"
+    return KokoroEngine if name == "kokoro" else Pyttsx3Engine
+
+
+def pcm16(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wav_bytes(audio: np.ndarray, sample_rate: int) -> bytes:
+    """In-memory 16-bit PCM WAV."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm16(audio))
+    return buf.getvalue()
+
+
+def wav_stream_header(sample_rate: int) -> bytes:
+    """WAV header for a stream of unknown length (sizes set to the maximum),
+    which browsers play progressively as PCM arrives."""
+    return b"".join([
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16),
+        b"data", struct.pack("<I", 0xFFFFFFFF),
+    ])
+
+
+class TTSPool:
+    def __init__(self, size: int = 1, max_queue: int = 32, engine_cls=None):
+        self.size = size
+        self.max_queue = max_queue
+        self.engine_cls = engine_cls
+        self._jobs: queue.Queue = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._ready = 0
+        self.busy = 0
+        self._count_lock = threading.Lock()
+        self.engine_name: Optional[str] = None
+
+    def start(self):
+        """Spawn workers; each initialises its engine before taking jobs."""
+        if self._threads:
+            return
+        engine_cls = self.engine_cls or pick_engine()
+        self.engine_name = engine_cls.name
+        size = self.size
+        max_workers = getattr(engine_cls, "max_workers", None)
+        if max_workers is not None and size > max_workers:
+            logger.warning(f"{engine_cls.name} supports {max_workers} TTS worker(s); ignoring tts_workers={size}")
+            size = max_workers
+        for i in range(size):
+            t = threading.Thread(target=self._work, args=(i, engine_cls), name=f"tts-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def depth(self) -> int:
+        return self._jobs.qsize()
+
+    def _work(self, worker_id: int, engine_cls):
+        engine, init_error = None, None
+        try:
+            engine = engine_cls(worker_id)
+            with self._count_lock:
+                self._ready += 1
+        except Exception as e:
+            init_error = e
+            logger.error(f"TTS worker {worker_id} failed to initialise {engine_cls.name}: {e}")
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            QUEUE_DEPTH.set(self._jobs.qsize())
+            loop, future, text, voice, speed = job
+            with self._count_lock:
+                self.busy += 1
+            result, error = None, None
+            try:
+                if engine is None:
+                    raise RuntimeError(f"TTS engine unavailable: {init_error}")
+                result = (engine.render(text, voice, speed), engine.sample_rate)
+            except Exception as e:
+                error = e
+            finally:
+                with self._count_lock:
+                    self.busy -= 1
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                pass                      # caller's loop already closed
+
+    async def render(self, text: str, voice: str, speed: float) -> tuple[np.ndarray, int]:
+        """Synthesize on a worker; returns (float32 mono samples, sample rate)."""
+        self.start()
+        if self._jobs.qsize() >= self.max_queue:
+            raise QueueFullError(f"TTS queue full ({self.max_queue} waiting)")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((loop, future, text, voice, speed))
+        QUEUE_DEPTH.set(self._jobs.qsize())
+        return await future
+
+    async def synthesize(self, text: str, voice: str, speed: float) -> bytes:
+        """Synthesize to an in-memory WAV."""
+        audio, rate = await self.render(text, voice, speed)
+        return wav_bytes(audio, rate)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        self._threads = []
+        self._ready = 0
+
+    def stats(self) -> dict:
+        return {
+            "engine": self.engine_name,
+            "workers": len(self._threads),
+            "ready": self._ready,
+            "busy": self.busy,
+            "queue_depth": self.depth,
+        }
+
+
+def _resolve(future: asyncio.Future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+tts_pool = TTSPool(size=settings.tts_workers, max_queue=settings.tts_max_queue)
@@ -16,11 +16,12 @@ const BADGES = [
 
 export default function ProfilePage() {
   const [history, setHistory] = useState([]);
+  const [progress, setProgress] = useState(EMPTY_PROGRESS);
   const [loading, setLoading] = useState(true);
   const userId = typeof window !== "undefined"
     ? localStorage.getItem("user_id") || "demo-user" : "demo-user";
 
-  useEffect(() => { fetchHistory(); }, []);
+  useEffect(() => { fetchHistory(); fetchProgress(); }, []);
 
   async function fetchHistory() {
     try {
@@ -31,11 +32,18 @@ export default function ProfilePage() {
     finally  { setLoading(false); }
   }
 
-  const avgScore = history.length
-    ? Math.round(history.reduce((s, h) => s + (h.score || 0), 0) / history.length)
-    : 0;
+  // Totals come from the server-side daily rollups, not from the 20 sessions above
+  async function fetchProgress() {
+    try {
+      const res = await fetch(`${API}/coach/progress/${userId}`);
+      if (res.ok) setProgress(await res.json());
+      else setProgress(DEMO_PROGRESS);
+    } catch { setProgress(DEMO_PROGRESS); }
+  }
+
+  const avgScore = progress.mean_score ? Math.round(progress.mean_score) : 0;
 
-  const earnedBadges = computeBadges(history);
+  const earnedBadges = computeBadges(progress);
 
   return (
     <>
@@ -52,10 +60,10 @@ export default function ProfilePage() {
 
         {/* Stats */}
         <section className="stats">
-          <StatCard value={history.length} label="Sessions" />
+          <StatCard value={progress.sessions} label="Sessions" />
           <StatCard value={avgScore || "—"} label="Avg Score" />
           <StatCard value={earnedBadges.length} label="Badges" />
-          <StatCard value={computeStreak(history)} label="Day Streak 🔥" />
+          <StatCard value={progress.streak} label="Day Streak 🔥" />
         </section>
 
         {/* Badges */}
@@ -165,35 +173,22 @@ function scoreColor(s) {
   return "#ff6e6e";
 }
 
-function computeBadges(history) {
+function computeBadges(progress) {
   const badges = [];
-  if (history.length >= 1)  badges.push("first_session");
-  if (history.length >= 10) badges.push("sessions_10");
-  if (history.length >= 50) badges.push("sessions_50");
-  if (history.some((h) => h.score >= 9)) badges.push("score_9");
-  const streak = computeStreak(history);
-  if (streak >= 3) badges.push("streak_3");
-  if (streak >= 7) badges.push("streak_7");
+  if (progress.sessions >= 1)  badges.push("first_session");
+  if (progress.sessions >= 10) badges.push("sessions_10");
+  if (progress.sessions >= 50) badges.push("sessions_50");
+  if (progress.best_score >= 9) badges.push("score_9");
+  if (progress.streak >= 3) badges.push("streak_3");
+  if (progress.streak >= 7) badges.push("streak_7");
   return badges;
 }
 
-function computeStreak(history) {
-  if (!history.length) return 0;
-  const dates = [...new Set(history.map((h) =>
-    new Date(h.created_at || Date.now()).toDateString()
-  ))].reverse();
-  let streak = 0;
-  let current = new Date();
-  for (const d of dates) {
-    const day = new Date(d);
-    const diff = Math.round((current - day) / 86400000);
-    if (diff <= 1) { streak++; current = day; }
-    else break;
-  }
-  return streak;
-}
+const EMPTY_PROGRESS = { sessions: 0, mean_score: null, best_score: null, streak: 0, tags: {}, daily: [] };
 
 const DEMO_HISTORY = [
   { score: 7, transcript: "I go to school yesterday.", correction: "I went to school yesterday.", tags: ["grammar"], created_at: new Date().toISOString() },
   { score: 9, transcript: "She is very beautiful and kind.", correction: null, tags: ["fluency"], created_at: new Date(Date.now() - 86400000).toISOString() },
 ];
+
+const DEMO_PROGRESS = { sessions: 2, mean_score: 8, best_score: 9, streak: 2, tags: { grammar: 1, fluency: 1 }, daily: [] };
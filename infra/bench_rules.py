@@ -0,0 +1,57 @@
+"""
+infra/bench_rules.py
+Throughput of the coach rule engine (backend/coach/rules.py) — how many
+transcripts per second it checks, and how often it is confident enough to
+answer without an LLM call.
+Run: python infra/bench_rules.py [seconds]
+"""
+
+import sys, os, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from common.config import settings
+from coach.rules import rule_engine
+
+SENTENCES = [
+    "I go to school yesterday.",
+    "She don't like coffee.",
+    "He is more taller than me.",
+    "They was at home last night.",
+    "I am very exciting about the trip.",
+    "I need to make my homework.",
+    "Um, I, uh, want to say that, you know, it is good.",
+    "I speak English since five years.",
+    "Yesterday I visited my grandmother and we cooked dinner together.",
+    "Can you explain me the informations about the course?",
+    "My sister work in a hospital and she have two childs.",
+    "I didn't went to the party because I was tired.",
+    "We discussed about the project in the meeting on Monday.",
+    "This is the most best day of my life!",
+    "I would like to improve my pronunciation before my interview.",
+    "Does he play football every weekend?",
+]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    print(f"{len(rule_engine)} rules compiled into one pattern ({len(rule_engine.pattern.pattern)} chars)")
+
+    for s in SENTENCES:
+        rule_engine.check(s)                       # warm-up
+
+    checked = fast = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for s in SENTENCES:
+            fast += rule_engine.check(s).confidence >= settings.coach_rules_threshold
+        checked += len(SENTENCES)
+    elapsed = time.perf_counter() - start
+
+    print(f"{checked} sentences in {elapsed:.2f}s → {checked / elapsed:,.0f} sentences/sec "
+          f"({elapsed / checked * 1e6:.1f} µs each)")
+    print(f"Fast path (confidence ≥ {settings.coach_rules_threshold}): {fast / checked:.0%} of this mix")
+
+
+if __name__ == "__main__":
+    main()
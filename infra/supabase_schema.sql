@@ -47,9 +47,70 @@ create table public.coaching_sessions (
   created_at  timestamptz default now()
 );
 
-create index idx_sessions_user_id    on public.coaching_sessions(user_id);
+-- History pages are keyset reads: where user_id = $1 and (created_at, id) < cursor
+-- order by created_at desc, id desc — one range scan on this index, however deep.
+create index idx_sessions_user_created
+  on public.coaching_sessions(user_id, created_at desc, id desc);
 create index idx_sessions_created_at on public.coaching_sessions(created_at desc);
 
+-- ── session_rollups ──────────────────────────────────────────
+-- Per-user, per-day progress kept current by a trigger on coaching_sessions,
+-- so dashboards read a handful of rows instead of scanning history.
+-- mean score = score_sum / scored; tag_counts = {"grammar": 3, ...}
+create table public.session_rollups (
+  user_id     uuid not null references public.profiles(id) on delete cascade,
+  day         date not null,                  -- UTC
+  sessions    int  not null default 0,
+  score_sum   int  not null default 0,
+  scored      int  not null default 0,        -- sessions that had a score
+  best_score  smallint,
+  tag_counts  jsonb not null default '{}',
+  primary key (user_id, day)
+);
+
+create or replace function public.merge_counts(a jsonb, b jsonb)
+returns jsonb language sql immutable as $$
+  select coalesce(jsonb_object_agg(k, coalesce((a->>k)::int, 0) + coalesce((b->>k)::int, 0)), '{}')
+  from (select jsonb_object_keys(a) union select jsonb_object_keys(b)) keys(k);
+$$;
+
+-- Statement-level, so a bulk insert from the write-behind queue costs one
+-- upsert per (user, day) rather than one per row.
+create or replace function public.rollup_sessions()
+returns trigger language plpgsql security definer as $$
+begin
+  insert into public.session_rollups as r
+    (user_id, day, sessions, score_sum, scored, best_score, tag_counts)
+  select b.user_id, b.day, b.sessions, b.score_sum, b.scored, b.best_score,
+         coalesce(t.tag_counts, '{}')
+  from (
+    select user_id, (created_at at time zone 'utc')::date as day,
+           count(*) as sessions, coalesce(sum(score), 0) as score_sum,
+           count(score) as scored, max(score) as best_score
+    from new_rows group by 1, 2
+  ) b
+  left join (
+    select user_id, day, jsonb_object_agg(tag, n) as tag_counts
+    from (
+      select user_id, (created_at at time zone 'utc')::date as day, tag, count(*) as n
+      from new_rows, unnest(tags) as tag group by 1, 2, 3
+    ) per_tag group by 1, 2
+  ) t using (user_id, day)
+  on conflict (user_id, day) do update set
+    sessions   = r.sessions + excluded.sessions,
+    score_sum  = r.score_sum + excluded.score_sum,
+    scored     = r.scored + excluded.scored,
+    best_score = greatest(r.best_score, excluded.best_score),
+    tag_counts = public.merge_counts(r.tag_counts, excluded.tag_counts);
+  return null;
+end;
+$$;
+
+create trigger on_coaching_sessions_inserted
+  after insert on public.coaching_sessions
+  referencing new table as new_rows
+  for each statement execute procedure public.rollup_sessions();
+
 -- ── lessons ──────────────────────────────────────────────────
 create table public.lessons (
   id          text primary key,               -- e.g. 'g1', 'p2'
@@ -80,6 +141,7 @@ insert into public.lessons (id, title, area, level) values
 alter table public.profiles         enable row level security;
 alter table public.coaching_sessions enable row level security;
 alter table public.lessons           enable row level security;
+alter table public.session_rollups   enable row level security;
 
 -- Profiles: users can only read/write their own row
 create policy "users own profile"
@@ -93,6 +155,11 @@ create policy "users own sessions"
   using (auth.uid() = user_id)
   with check (auth.uid() = user_id);
 
+-- Rollups: users can read their own (written only by the trigger)
+create policy "users read own rollups"
+  on public.session_rollups for select
+  using (auth.uid() = user_id);
+
 -- Lessons: readable by everyone
 create policy "lessons are public"
   on public.lessons for select
@@ -128,3 +195,35 @@ begin
   end if;
 end;
 $$;
+
+-- ── Lesson completion ────────────────────────────────────────
+-- One round trip, atomic: appends the lesson IDs not already completed
+-- (in the order given), then bumps the streak / total_sessions through
+-- update_streak. Concurrent calls for one user serialise on the row lock,
+-- so no completion is lost. Pass several IDs to sync offline completions.
+-- Called via supabase.rpc('complete_lessons', {p_user_id, p_lesson_ids}).
+
+create or replace function complete_lessons(p_user_id uuid, p_lesson_ids text[])
+returns table (completed_lessons text[], streak int, total_sessions int)
+language plpgsql as $$
+begin
+  update public.profiles p
+  set completed_lessons = coalesce(p.completed_lessons, '{}') || array(
+        select l.id
+        from unnest(p_lesson_ids) with ordinality as l(id, pos)
+        where l.id <> all(coalesce(p.completed_lessons, '{}'))
+        group by l.id
+        order by min(l.pos))
+  where p.id = p_user_id;
+
+  if not found then
+    return;
+  end if;
+
+  perform update_streak(p_user_id);
+
+  return query
+    select p.completed_lessons, p.streak, p.total_sessions
+    from public.profiles p where p.id = p_user_id;
+end;
+$$;